@@ -0,0 +1,169 @@
+"""离线flow回放基准
+
+从夹具文件加载录制的flow, 在进程内依次驱动 Proxy_service_mkey_163_com 的各个hook,
+统计每个hook的耗时分位数与内存分配, 并输出JSON基线文件用于回归对比. 全程无需网络.
+
+python -m Src.Proxy.flow_replay -n 2000 -o baseline.json
+python -m Src.Proxy.flow_replay --compare baseline.json
+"""
+
+import argparse
+import base64
+import importlib.util
+import json
+import platform
+import time
+import tracemalloc
+from pathlib import Path
+
+from mitmproxy import http, version
+from mitmproxy.test import tflow
+
+_PLUGIN_PATH = Path(__file__).parent / "plugin" / "MITM_4_service_mkey_163_com.py"
+_FIXTURE_PATH = Path(__file__).parent / "fixtures" / "replay_flows.json"
+
+# 回放顺序与mitmproxy一致
+HOOKS = ("requestheaders", "request", "responseheaders", "response")
+
+
+def load_plugin():
+    """按mitmdump加载脚本的方式从文件加载插件模块"""
+    spec = importlib.util.spec_from_file_location("mitm_plugin", _PLUGIN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _body(record: dict) -> bytes:
+    """夹具中的消息体: json / content(文本) / content_b64 / content_size(填充字节)"""
+    if "json" in record:
+        return json.dumps(record["json"], ensure_ascii=False).encode()
+    if "content" in record:
+        return record["content"].encode()
+    if "content_b64" in record:
+        return base64.b64decode(record["content_b64"])
+    return b"\0" * record.get("content_size", 0)
+
+
+def build_flow(fixture: dict) -> http.HTTPFlow:
+    """根据夹具构建一个全新的flow, 每次回放都需要新的flow"""
+    req, resp = fixture["request"], fixture["response"]
+    host = req["headers"].get("Host", "service.mkey.163.com")
+    flow = tflow.tflow()
+    flow.request = http.Request.make(
+        req["method"], f"https://{host}{req['path']}", _body(req), req["headers"]
+    )
+    flow.response = http.Response.make(
+        resp.get("status_code", 200), _body(resp), resp.get("headers", {})
+    )
+    return flow
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def replay(fixtures: list[dict], iterations: int = 1000, warmup: int = 50) -> dict:
+    """回放所有夹具, 返回 {flow名: {hook: 统计}}"""
+    plugin = load_plugin()
+    addon = plugin.Proxy_service_mkey_163_com()
+    # 回放时丢弃插件事件, 避免输出到标准输出影响计时
+    plugin.events.set_sink(lambda event: None)
+
+    results = {}
+    for fixture in fixtures:
+        hooks = [(name, getattr(addon, name)) for name in HOOKS]
+        timings = {name: [] for name in HOOKS}
+
+        # 计时: 预热后逐hook计时
+        for i in range(warmup + iterations):
+            flow = build_flow(fixture)
+            for name, hook in hooks:
+                start = time.perf_counter_ns()
+                hook(flow)
+                elapsed = time.perf_counter_ns() - start
+                if i >= warmup:
+                    timings[name].append(elapsed)
+
+        # 内存分配: 单独一轮开启tracemalloc, 避免影响计时
+        alloc_peak = {name: 0 for name in HOOKS}
+        alloc_rounds = max(1, iterations // 10)
+        tracemalloc.start()
+        for _ in range(alloc_rounds):
+            flow = build_flow(fixture)
+            for name, hook in hooks:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                hook(flow)
+                alloc_peak[name] += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+
+        stats = {}
+        for name in HOOKS:
+            values = sorted(timings[name])
+            stats[name] = {
+                "p50_us": _percentile(values, 0.50) / 1000,
+                "p90_us": _percentile(values, 0.90) / 1000,
+                "p99_us": _percentile(values, 0.99) / 1000,
+                "mean_us": sum(values) / len(values) / 1000,
+                "alloc_peak_bytes": alloc_peak[name] // alloc_rounds,
+            }
+        results[fixture["name"]] = stats
+
+    plugin.events.set_sink(None)
+    return results
+
+
+def compare(results: dict, baseline: dict):
+    """与基线对比, 打印p50/p99的变化比例"""
+    print(f"{'flow':<24}{'hook':<17}{'p50':>10}{'Δp50':>9}{'p99':>10}{'Δp99':>9}")
+    for flow_name, hooks in results.items():
+        base_hooks = baseline.get(flow_name, {})
+        for hook, stats in hooks.items():
+            base = base_hooks.get(hook)
+
+            def delta(key: str) -> str:
+                if not base or not base[key]:
+                    return "-"
+                return f"{(stats[key] / base[key] - 1) * 100:+.0f}%"
+
+            print(
+                f"{flow_name:<24}{hook:<17}"
+                f"{stats['p50_us']:>8.1f}us{delta('p50_us'):>9}"
+                f"{stats['p99_us']:>8.1f}us{delta('p99_us'):>9}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线flow回放基准")
+    parser.add_argument("-f", "--fixtures", type=Path, default=_FIXTURE_PATH)
+    parser.add_argument("-n", "--iterations", type=int, default=1000)
+    parser.add_argument("-o", "--output", type=Path, help="输出基线JSON文件路径")
+    parser.add_argument("--compare", type=Path, help="与已有基线JSON文件对比")
+    args = parser.parse_args()
+
+    fixtures = json.loads(args.fixtures.read_text(encoding="utf-8"))
+    results = replay(fixtures, args.iterations)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "mitmproxy": version.VERSION,
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+
+    baseline = {}
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))["results"]
+    compare(results, baseline)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"基线已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
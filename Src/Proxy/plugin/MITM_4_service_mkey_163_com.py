@@ -4,11 +4,36 @@ This module contains plugins for modifying HTTPS traffic for the service.mkey.16
 功能：修改游戏登录相关API的请求/响应，添加cv参数，管理登录渠道和二维码登录状态
 """
 
+import functools
 import json
+import os
+import queue
 import re
-from urllib.parse import urlencode
+import socket
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+from urllib.parse import quote_plus, unquote_to_bytes
+
+from mitmproxy import command, ctx, http
+from mitmproxy.proxy import layer, layers
+
+# 安装了orjson时自动使用更快的JSON后端
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
 
-from mitmproxy import http
 
 # 常量开始
 loginMethod = [
@@ -81,10 +106,504 @@ ExceptAddCVHeaderPaths = [
     r"/mpay/api/reverify",
 ]
 
+# 请求路由: (路由名, 路径正则), 命中任一路由的请求均不添加cv参数
+RequestRoutes = [
+    ("qrcode_create", r"/mpay/api/qrcode/create_login"),
+    ("qrcode_login", r"/mpay/api/users/login/qrcode/exchange_token"),
+    *(("except_cv", path) for path in ExceptAddCVHeaderPaths),
+]
+# 响应路由: (路由名, 路径正则), 路由名对应 _handle_{路由名} 处理方法
+ResponseRoutes = [
+    ("pc_config", r"/mpay/games/pc_config"),
+    ("login_methods", r"/mpay/games/.*/login_methods"),
+    # 对于 h55 不处理也可
+    # ("device_info", r"/mpay/games/.*/devices/.*/users"),
+    ("qrcode_create", r"/mpay/api/qrcode/create_login"),
+    ("qrcode_login", r"/mpay/api/users/login/qrcode/exchange_token"),
+]
+
 
 # 常量结束
 
 
+class RouteTable:
+    """路径路由表
+    加载时按各路径正则的字面量前缀(完整的路径段)建立前缀树并预编译正则,
+    每个flow只沿路径段查找一次前缀树, 仅对字面量前缀是该路径前缀的候选路由做正则匹配.
+    字面量前缀在第一个含正则元字符的路径段处截止, 在同一前缀后紧跟正则的路由仍需逐条匹配.
+    match返回先声明的路由, 未命中返回None;
+    match_all按声明顺序返回全部命中的路由
+    """
+
+    _REGEX_META = frozenset(".^$*+?{}[]\\|()")
+
+    def __init__(self, routes: list[tuple[str, str]]):
+        self.routes = routes
+        # 前缀树节点: {路径段: 子节点, None: [(序号, 路由名, 正则), ...]}
+        self._trie = {}
+        for order, (name, path) in enumerate(routes):
+            node = self._trie
+            # 最后一段可能只是前缀匹配的一部分, 不作为字面量路径段
+            for segment in path.split("/")[:-1]:
+                if self._REGEX_META.intersection(segment):
+                    break
+                node = node.setdefault(segment, {})
+            node.setdefault(None, []).append((order, name, re.compile(path)))
+
+    def _candidates(self, path: str) -> list[tuple[int, str, re.Pattern]]:
+        """沿路径段查找前缀树, 返回按声明顺序排列的候选路由"""
+        candidates = []
+        node = self._trie
+        for segment in path.split("/"):
+            if None in node:
+                candidates += node[None]
+            node = node.get(segment)
+            if node is None:
+                break
+        else:
+            candidates += node.get(None, [])
+        candidates.sort()
+        return candidates
+
+    def match(self, path: str) -> Optional[str]:
+        for _, name, pattern in self._candidates(path):
+            if pattern.match(path):
+                return name
+        return None
+
+    def match_all(self, path: str) -> list[str]:
+        """按声明顺序返回所有命中的路由名"""
+        return [
+            name for _, name, pattern in self._candidates(path) if pattern.match(path)
+        ]
+
+
+def _form_field_name(field: bytes) -> bytes:
+    name = field.partition(b"=")[0]
+    if b"%" in name or b"+" in name:
+        name = unquote_to_bytes(name.replace(b"+", b" "))
+    return name
+
+
+def rewrite_form_cv(content: bytes, cv: str) -> bytes:
+    """在urlencoded表单原始字节上设置cv字段并删除arch字段
+    只扫描一次字段, 其余字段的字节与顺序保持不变(不重新转义);
+    已有cv时替换第一个并丢弃其余重复项, 否则追加到末尾
+    """
+    cv_field = b"cv=" + quote_plus(cv).encode()
+    fields = []
+    has_cv = False
+    for field in content.split(b"&") if content else ():
+        name = _form_field_name(field)
+        if name == b"arch":
+            continue
+        if name == b"cv":
+            if has_cv:
+                continue
+            field = cv_field
+            has_cv = True
+        fields.append(field)
+    if not has_cv:
+        fields.append(cv_field)
+    return b"&".join(fields)
+
+
+class LazyBody:
+    """flow消息体的惰性视图
+    首次访问data时才解码, 同一flow中所有处理方法修改同一份数据,
+    修改后需调用mark_modified, 在hook结束时由commit统一序列化一次
+    """
+
+    __slots__ = ("_message", "_loads", "_dumps", "_data", "modified")
+
+    def __init__(
+        self,
+        message: http.Message,
+        loads: Callable[[bytes], Any],
+        dumps: Callable[[Any], bytes],
+    ):
+        self._message = message
+        self._loads = loads
+        self._dumps = dumps
+        self._data = None
+        self.modified = False
+
+    @classmethod
+    def json(cls, message: http.Message) -> "LazyBody":
+        return cls(message, _json_loads, _json_dumps)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._loads(self._message.content)
+        return self._data
+
+    def mark_modified(self):
+        self.modified = True
+
+    def commit(self):
+        """仅在数据被修改过时序列化并写回消息体"""
+        if self.modified:
+            self._message.content = self._dumps(self._data)
+            self.modified = False
+
+
+class EventChannel:
+    """插件事件通道
+    以NDJSON(每行一个JSON对象)通过本地TCP连接向MitmproxyManager发送结构化事件:
+    {"type": 事件类型, "flow": flow id, "ts": 时间戳, "payload": 事件内容}
+    emit在mitmproxy的事件循环中调用, 只把序列化后的事件放入有界队列, 由写线程合并发送;
+    接收方处理不及时导致队列已满时丢弃新事件并计数, 不阻塞事件循环
+    以内嵌模式运行时可设置sink回调, 事件直接在进程内传递而不经过连接
+    未配置或连接断开时退回到标准输出的 <TYPE>payload</TYPE> 标签格式
+    """
+
+    def __init__(self, max_pending: int = 10000):
+        self.max_pending = max_pending
+        self.dropped = 0  # 队列已满而丢弃的事件数
+        self._sock: Optional[socket.socket] = None
+        self._pending: Optional[queue.Queue] = None
+        self._writer: Optional[threading.Thread] = None
+        self._sink: Optional[Callable[[dict], None]] = None
+
+    def set_sink(self, sink: Optional[Callable[[dict], None]]):
+        """设置进程内事件回调, 传入None取消"""
+        self._sink = sink
+
+    def connect(self, address: str):
+        """连接到 host:port 形式的事件通道地址"""
+        self.close()
+        host, port = address.rsplit(":", 1)
+        sock = socket.create_connection((host, int(port)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        pending = queue.Queue(self.max_pending)
+        self._writer = threading.Thread(
+            target=self._write, args=(sock, pending), name="EventChannel", daemon=True
+        )
+        self._sock, self._pending = sock, pending
+        self._writer.start()
+
+    def close(self, timeout: float = 1):
+        """发送已排队的事件后断开, 超时后直接断开"""
+        sock, pending, writer = self._sock, self._pending, self._writer
+        self._sock = self._pending = self._writer = None
+        if sock is None:
+            return
+        try:
+            pending.put_nowait(None)  # 通知写线程发送完已排队的事件后退出
+        except queue.Full:
+            pass
+        writer.join(timeout)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)  # 唤醒仍阻塞在发送中的写线程
+        except OSError:
+            pass
+        sock.close()
+
+    def _write(self, sock: socket.socket, pending: queue.Queue):
+        """写线程: 合并已排队的事件一次发送, 连接断开后事件通道退回到标准输出"""
+        while True:
+            batch = [pending.get()]
+            while batch[-1] is not None and len(batch) < 256:
+                try:
+                    batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            try:
+                sock.sendall(b"".join(batch[:-1] if closing else batch))
+            except OSError:
+                if self._pending is pending:
+                    self._pending = None
+                return
+            if closing:
+                return
+
+    def emit(self, event_type: str, payload: Any = None, flow=None):
+        pending = self._pending
+        if pending is None and self._sink is None:
+            print(f"<{event_type}>{payload}</{event_type}>")
+            return
+        event = {
+            "type": event_type,
+            "flow": flow.id if flow is not None else None,
+            "ts": time.time(),
+            "payload": payload,
+        }
+        if self._sink is not None:
+            self._sink(event)
+            return
+        try:
+            pending.put_nowait(_json_dumps(event) + b"\n")
+        except queue.Full:
+            self.dropped += 1
+
+
+events = EventChannel()
+
+
+class LatencyHistogram:
+    """固定分桶的耗时直方图
+    桶边界在创建时确定, 记录时只做二分查找和计数累加, 不分配新的容器对象
+    """
+
+    # 桶上界(微秒), 最后一个桶收集超出上界的样本
+    BOUNDS_US = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)
+    _BOUNDS_NS = tuple(b * 1000 for b in BOUNDS_US)
+
+    __slots__ = ("counts", "count", "total_ns")
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_US) + 1)
+        self.count = 0
+        self.total_ns = 0
+
+    def observe(self, elapsed_ns: int):
+        self.counts[bisect_left(self._BOUNDS_NS, elapsed_ns)] += 1
+        self.count += 1
+        self.total_ns += elapsed_ns
+
+    def quantile(self, q: float) -> Optional[int]:
+        """返回q分位所在桶的上界(微秒), 无样本或落在溢出桶时返回None"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, n in zip(self.BOUNDS_US, self.counts):
+            cumulative += n
+            if cumulative >= rank:
+                return bound
+        return None
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum_us": self.total_ns / 1000,
+            "counts": list(self.counts),
+            "p50_us": self.quantile(0.50),
+            "p99_us": self.quantile(0.99),
+        }
+
+
+class LatencyMetrics:
+    """各hook与处理方法的耗时直方图集合
+    可通过mitmproxy命令 loginer.latency 或本地HTTP端点 GET /metrics 以JSON获取
+    """
+
+    def __init__(self):
+        self.histograms: dict[str, LatencyHistogram] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        return self.histograms.setdefault(name, LatencyHistogram())
+
+    def timed(self, name: str):
+        """装饰器: 记录被装饰函数的耗时, 直方图在装饰时创建"""
+        hist = self.histogram(name)
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    hist.observe(time.perf_counter_ns() - start)
+
+            return wrapper
+
+        return decorator
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets_us": list(LatencyHistogram.BOUNDS_US),
+            "histograms": {
+                name: hist.snapshot() for name, hist in self.histograms.items()
+            },
+        }
+
+    def serve(self, port: int):
+        """在 127.0.0.1:port 上提供 GET /metrics"""
+        self.close()
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = _json_dumps(metrics.snapshot())
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 不输出访问日志
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        threading.Thread(
+            target=self._server.serve_forever, name="LatencyMetrics", daemon=True
+        ).start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+metrics = LatencyMetrics()
+
+
+class QRCodeSessionStore:
+    """二维码登录记录
+    按设备(game_id:device_id)跟踪进行中的扫码会话以统计登录耗时, 按账号id记录最近一次登录的有效期,
+    有效期内再次登录计为命中, 否则计为未命中; 账号数超过上限时淘汰最久未登录的账号.
+    设置path后每次登录都会把账号id、有效期与命中统计持久化为JSON文件
+    只记录不代答, 也不保存令牌: 换取令牌请求在服务器响应前无法确定扫码的是哪个账号,
+    以设备为键返回缓存令牌会把上一个账号的令牌交给同一设备上的其他用户
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path: Optional[str] = None
+        self._accounts: OrderedDict[str, float] = OrderedDict()  # 账号id -> 过期时间
+        # 设备键 -> {"uuid": 二维码uuid, "started": 创建二维码的时间}
+        self._sessions: OrderedDict[str, dict] = OrderedDict()
+        self._uuid_index: dict[str, str] = {}  # 二维码uuid -> 设备键
+        self.hits = 0  # 登录时该账号的记录仍在有效期内的次数
+        self.misses = 0
+        self.login_times: deque[float] = deque(maxlen=100)  # 最近的扫码登录耗时(秒)
+
+    def load(self, path: str):
+        """从JSON文件加载账号记录与命中统计, 丢弃已过期的条目
+        旧版本文件中按账号保存了令牌, 加载时只取有效期并立即重写文件
+        """
+        self.path = path
+        self._accounts.clear()
+        self.hits = self.misses = 0
+        try:
+            with open(path, "rb") as f:
+                data = _json_loads(f.read())
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict):
+            return
+        legacy = "accounts" not in data
+        accounts = data if legacy else data["accounts"]
+        if not isinstance(accounts, dict):
+            return
+        now = time.time()
+        for account, expires in accounts.items():
+            if isinstance(expires, dict):
+                expires = expires.get("expires")
+            if isinstance(expires, (int, float)) and expires > now:
+                self._accounts[account] = expires
+        if legacy:
+            self.save()
+            return
+        for name in ("hits", "misses"):
+            if isinstance(value := data.get(name), int):
+                setattr(self, name, value)
+
+    def save(self):
+        """写入临时文件后替换, 避免中途崩溃留下损坏的文件"""
+        if not self.path:
+            return
+        data = {
+            "accounts": dict(self._accounts),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_json_dumps(data))
+        os.replace(tmp_path, self.path)
+
+    def resolve_key(self, key: Optional[str], uuid: Optional[str]) -> Optional[str]:
+        """设备键缺失时尝试通过二维码uuid找回"""
+        return key or self._uuid_index.get(uuid)
+
+    def put_session(self, key: str, session: dict):
+        """记录二维码创建响应中的uuid, 开始计时"""
+        if (previous := self._sessions.pop(key, None)) is not None:
+            self._uuid_index.pop(previous["uuid"], None)
+        uuid = session.get("uuid")
+        self._sessions[key] = {"uuid": uuid, "started": time.time()}
+        if uuid:
+            self._uuid_index[uuid] = key
+        while len(self._sessions) > self.max_entries:
+            _, entry = self._sessions.popitem(last=False)
+            self._uuid_index.pop(entry["uuid"], None)
+
+    def record_login(self, key: str, response: dict) -> Optional[str]:
+        """按换取令牌响应中的账号id记录登录, 结束该设备的计时并持久化
+        返回账号id, 响应中没有账号时不记录
+        """
+        user = response.get("user")
+        account = user.get("id") if isinstance(user, dict) else None
+        if account is None:
+            return None
+        account = str(account)
+        now = time.time()
+        if (session := self._sessions.pop(key, None)) is not None:
+            self._uuid_index.pop(session["uuid"], None)
+            self.login_times.append(now - session["started"])
+        expires = self._accounts.pop(account, None)
+        if expires is not None and expires > now:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self._accounts[account] = now + self.ttl
+        while len(self._accounts) > self.max_entries:
+            self._accounts.popitem(last=False)
+        self.save()
+        return account
+
+    def stats(self) -> dict:
+        logins = self.hits + self.misses
+        return {
+            "accounts": len(self._accounts),
+            "pending_sessions": len(self._sessions),
+            "logins": logins,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / logins if logins else None,
+            "login_time_avg_s": (
+                sum(self.login_times) / len(self.login_times)
+                if self.login_times
+                else None
+            ),
+            "login_time_last_s": self.login_times[-1] if self.login_times else None,
+        }
+
+
+qrcode_sessions = QRCodeSessionStore()
+
+
+def qrcode_login_key(flow: http.HTTPFlow) -> Optional[str]:
+    """二维码登录会话的设备键 game_id:device_id, 依次从查询参数与请求体中读取,
+    均缺失时通过二维码uuid查找"""
+    params = dict(flow.request.query)
+    if flow.request.content:
+        if "json" in flow.request.headers.get("Content-Type", ""):
+            try:
+                body = _json_loads(flow.request.content)
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                params.update(body)
+        else:
+            params.update(flow.request.urlencoded_form)
+    key = None
+    if params.get("game_id") and params.get("device_id"):
+        key = f"{params['game_id']}:{params['device_id']}"
+    return qrcode_sessions.resolve_key(key, params.get("uuid"))
+
+
 class Proxy_service_mkey_163_com:
     def __init__(self):
         # self.channel_account_selected = ""
@@ -94,66 +613,169 @@ class Proxy_service_mkey_163_com:
         self.pc_info = pcInfo
         self.login_methods = loginMethod
 
+        # 路由表仅在插件加载时编译一次
+        self.request_routes = RouteTable(RequestRoutes)
+        self.response_routes = RouteTable(ResponseRoutes)
+        self._response_handlers = {
+            name: getattr(self, f"_handle_{name}") for name, _ in ResponseRoutes
+        }
+
     # def running(self, loader):
     #     """插件开始运行"""
     #     print("<INFO>插件开始运行</INFO>")
 
+    @staticmethod
+    def load(loader):
+        """注册插件选项"""
+        loader.add_option(
+            name="event_channel",
+            typespec=str,
+            default="",
+            help="事件通道地址 host:port, 为空时事件输出到标准输出",
+        )
+        loader.add_option(
+            name="metrics_port",
+            typespec=int,
+            default=0,
+            help="耗时直方图HTTP端点端口(仅监听127.0.0.1), 为0时不开启",
+        )
+        loader.add_option(
+            name="qrcode_store",
+            typespec=str,
+            default="",
+            help="二维码登录记录的持久化文件路径, 为空时仅保存在内存中",
+        )
+        loader.add_option(
+            name="qrcode_record_ttl",
+            typespec=int,
+            default=86400,
+            help="账号登录记录的有效期(秒), 有效期内再次登录计为命中",
+        )
+        loader.add_option(
+            name="intercept_hosts",
+            typespec=Sequence[str],
+            default=[],
+            help="选择性拦截: 只解密这些主机的TLS, 其余连接以TCP隧道透传; 为空时拦截全部连接",
+        )
+
+    @staticmethod
+    def configure(updated):
+        if "event_channel" in updated:
+            if ctx.options.event_channel:
+                events.connect(ctx.options.event_channel)
+            else:
+                events.close()
+        if "metrics_port" in updated:
+            if ctx.options.metrics_port:
+                metrics.serve(ctx.options.metrics_port)
+            else:
+                metrics.close()
+        if "qrcode_record_ttl" in updated:
+            qrcode_sessions.ttl = ctx.options.qrcode_record_ttl
+        if "qrcode_store" in updated and ctx.options.qrcode_store:
+            qrcode_sessions.load(ctx.options.qrcode_store)
+
+    @staticmethod
+    def done():
+        events.close()
+        metrics.close()
+
+    @command.command("loginer.latency")
+    def latency(self) -> str:
+        """以JSON返回各hook与处理方法的耗时直方图"""
+        return json.dumps(metrics.snapshot())
+
+    @command.command("loginer.qrcode_stats")
+    def qrcode_stats(self) -> str:
+        """以JSON返回二维码登录记录的账号数、命中率与登录耗时"""
+        return json.dumps(qrcode_sessions.stats())
+
+    @staticmethod
+    def next_layer(nextlayer: layer.NextLayer):
+        """选择性拦截: 目标主机不在 intercept_hosts 中的连接以TCP隧道透传
+        在目标地址确定后判断(HTTP代理模式下即CONNECT之后), 代理自身的入站连接不受影响;
+        不使用 allow_hosts, 部分mitmproxy版本会按CONNECT请求的Host头忽略入站连接, 导致透传失败
+        """
+        hosts = ctx.options.intercept_hosts
+        address = nextlayer.context.server.address
+        if not hosts or address is None:
+            return
+        if address[0].lower() not in hosts:
+            nextlayer.layer = layers.TCPLayer(nextlayer.context, ignore=True)
+
+    @metrics.timed("hook.requestheaders")
+    def requestheaders(self, flow: http.HTTPFlow):
+        """请求头到达时判断是否需要缓冲请求体
+        只有需要修改cv参数的POST请求与二维码请求才缓冲(响应处理时从请求体读取设备键),
+        其余请求体直接流式转发
+        """
+        route = self.request_routes.match(flow.request.path)
+        if route in ("qrcode_create", "qrcode_login"):
+            return
+        if flow.request.method != "POST" or not self._need_add_cv_param(flow, route):
+            flow.request.stream = True
+
+    @metrics.timed("hook.responseheaders")
+    def responseheaders(self, flow: http.HTTPFlow):
+        """响应头到达时判断是否需要缓冲响应体
+        路由表未命中的响应(如游戏资源下载)不会被修改, 直接流式转发
+        """
+        if self.response_routes.match(flow.request.path) is None:
+            flow.response.stream = True
+
+    @metrics.timed("hook.request")
     def request(self, flow: http.HTTPFlow):
         """请求处理入口"""
-        DoNotAddCVHeader = False
+        route = self.request_routes.match(flow.request.path)
         # 特殊路径处理开始
         # 外传QRCode创建参数
-        if re.compile(r"/mpay/api/qrcode/create_login").match(flow.request.path):
-            print(f"<CreateLoginQRCode>{flow.request.path}</CreateLoginQRCode>")
-        # 排除不需要添加cv参数的请求
-        for path in ExceptAddCVHeaderPaths:
-            if re.compile(path).match(flow.request.path):
-                DoNotAddCVHeader = True
-                break
+        if route == "qrcode_create":
+            events.emit("CreateLoginQRCode", flow.request.path, flow)
         # 特殊路径处理结束
 
         # 修改cv参数到所有非空路径请求, Host: service.mkey.163.com
-        if (
-            flow.request.path != "/"
-            and flow.request.headers.get("Host") == DOMAIN
-            and not DoNotAddCVHeader
-        ):
+        if self._need_add_cv_param(flow, route):
             self._add_cv_param(flow)
-            print(f"<REQUEST>{flow.request.path}</REQUEST>")
+            events.emit("REQUEST", flow.request.path, flow)
 
+    @metrics.timed("hook.response")
     def response(self, flow: http.HTTPFlow):
         """响应处理入口"""
         # if flow.request.path != "/":
         #     print(f"<REQUEST>{flow.request.path}</REQUEST>")
 
+        routes = self.response_routes.match_all(flow.request.path)
+        if not routes:
+            return
+
+        # 命中的处理方法按声明顺序修改同一份数据, 结束后只序列化一次
+        # 某个处理方法出错时跳过它, 其余处理方法的修改照常写回
+        body = LazyBody.json(flow.response)
+        # pc_config:      /mpay/games/pc_config
+        # login_methods:  /mpay/games/{game_id}/login_methods
+        # qrcode_create:  /mpay/api/qrcode/create_login
+        # qrcode_login:   /mpay/api/users/login/qrcode/exchange_token
+        for route in routes:
+            try:
+                self._response_handlers[route](flow, body)
+            except Exception as e:
+                events.emit("ERROR", f"{route} 处理失败, 已跳过: {e}", flow)
         try:
-            # 处理PC配置 path: /mpay/games/pc_config
-            if re.compile(r"/mpay/games/pc_config").match(flow.request.path):
-                self._handle_pc_config(flow)
-
-            # 处理登录方法配置 path: /mpay/games/{game_id}/login_methods
-            if re.compile(r"/mpay/games/.*/login_methods").match(flow.request.path):
-                self._handle_login_methods(flow)
-
-            # 处理设备信息 path: /mpay/games/{game_id}/devices/{device_id}/users/{user_id}
-            # 对于 h55 不处理也可
-            # if re.compile(r"/mpay/games/.*/devices/.*/users").match(flow.request.path):
-            #     self._handle_device_info(flow)
-
-            # 外传QRCode创建参数
-            if re.compile(r"/mpay/api/qrcode/create_login").match(flow.request.path):
-                self._handle_qrcode_create(flow)
-
-            # 处理QRCODE登录
-            if re.compile(r"/mpay/api/users/login/qrcode/exchange_token").match(
-                flow.request.path
-            ):
-                self._handle_qrcode_login(flow)
-
+            body.commit()
         except Exception as e:
-            print(f"<ERROR>{str(e)}</ERROR>")
+            events.emit("ERROR", f"响应写回失败: {e}", flow)
 
     @staticmethod
+    def _need_add_cv_param(flow: http.HTTPFlow, route: Optional[str]) -> bool:
+        """非空路径且Host为DOMAIN的请求需要修改cv参数, 命中请求路由的除外"""
+        return (
+            route is None
+            and flow.request.path != "/"
+            and flow.request.headers.get("Host") == DOMAIN
+        )
+
+    @staticmethod
+    @metrics.timed("handler.add_cv_param")
     def _add_cv_param(flow: http.HTTPFlow, cv: str = "i4.7.0"):
         """为请求修改cv参数
         必要, 不修改登录时会返回不支持错误
@@ -166,35 +788,35 @@ class Proxy_service_mkey_163_com:
         if flow.request.method == "POST":
             try:
                 if "json" in flow.request.headers.get("Content-Type"):
-                    data = json.loads(flow.request.content)
-                    data["cv"] = cv
-                    data.pop("arch", None)
-                    flow.request.content = json.dumps(data).encode()
-                else:  # form-data处理
-                    body = flow.request.urlencoded_form
-                    body["cv"] = cv
-                    body.pop("arch", None)
-                    flow.request.content = bytes(urlencode(body), "utf-8")
+                    body = LazyBody.json(flow.request)
+                    body.data["cv"] = cv
+                    body.data.pop("arch", None)
+                    body.mark_modified()
+                    body.commit()
+                else:  # form-data处理, 直接在原始字节上改写
+                    flow.request.content = rewrite_form_cv(flow.request.content, cv)
             except Exception as e:
-                print(f"<ERROR>POST请求cv参数添加失败:{e}</ERROR>")
+                events.emit("ERROR", f"POST请求cv参数添加失败:{e}", flow)
 
     @staticmethod
-    def _handle_pc_config(flow: http.HTTPFlow):
+    @metrics.timed("handler.pc_config")
+    def _handle_pc_config(flow: http.HTTPFlow, body: LazyBody):
         """处理PC配置 path: /mpay/games/pc_config"""
         try:
-            response = json.loads(flow.response.content)
+            response = body.data
             response["game"]["config"]["cv_review_status"] = 1  # 原始数据就是1
-            flow.response.content = json.dumps(response).encode()
+            body.mark_modified()
             # print(f"<PC_CONFIG>{response}</PC_CONFIG>")
-            print(f"<INFO>PC CONFIG 已修改</INFO>")
+            events.emit("INFO", "PC CONFIG 已修改", flow)
         except (KeyError, json.JSONDecodeError) as e:
-            print(f"<ERROR>PC CONFIG 响应格式异常:{e}</ERROR>")
+            events.emit("ERROR", f"PC CONFIG 响应格式异常:{e}", flow)
 
     @staticmethod
-    def _handle_login_methods(flow: http.HTTPFlow):
+    @metrics.timed("handler.login_methods")
+    def _handle_login_methods(flow: http.HTTPFlow, body: LazyBody):
         """处理登录方法配置"""
         try:
-            response = json.loads(flow.response.content)
+            response = body.data
             response["entrance"] = [loginMethod]
             response["select_platform"] = True
             response["qrcode_select_platform"] = True
@@ -203,40 +825,54 @@ class Proxy_service_mkey_163_com:
             for key in response.get("config", {}):
                 response["config"][key]["select_platforms"] = [0, 1, 2, 3, 4]
 
-            flow.response.content = json.dumps(response).encode()
+            body.mark_modified()
 
-            print(f"<INFO>登录方法配置已修改</INFO>")
+            events.emit("INFO", "登录方法配置已修改", flow)
         except json.JSONDecodeError:
-            print(f"<ERROR>登录方法配置响应不是有效JSON</ERROR>")
+            events.emit("ERROR", "登录方法配置响应不是有效JSON", flow)
 
-    def _handle_device_info(self, flow: http.HTTPFlow):
+    @metrics.timed("handler.device_info")
+    def _handle_device_info(self, flow: http.HTTPFlow, body: LazyBody):
         """处理设备信息，可能可以实现绕过防沉迷"""
         try:
-            response = json.loads(flow.response.content)
-            print(f"<DEVICE_INFO>{response}</DEVICE_INFO>")
+            response = body.data
+            events.emit("DEVICE_INFO", response, flow)
             response["user"]["pc_ext_info"] = self.pc_info
-            flow.response.content = json.dumps(response).encode()
-            print(f"<INFO>设备信息已修改</INFO>")
+            body.mark_modified()
+            events.emit("INFO", "设备信息已修改", flow)
         except (KeyError, json.JSONDecodeError) as e:
-            print(f"<ERROR>PC CONFIG 响应格式异常:{e}</ERROR>")
+            events.emit("ERROR", f"PC CONFIG 响应格式异常:{e}", flow)
 
     @staticmethod
-    def _handle_qrcode_create(flow: http.HTTPFlow):
+    @metrics.timed("handler.qrcode_create")
+    def _handle_qrcode_create(flow: http.HTTPFlow, body: LazyBody):
         """处理二维码创建"""
         try:
-            response = json.loads(flow.response.content)
-            print(f"<QRCode>{response}</QRCode>")
+            response = body.data
+            events.emit("QRCode", response, flow)
+            key = qrcode_login_key(flow)
+            if key and isinstance(response, dict):
+                qrcode_sessions.put_session(key, response)
         except json.JSONDecodeError:
-            print(f"<ERROR>二维码创建响应不是有效JSON</ERROR>")
+            events.emit("ERROR", "二维码创建响应不是有效JSON", flow)
 
     @staticmethod
-    def _handle_qrcode_login(flow: http.HTTPFlow):
-        """处理二维码登录结果，可能可以实现保存上次扫码记录"""
+    @metrics.timed("handler.qrcode_login")
+    def _handle_qrcode_login(flow: http.HTTPFlow, body: LazyBody):
+        """处理二维码登录结果，按账号记录本次登录"""
         try:
-            response = json.loads(flow.response.content)
-            print(f"<QRCodeLogin>{response}</QRCodeLogin>")
+            response = body.data
+            events.emit("QRCodeLogin", response, flow)
+            key = qrcode_login_key(flow)
+            if (
+                key
+                and flow.response.status_code == 200
+                and isinstance(response, dict)
+                and qrcode_sessions.record_login(key, response) is not None
+            ):
+                events.emit("QRCodeRecord", qrcode_sessions.stats(), flow)
         except json.JSONDecodeError:
-            print(f"<ERROR>二维码登录响应不是有效JSON</ERROR>")
+            events.emit("ERROR", "二维码登录响应不是有效JSON", flow)
 
 
 # mitmproxy插件标准入口
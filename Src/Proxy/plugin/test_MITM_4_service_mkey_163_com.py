@@ -0,0 +1,454 @@
+"""插件与内嵌模式 MitmproxyManager 的测试
+
+内嵌启动与停止: 启动返回时代理端口已在监听; 停止超时时保留 DumpMaster 的引用
+二维码登录记录: 内嵌模式的 MitmproxyManager 加载插件, 客户端经代理访问本地替身 /mpay/api/... 接口,
+create_login 按设备返回新的二维码uuid, exchange_token 返回扫描该二维码的账号的令牌,
+插件只按账号记录登录有效期与命中统计
+选择性拦截: 经代理CONNECT本地HTTPS替身上游, 按客户端看到的证书签发者判断是否被解密
+流式转发: 请求头/响应头阶段只为插件会改写的消息体保留缓冲
+路由表: 与逐条匹配的原实现结果一致
+事件通道: 接收方不读取时emit不阻塞, 超出队列的事件被丢弃
+表单改写: 字节级改写与解码-修改-编码的结果在语义上一致
+"""
+
+import http.server
+import json
+import random
+import socket
+import ssl
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import httpx
+import pytest
+from cryptography import x509
+from mitmproxy.http import Response
+from mitmproxy.test import tflow
+
+from Src.Proxy.plugin import MITM_4_service_mkey_163_com as plugin
+from Src.Proxy.proxy_bench import (
+    ROUTE_SHAPES,
+    Upstream,
+    decode_form,
+    linear_match,
+    rewrite_form_cv_by_decode,
+)
+from Src.ThirdPartyManager import mitmproxy
+from Src.ThirdPartyManager.mitmproxy import MitmproxyManager
+from Src.config import cfg
+
+
+class _MpayHandler(http.server.BaseHTTPRequestHandler):
+    scanned: dict = {}  # 二维码uuid -> 扫码的账号
+    exchanges: list = []  # 到达服务器的换取令牌请求的uuid
+
+    def _send_json(self, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != "/mpay/api/qrcode/create_login":
+            self.send_error(404)
+            return
+        self._send_json({"uuid": uuid.uuid4().hex, "qrcode_scanner_url": ""})
+
+    def do_POST(self):
+        if self.path != "/mpay/api/users/login/qrcode/exchange_token":
+            self.send_error(404)
+            return
+        length = int(self.headers["Content-Length"])
+        form = parse_qs(self.rfile.read(length).decode())
+        qrcode = form["uuid"][0]
+        self.exchanges.append(qrcode)
+        account = self.scanned[qrcode]
+        self._send_json({"user": {"id": account, "token": f"token-{account}"}})
+
+
+@pytest.fixture
+def mpay(http_server):
+    _MpayHandler.scanned = {}
+    _MpayHandler.exchanges = []
+    return http_server(_MpayHandler).base_url
+
+
+def _start_manager(tmp_path) -> MitmproxyManager:
+    with socket.create_server(("127.0.0.1", 0)) as s:
+        port = s.getsockname()[1]
+    manager = MitmproxyManager(port, embedded=True)
+    manager.qrcode_store_path = tmp_path / "qrcode_sessions.json"
+    manager.start_mitmproxy()
+    try:
+        manager.wait_ready(10)
+    except Exception:
+        manager.stop_mitmproxy()
+        raise
+    return manager
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    manager = _start_manager(tmp_path)
+    yield manager
+    manager.stop_mitmproxy()
+
+
+class _SlowDone:
+    """退出时阻塞事件循环, 模拟未能按时退出的 DumpMaster"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def done(self):
+        time.sleep(self.delay)
+
+
+def test_embedded_start_returns_after_listening(tmp_path):
+    with socket.create_server(("127.0.0.1", 0)) as s:
+        port = s.getsockname()[1]
+    manager = MitmproxyManager(port, embedded=True)
+    manager.qrcode_store_path = tmp_path / "qrcode_sessions.json"
+    manager.start_mitmproxy()
+    try:
+        # 不经 wait_ready, 启动返回时代理端口已可连接
+        socket.create_connection(("127.0.0.1", port), 1).close()
+    finally:
+        manager.stop_mitmproxy()
+
+
+def test_embedded_stop_timeout_keeps_master(tmp_path, monkeypatch):
+    errors = []
+    monkeypatch.setattr(mitmproxy, "error", lambda msg, *a, **k: errors.append(msg))
+    manager = _start_manager(tmp_path)
+    added = threading.Event()
+
+    def add_slow_done():
+        manager._master.addons.add(_SlowDone(1))
+        added.set()
+
+    manager._loop.call_soon_threadsafe(add_slow_done)
+    assert added.wait(5)
+
+    manager._stop_embedded(timeout=0.1)
+    # 事件循环线程仍在退出中, 保留引用, 可以再次停止
+    assert manager.is_running() and manager._master is not None
+    manager._stop_embedded(timeout=5)
+    assert not manager.is_running() and manager._master is None
+    assert errors == []
+
+
+def _login(client: httpx.Client, mpay: str, account: str, with_device=True) -> dict:
+    """创建二维码, 由account扫码后换取令牌"""
+    device = {"game_id": "h55", "device_id": "DEVICE-1"}
+    qrcode = client.get(f"{mpay}/mpay/api/qrcode/create_login", params=device).json()
+    _MpayHandler.scanned[qrcode["uuid"]] = account
+    form = {**(device if with_device else {}), "uuid": qrcode["uuid"]}
+    response = client.post(
+        f"{mpay}/mpay/api/users/login/qrcode/exchange_token", data=form
+    )
+    return response.json()
+
+
+def test_records_logins_per_account_on_shared_device(mpay, proxy):
+    with httpx.Client(proxy=f"http://127.0.0.1:{proxy.port}", timeout=10) as client:
+        alice = _login(client, mpay, "alice")
+        # 同一设备换了账号扫码, 换取令牌请求只带uuid, 通过uuid找回设备
+        bob = _login(client, mpay, "bob", with_device=False)
+        alice_again = _login(client, mpay, "alice")
+
+    # 每次登录都由服务器换取令牌, 不会把上一个账号的令牌交给下一个用户
+    assert len(_MpayHandler.exchanges) == 3
+    assert alice["user"]["id"] == alice_again["user"]["id"] == "alice"
+    assert bob["user"]["id"] == "bob"
+
+    stats = plugin.qrcode_sessions.stats()
+    assert (stats["accounts"], stats["pending_sessions"]) == (2, 0)
+    assert (stats["logins"], stats["hits"], stats["misses"]) == (3, 1, 2)
+    assert stats["login_time_last_s"] is not None
+
+    # 持久化文件只有账号id、有效期与命中统计, 不含令牌
+    content = proxy.qrcode_store_path.read_text()
+    assert "token" not in content
+    assert set(json.loads(content)["accounts"]) == {"alice", "bob"}
+    reloaded = plugin.QRCodeSessionStore()
+    reloaded.load(str(proxy.qrcode_store_path))
+    assert (reloaded.stats()["accounts"], reloaded.stats()["hits"]) == (2, 1)
+
+
+def test_expired_records_are_not_loaded(tmp_path):
+    store = plugin.QRCodeSessionStore(ttl=-1)
+    store.path = str(tmp_path / "qrcode_sessions.json")
+    store.put_session("h55:DEVICE-1", {"uuid": "u1"})
+    assert store.record_login("h55:DEVICE-1", {"user": {"id": 1}}) == "1"
+    assert store.record_login("h55:DEVICE-1", {"code": 1404}) is None
+
+    reloaded = plugin.QRCodeSessionStore()
+    reloaded.load(store.path)
+    assert reloaded.stats()["accounts"] == 0
+
+
+def test_legacy_store_with_tokens_is_rewritten(tmp_path):
+    path = tmp_path / "qrcode_sessions.json"
+    legacy = {"alice": {"token": {"user": {"token": "secret"}}, "expires": 2e9}}
+    path.write_text(json.dumps(legacy))
+
+    store = plugin.QRCodeSessionStore()
+    store.load(str(path))
+    assert store.stats()["accounts"] == 1
+    assert "secret" not in path.read_text()
+
+
+def test_response_runs_every_matching_handler_on_one_body(monkeypatch):
+    calls = {"loads": 0, "dumps": 0}
+
+    def counted(name, func):
+        def wrapper(value):
+            calls[name] += 1
+            return func(value)
+
+        return wrapper
+
+    monkeypatch.setattr(plugin, "_json_loads", counted("loads", plugin._json_loads))
+    monkeypatch.setattr(plugin, "_json_dumps", counted("dumps", plugin._json_dumps))
+
+    def handler(key):
+        def handle(flow, body):
+            body.data[key] = len(body.data)
+            body.mark_modified()
+
+        return handle
+
+    addon = plugin.Proxy_service_mkey_163_com()
+    addon.response_routes = plugin.RouteTable(
+        [("games", r"/mpay/games/.*"), ("pc_config", r"/mpay/games/pc_config")]
+    )
+    addon._response_handlers = {"games": handler("a"), "pc_config": handler("b")}
+
+    flow = tflow.tflow()
+    flow.request.path = "/mpay/games/pc_config"
+    flow.response = Response.make(200, b'{"game": {}}')
+    addon.response(flow)
+
+    # 两个处理方法按声明顺序修改同一份数据, 消息体只解析和序列化一次
+    assert json.loads(flow.response.content) == {"game": {}, "a": 1, "b": 2}
+    assert calls == {"loads": 1, "dumps": 1}
+
+
+def test_response_keeps_edits_when_a_handler_raises(monkeypatch):
+    emitted = []
+    monkeypatch.setattr(
+        plugin.events, "emit", lambda kind, payload, flow=None: emitted.append(kind)
+    )
+
+    def edit(key):
+        def handle(flow, body):
+            body.data[key] = True
+            body.mark_modified()
+
+        return handle
+
+    def broken(flow, body):
+        body.data["partial"] = True
+        raise KeyError("game")
+
+    addon = plugin.Proxy_service_mkey_163_com()
+    addon.response_routes = plugin.RouteTable(
+        [("a", r"/mpay/"), ("broken", r"/mpay/games/"), ("b", r"/mpay/games/")]
+    )
+    addon._response_handlers = {"a": edit("a"), "broken": broken, "b": edit("b")}
+
+    flow = tflow.tflow()
+    flow.request.path = "/mpay/games/pc_config"
+    flow.response = Response.make(200, b"{}")
+    addon.response(flow)
+
+    # 出错的处理方法被跳过并报告, 前后处理方法的修改都写回了消息体
+    assert json.loads(flow.response.content) == {"a": True, "partial": True, "b": True}
+    assert emitted == ["ERROR"]
+
+
+def _peer_issuer(proxy_port: int, upstream_port: int) -> str:
+    """经代理CONNECT到上游并完成TLS握手, 返回客户端看到的证书签发者"""
+    target = f"127.0.0.1:{upstream_port}"
+    with socket.create_connection(("127.0.0.1", proxy_port), 5) as sock:
+        sock.sendall(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+        assert sock.recv(4096).startswith(b"HTTP/1.1 200")
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        with context.wrap_socket(sock) as tls:
+            der = tls.getpeercert(binary_form=True)
+    return x509.load_der_x509_certificate(der).issuer.rfc4514_string()
+
+
+@pytest.mark.parametrize(
+    "hosts, intercepted",
+    [(["service.mkey.163.com"], False), (["service.mkey.163.com", "127.0.0.1"], True)],
+)
+def test_selective_intercept(tmp_path, monkeypatch, hosts, intercepted):
+    monkeypatch.setitem(cfg["proxy"], "selective_intercept", True)
+    monkeypatch.setitem(cfg["proxy"], "intercept_hosts", hosts)
+    upstream = Upstream(tls=True)
+    manager = _start_manager(tmp_path)
+    try:
+        issuer = _peer_issuer(manager.port, upstream.server_address[1])
+    finally:
+        manager.stop_mitmproxy()
+        upstream.close()
+    # 透传时客户端直接与上游握手, 解密时证书由mitmproxy的CA签发
+    assert ("mitmproxy" in issuer) == intercepted, issuer
+
+
+@pytest.mark.parametrize(
+    "method, path, request_stream, response_stream",
+    [
+        ("GET", "/patch/res/assets_001.zip", True, True),
+        ("POST", "/mpay/games/pc_config", False, False),
+        ("POST", "/mpay/api/users/login/qrcode/exchange_token", False, False),
+    ],
+)
+def test_headers_stage_streams_only_unrewritten_bodies(
+    method, path, request_stream, response_stream
+):
+    addon = plugin.Proxy_service_mkey_163_com()
+    flow = tflow.tflow(resp=True)
+    flow.request.method = method
+    flow.request.path = path
+    flow.request.headers["Host"] = plugin.DOMAIN
+
+    addon.requestheaders(flow)
+    addon.responseheaders(flow)
+
+    assert bool(flow.request.stream) == request_stream
+    assert bool(flow.response.stream) == response_stream
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        (b"a=1&cv=a5.10.0&arch=win_x64&b=%E5%80%BC", b"a=1&cv=i4.7.0&b=%E5%80%BC"),
+        (b"cv=1&a=x+y&cv=2", b"cv=i4.7.0&a=x+y"),
+        (b"a=1&arch=", b"a=1&cv=i4.7.0"),
+        (b"", b"cv=i4.7.0"),
+    ],
+)
+def test_rewrite_form_cv_keeps_other_fields_verbatim(body, expected):
+    assert plugin.rewrite_form_cv(body, "i4.7.0") == expected
+
+
+def test_rewrite_form_cv_matches_decode_and_encode():
+    rng = random.Random(0)
+    alphabet = ["a", "b", "cv", "arch", "c%76", "x y", "值", "&", "=", "%", "+"]
+    for _ in range(2000):
+        pairs = [
+            (rng.choice(alphabet), "".join(rng.choices(alphabet, k=rng.randint(0, 3))))
+            for _ in range(rng.randint(0, 8))
+        ]
+        body = urlencode(pairs).encode()
+        fast = plugin.rewrite_form_cv(body, "i4.7.0")
+        slow = rewrite_form_cv_by_decode(body, "i4.7.0")
+        assert decode_form(fast) == decode_form(slow), body
+        assert len(fast) <= len(body) + len(b"&cv=i4.7.0")
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        # 完全匹配
+        ("/mpay/games/pc_config", "pc_config"),
+        # 正则只锚定开头, 路径带查询参数或更深的路径段也命中
+        ("/mpay/games/pc_config?app_channel=netease", "pc_config"),
+        ("/mpay/api/qrcode/create_login/extra", "qrcode_create"),
+        # 共享 /mpay/games/ 前缀, 在字面量段之后才由正则区分
+        ("/mpay/games/h55/login_methods", "login_methods"),
+        ("/mpay/games/h55/devices", None),
+        ("/mpay/api/users/login/qrcode/exchange_token", "qrcode_login"),
+        ("/mpay", None),
+        ("", None),
+    ],
+)
+def test_route_table_matches(path, expected):
+    assert plugin.RouteTable(plugin.ResponseRoutes).match(path) == expected
+
+
+def test_route_table_prefers_first_declared_route():
+    # 后声明的路由字面量前缀更长, 仍按声明顺序返回先声明的路由
+    routes = [
+        ("wide", r"/mpay/.*"),
+        ("exact", r"/mpay/api/qrcode/create_login"),
+        ("prefix", r"/mpay/api/qrcode"),
+    ]
+    table = plugin.RouteTable(routes)
+    path = "/mpay/api/qrcode/create_login"
+    assert table.match(path) == "wide"
+    assert table.match_all(path) == ["wide", "exact", "prefix"]
+    assert plugin.RouteTable(routes[1:]).match_all(path) == ["exact", "prefix"]
+
+
+def test_route_table_agrees_with_linear_scan():
+    rng = random.Random(0)
+    segments = [
+        "mpay",
+        "api",
+        "games",
+        "h55",
+        "qrcode",
+        "pc_config",
+        "bench1",
+        "path",
+        "",
+    ]
+    paths = [
+        "/"
+        + "/".join(rng.choices(segments, k=rng.randint(0, 5)))
+        + rng.choice(["", "?a=1"])
+        for _ in range(300)
+    ]
+    for make_path in ROUTE_SHAPES.values():
+        routes = plugin.RequestRoutes + plugin.ResponseRoutes
+        routes += [(f"r{i}", make_path(i)) for i in range(8)]
+        rng.shuffle(routes)
+        table = plugin.RouteTable(routes)
+        for path in paths + [p for _, p in routes]:
+            assert table.match(path) == linear_match(routes, path), path
+
+
+def test_event_channel_delivers_events_in_order():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        channel = plugin.EventChannel()
+        channel.connect(f"127.0.0.1:{server.getsockname()[1]}")
+        conn, _ = server.accept()
+        for i in range(1000):
+            channel.emit("INFO", i)
+        channel.close()  # 发送完已排队的事件后断开
+        with conn, conn.makefile("rb") as lines:
+            payloads = [json.loads(line)["payload"] for line in lines]
+    assert payloads == list(range(1000))
+    assert channel.dropped == 0
+
+
+def test_event_channel_drops_instead_of_blocking():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        channel = plugin.EventChannel(max_pending=100)
+        channel.connect(f"127.0.0.1:{server.getsockname()[1]}")
+        conn, _ = server.accept()  # 接收方从不读取, 发送缓冲区很快写满
+
+        def emit_all():
+            for _ in range(2000):
+                channel.emit("INFO", "x" * 10000)
+
+        emitter = threading.Thread(target=emit_all, daemon=True)
+        emitter.start()
+        emitter.join(5)
+        try:
+            assert not emitter.is_alive()
+            assert channel.dropped > 0
+        finally:
+            channel.close(timeout=0.1)
+            conn.close()
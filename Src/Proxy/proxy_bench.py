@@ -0,0 +1,606 @@
+"""代理端到端基准
+
+events: 插件的 EventChannel 连接 MitmproxyManager 在托管事件循环中监听的事件通道,
+        经 _receive_events 解析为 MitmEvent、_handle_event 路由到日志并写入输出缓冲区,
+        统计从第一条事件发出到最后一条事件写入输出缓冲区的 events/sec
+cpu:    在本进程的事件循环线程中运行加载了插件的 DumpMaster, 客户端经代理从本地HTTPS替身上游下载,
+        对比选择性拦截(上游不在拦截名单中, TLS直接透传)与拦截全部连接时代理线程每MB的CPU时间
+stream: 同样的进程内代理, 客户端经代理从本地HTTP替身上游下载大文件(插件不改写的路径),
+        对比完整插件(响应头阶段开启流式转发)与只有 request/response 阶段的插件(完整缓冲消息体)
+        的峰值RSS与首字节时间
+routes: 插件路由表(RouteTable)与逐条编译、预编译后逐条匹配的单次分发耗时, 增加的路由与
+        测试路径共享 /mpay/api/ 前缀: 字面量形状在共享前缀后的字面量路径段分叉, 前缀树可剪掉;
+        通配形状在共享前缀后紧跟正则, 全部成为候选路由, 仍需逐条匹配
+form:   插件在原始字节上改写登录表单cv字段(rewrite_form_cv)与解码-修改-编码的单次耗时
+startup: MitmproxyManager 内嵌模式与子进程模式从启动到代理端口可连接、以及停止的耗时,
+        首次启动包含导入mitmproxy或启动解释器的冷启动开销, 单独列出
+cpu/stream/startup 的每种模式在单独的子进程中运行, 峰值RSS与导入缓存等互不影响
+
+python -m Src.Proxy.proxy_bench events -n 20000
+python -m Src.Proxy.proxy_bench events -n 20000 --quiet
+python -m Src.Proxy.proxy_bench cpu --size 200
+python -m Src.Proxy.proxy_bench stream --size 500
+python -m Src.Proxy.proxy_bench routes
+python -m Src.Proxy.proxy_bench form
+python -m Src.Proxy.proxy_bench startup --rounds 5
+"""
+
+import argparse
+import asyncio
+import http.server
+import json
+import logging
+import re
+import socket
+import socketserver
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode
+
+MB = 1024 * 1024
+_CHUNK = bytes(range(256)) * (MB // 256)
+
+# 插件常见的事件组合: 改写请求、处理结果日志、捕获的二维码
+EVENTS = (
+    ("REQUEST", "/mpay/games/h55/login_methods?app_channel=netease"),
+    ("INFO", "登录方法配置已修改"),
+    ("QRCode", {"uuid": "4f1c0a9e", "game_id": "h55", "qrcode_scanner_url": ""}),
+)
+
+
+def bench_events(n: int, quiet: bool = False) -> dict:
+    from Src.Proxy.plugin import MITM_4_service_mkey_163_com as plugin
+    from Src.ThirdPartyManager.mitmproxy import MitmproxyManager
+
+    manager = MitmproxyManager(embedded=False, output_capacity=n)
+    received = threading.Semaphore(0)
+    unsubscribe = manager.output.subscribe(lambda seq, item: received.release())
+    port = manager._open_event_channel()
+    plugin.events.connect(f"127.0.0.1:{port}")
+    plugin.events.dropped = 0
+    logger = logging.getLogger("runtime_log")
+    logger.disabled = quiet
+    try:
+        start = time.perf_counter()
+        for i in range(n):
+            event_type, payload = EVENTS[i % len(EVENTS)]
+            plugin.events.emit(event_type, payload)
+        sent = time.perf_counter() - start
+        # 写线程队列已满时丢弃的事件不会到达
+        deadline = time.monotonic() + max(60.0, n / 1000)
+        for _ in range(n - plugin.events.dropped):
+            if not received.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                raise TimeoutError(f"只收到 {manager.output.next_seq}/{n} 条事件")
+        elapsed = time.perf_counter() - start
+    finally:
+        logger.disabled = False
+        plugin.events.close()
+        manager._close_event_channel()
+        unsubscribe()
+    return {
+        "events": n,
+        "dropped": plugin.events.dropped,
+        "send_s": sent,
+        "total_s": elapsed,
+        "events_per_sec": (n - plugin.events.dropped) / elapsed,
+    }
+
+
+def _quiet_log_message(self, *args):
+    pass
+
+
+class LocalHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """监听 127.0.0.1 随机端口的多线程HTTP服务器, 不输出访问日志
+
+    基准的替身上游与测试中的替身服务器共用, 测试经 conftest 的 http_server 夹具使用
+
+    Args:
+        handler: 请求处理类
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handler: type[http.server.BaseHTTPRequestHandler]):
+        quiet = type(handler.__name__, (handler,), {"log_message": _quiet_log_message})
+        super().__init__(("127.0.0.1", 0), quiet)
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def serve_in_background(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Upstream(LocalHTTPServer):
+    """本地替身上游, GET /blob/{字节数} 返回指定大小的响应体
+
+    Args:
+        tls: 是否以自签名证书提供HTTPS
+    """
+
+    def __init__(self, tls: bool = False):
+        super().__init__(_BlobHandler)
+        self.scheme = "http"
+        if tls:
+            self.socket = _self_signed_context().wrap_socket(
+                self.socket, server_side=True
+            )
+            self.scheme = "https"
+        self.serve_in_background()
+
+    def url(self, size: int) -> str:
+        return f"{self.scheme}://127.0.0.1:{self.server_address[1]}/blob/{size}"
+
+
+class _BlobHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        size = int(self.path.rsplit("/", 1)[-1])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        chunk = memoryview(_CHUNK)
+        try:
+            for offset in range(0, size, len(chunk)):
+                self.wfile.write(chunk[: size - offset])
+        except OSError:
+            pass  # 客户端已断开
+
+
+def _self_signed_context() -> ssl.SSLContext:
+    from cryptography.hazmat.primitives import serialization
+    from mitmproxy.certs import create_ca
+
+    key, cert = create_ca("proxy_bench", "127.0.0.1", 2048)
+    with tempfile.NamedTemporaryFile("wb", suffix=".pem", delete=False) as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption(),
+            )
+        )
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(f.name)
+    Path(f.name).unlink()
+    return context
+
+
+class InProcessProxy:
+    """在独立的事件循环线程中运行加载了插件的 DumpMaster, 与内嵌模式的 MitmproxyManager 一致
+
+    Args:
+        addon: 插件实例
+        **options: 额外的mitmproxy或插件选项, 如 intercept_hosts
+    """
+
+    def __init__(self, addon, timeout: float = 10, **options):
+        from mitmproxy import options as mitm_options
+        from mitmproxy.tools.dump import DumpMaster
+
+        with socket.create_server(("127.0.0.1", 0)) as s:
+            self.port = s.getsockname()[1]
+        self._confdir = tempfile.TemporaryDirectory(prefix="proxy_bench_")
+        self.thread_id: Optional[int] = None  # 事件循环线程的系统线程id
+        self._master = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        started = threading.Event()
+
+        async def _run():
+            opts = mitm_options.Options(
+                listen_host="127.0.0.1",
+                listen_port=self.port,
+                confdir=self._confdir.name,
+                ssl_insecure=True,
+            )
+            self._master = DumpMaster(opts, with_termlog=False, with_dumper=False)
+            self._master.addons.add(addon)
+            opts.update(**options)
+            self._loop = asyncio.get_running_loop()
+            self.thread_id = threading.get_native_id()
+            started.set()
+            try:
+                await self._master.run()
+            finally:
+                if proxyserver := self._master.addons.get("proxyserver"):
+                    await proxyserver.servers.update([])
+
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(_run(),), name="ProxyBenchLoop", daemon=True
+        )
+        self._thread.start()
+        if not started.wait(timeout):
+            raise RuntimeError("mitmproxy启动失败")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), 0.1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("mitmproxy端口未就绪")
+                time.sleep(0.02)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def thread_cpu_time(self) -> float:
+        """事件循环线程已消耗的CPU时间(秒)"""
+        import psutil
+
+        for thread in psutil.Process().threads():
+            if thread.id == self.thread_id:
+                return thread.user_time + thread.system_time
+        raise RuntimeError("未找到mitmproxy事件循环线程")
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._master.shutdown)
+        self._thread.join(10)
+        self._confdir.cleanup()
+
+
+def _plugin_addon():
+    from Src.Proxy.plugin import MITM_4_service_mkey_163_com as plugin
+
+    plugin.events.set_sink(lambda event: None)  # 丢弃插件事件
+    return plugin, plugin.Proxy_service_mkey_163_com()
+
+
+def _download(client, url: str) -> tuple[int, float]:
+    """下载并丢弃响应体, 返回 (字节数, 首字节时间)"""
+    start = time.perf_counter()
+    ttfb = None
+    received = 0
+    with client.stream("GET", url) as response:
+        response.raise_for_status()
+        for chunk in response.iter_raw(64 * 1024):
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            received += len(chunk)
+    return received, ttfb
+
+
+def bench_cpu(mode: str, size_mb: int) -> dict:
+    """mode: selective 只拦截插件的域名, 上游以TLS透传; all 拦截全部连接"""
+    import httpx
+
+    plugin, addon = _plugin_addon()
+    options = {}
+    if mode == "selective":
+        options["intercept_hosts"] = [plugin.DOMAIN]
+    upstream = Upstream(tls=True)
+    proxy = InProcessProxy(addon, **options)
+    try:
+        with httpx.Client(proxy=proxy.url, verify=False, timeout=60) as client:
+            _download(client, upstream.url(MB))  # 预热: 建立连接与证书
+            cpu_start = proxy.thread_cpu_time()
+            process_start = time.process_time()
+            start = time.perf_counter()
+            received, _ = _download(client, upstream.url(size_mb * MB))
+            elapsed = time.perf_counter() - start
+            proxy_cpu = proxy.thread_cpu_time() - cpu_start
+            process_cpu = time.process_time() - process_start
+    finally:
+        proxy.close()
+        upstream.close()
+    assert received == size_mb * MB, received
+    return {
+        "mode": mode,
+        "mb": size_mb,
+        "elapsed_s": elapsed,
+        "mb_per_s": size_mb / elapsed,
+        "proxy_cpu_ms_per_mb": proxy_cpu * 1000 / size_mb,
+        "process_cpu_ms_per_mb": process_cpu * 1000 / size_mb,
+    }
+
+
+class _BufferedAddon:
+    """只有 request/response 阶段的插件, 即增加 requestheaders/responseheaders 之前的行为"""
+
+    def __init__(self, addon):
+        self._addon = addon
+
+    def load(self, loader):
+        self._addon.load(loader)
+
+    def request(self, flow):
+        self._addon.request(flow)
+
+    def response(self, flow):
+        self._addon.response(flow)
+
+
+class _PeakRSS:
+    """在后台线程中定时采样本进程的RSS, 记录峰值"""
+
+    def __init__(self, interval: float = 0.005):
+        import psutil
+
+        self._process = psutil.Process()
+        self._interval = interval
+        self._stop = threading.Event()
+        self.peak = self._process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self._interval):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def __enter__(self) -> "_PeakRSS":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def bench_stream(mode: str, size_mb: int) -> dict:
+    """mode: streamed 完整插件; buffered 不含响应头阶段的插件"""
+    import httpx
+
+    _, addon = _plugin_addon()
+    if mode == "buffered":
+        addon = _BufferedAddon(addon)
+    upstream = Upstream()
+    proxy = InProcessProxy(addon)
+    try:
+        # 缓冲模式下首字节要等整个响应体收完, 不设读取超时
+        with httpx.Client(proxy=proxy.url, timeout=None) as client:
+            _download(client, upstream.url(MB))  # 预热
+            with _PeakRSS() as rss:
+                baseline = rss.peak
+                start = time.perf_counter()
+                received, ttfb = _download(client, upstream.url(size_mb * MB))
+                elapsed = time.perf_counter() - start
+    finally:
+        proxy.close()
+        upstream.close()
+    assert received == size_mb * MB, received
+    return {
+        "mode": mode,
+        "mb": size_mb,
+        "ttfb_ms": ttfb * 1000,
+        "elapsed_s": elapsed,
+        "baseline_rss_mb": baseline / MB,
+        "peak_rss_mb": rss.peak / MB,
+    }
+
+
+ROUTE_SHAPES = {
+    "literal": lambda i: rf"/mpay/api/bench{i}/.*/path",
+    "wildcard": lambda i: rf"/mpay/api/.*/bench{i}",
+}
+ROUTE_TEST_PATH = "/mpay/api/users/login/qrcode/exchange_token?app_channel=netease"
+
+
+def linear_match(routes: list[tuple[str, str]], path: str) -> Optional[str]:
+    """RouteTable 之前的实现: 每个flow逐条编译并匹配, 返回先声明的命中路由"""
+    for name, pattern in routes:
+        if re.compile(pattern).match(path):
+            return name
+    return None
+
+
+def bench_routes(number: int) -> list[dict]:
+    from Src.Proxy.plugin import MITM_4_service_mkey_163_com as plugin
+
+    results = []
+    for shape, make_path in ROUTE_SHAPES.items():
+        for n in (4, 16, 64, 256):
+            routes = [(f"r{i}", make_path(i)) for i in range(n)]
+            routes += plugin.ResponseRoutes
+            table = plugin.RouteTable(routes)
+            compiled = [(name, re.compile(path)) for name, path in routes]
+            assert table.match(ROUTE_TEST_PATH) == "qrcode_login"
+
+            def precompiled():
+                for name, pattern in compiled:
+                    if pattern.match(ROUTE_TEST_PATH):
+                        return name
+
+            result = {"shape": shape, "routes": len(routes)}
+            for name, func in (
+                ("linear", lambda: linear_match(routes, ROUTE_TEST_PATH)),
+                ("precompiled", precompiled),
+                ("table", lambda: table.match(ROUTE_TEST_PATH)),
+            ):
+                result[name] = timeit.timeit(func, number=number) / number * 1e6
+            results.append(result)
+    return results
+
+
+# 典型的登录表单, cv与arch位于中间
+LOGIN_FORM = (
+    b"username=player%40163.com&password=5f4dcc3b5aa765d61d8327deb882cf99"
+    b"&unique_id=AABBCCDDEEFF0011&cv=a5.10.0&arch=win_x64&app_channel=netease"
+    b"&sv=32&gv=1.0.0&app_type=games&nickname=%E7%8E%A9%E5%AE%B6"
+    b"&opt_fields=nickname%2Cavatar%2Crealname_status%2Cmobile_bind_status"
+)
+
+
+def decode_form(content: bytes) -> dict:
+    """解码urlencoded表单, 重复字段只保留第一个"""
+    data = {}
+    for key, value in parse_qsl(content.decode("utf-8"), keep_blank_values=True):
+        data.setdefault(key, value)
+    return data
+
+
+def rewrite_form_cv_by_decode(content: bytes, cv: str) -> bytes:
+    """rewrite_form_cv 之前的实现: 解码整个表单, 修改后重新编码"""
+    data = decode_form(content)
+    data["cv"] = cv
+    data.pop("arch", None)
+    return urlencode(data).encode("utf-8")
+
+
+def bench_form(number: int) -> dict:
+    from Src.Proxy.plugin import MITM_4_service_mkey_163_com as plugin
+
+    results = {}
+    for name, func in (
+        ("decode", rewrite_form_cv_by_decode),
+        ("bytes", plugin.rewrite_form_cv),
+    ):
+        t = timeit.timeit(lambda: func(LOGIN_FORM, "i4.7.0"), number=number)
+        results[name] = t / number * 1e6
+    return results
+
+
+def _default_mitmdump() -> Path:
+    from Src.ThirdPartyManager.mitmproxy import MitmproxyManager
+
+    path = MitmproxyManager(embedded=False).mitmproxy_path
+    return path if path.exists() else Path(sys.executable).with_name("mitmdump")
+
+
+def bench_startup(mode: str, rounds: int, mitmdump: Path) -> dict:
+    from Src.ThirdPartyManager.mitmproxy import MitmproxyManager
+
+    plugin_path = Path(__file__).parent / "plugin" / "MITM_4_service_mkey_163_com.py"
+    starts, stops = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        # 子进程模式从 mitmdump 所在目录加载插件
+        core = Path(tmp) / "mitmdump.exe"
+        core.symlink_to(mitmdump)
+        shutil.copy(plugin_path, Path(tmp) / plugin_path.name)
+        for _ in range(rounds):
+            with socket.create_server(("127.0.0.1", 0)) as s:
+                port = s.getsockname()[1]
+            manager = MitmproxyManager(port, embedded=mode == "embedded")
+            manager.mitmproxy_path = core
+            manager.qrcode_store_path = Path(tmp) / "qrcode_sessions.json"
+            start = time.perf_counter()
+            manager.start_mitmproxy()
+            manager.wait_ready(30)
+            starts.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            manager.stop_mitmproxy()
+            stops.append(time.perf_counter() - start)
+    return {
+        "mode": mode,
+        "first_start_ms": starts[0] * 1000,
+        "start_ms": statistics.median(starts[1:] or starts) * 1000,
+        "stop_ms": statistics.median(stops) * 1000,
+    }
+
+
+def _run_modes(bench: str, modes: tuple[str, ...], args: list[str]) -> list[dict]:
+    """每种模式在单独的子进程中运行"""
+    results = []
+    for mode in modes:
+        output = subprocess.run(
+            [sys.executable, "-m", __spec__.name, bench, "--mode", mode, *args],
+            cwd=Path(__file__).parents[2],
+            stdout=subprocess.PIPE,
+            check=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="代理端到端基准")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    events = sub.add_parser("events", help="插件事件通道 events/sec")
+    events.add_argument("-n", "--events", type=int, default=20000)
+    events.add_argument(
+        "--quiet", action="store_true", help="计时期间关闭日志输出, 只测通道与解析"
+    )
+    cpu = sub.add_parser("cpu", help="选择性拦截与全部拦截的每MB CPU时间")
+    cpu.add_argument("--size", type=int, default=200, help="下载大小(MB)")
+    cpu.add_argument("--mode", choices=("selective", "all"), help="只运行一种模式")
+    stream = sub.add_parser("stream", help="流式转发与完整缓冲的峰值RSS与首字节时间")
+    stream.add_argument("--size", type=int, default=500, help="下载大小(MB)")
+    stream.add_argument(
+        "--mode", choices=("buffered", "streamed"), help="只运行一种模式"
+    )
+    routes = sub.add_parser("routes", help="路由分发的单次耗时")
+    routes.add_argument("-n", "--number", type=int, default=2000)
+    form = sub.add_parser("form", help="登录表单cv字段改写的单次耗时")
+    form.add_argument("-n", "--number", type=int, default=20000)
+    startup = sub.add_parser("startup", help="内嵌模式与子进程模式的启动、停止耗时")
+    startup.add_argument("--rounds", type=int, default=5, help="每种模式启动次数")
+    startup.add_argument(
+        "--mitmdump", type=Path, help="子进程模式使用的mitmdump, 默认为应用目录中的"
+    )
+    startup.add_argument(
+        "--mode", choices=("embedded", "subprocess"), help="只运行一种模式"
+    )
+    args = parser.parse_args()
+
+    if args.bench == "events":
+        result = bench_events(args.events, args.quiet)
+        print(
+            f"事件通道: {result['events']} events, 丢弃 {result['dropped']},"
+            f" 发送 {result['send_s'] * 1000:.0f}ms,"
+            f" 处理完成 {result['total_s'] * 1000:.0f}ms,"
+            f" {result['events_per_sec']:,.0f} events/sec"
+        )
+    elif args.bench == "routes":
+        for r in bench_routes(args.number):
+            print(
+                f"{r['shape']:<9} routes={r['routes']:4d}"
+                f" 逐条编译: {r['linear']:8.2f}us 预编译逐条: {r['precompiled']:8.2f}us"
+                f" 路由表: {r['table']:8.2f}us"
+            )
+    elif args.bench == "form":
+        result = bench_form(args.number)
+        print(
+            f"表单改写 解码-编码: {result['decode']:.2f}us"
+            f" 字节级: {result['bytes']:.2f}us"
+        )
+    elif args.bench == "startup" and args.mode:
+        mitmdump = args.mitmdump or _default_mitmdump()
+        print(json.dumps(bench_startup(args.mode, args.rounds, mitmdump)))
+    elif args.bench == "startup":
+        print(f"{'模式':<12}{'首次启动':>10}{'启动':>10}{'停止':>10}")
+        options = ["--rounds", str(args.rounds)]
+        if args.mitmdump:
+            options += ["--mitmdump", str(args.mitmdump)]
+        for r in _run_modes("startup", ("embedded", "subprocess"), options):
+            print(
+                f"{r['mode']:<14}{r['first_start_ms']:>10.0f}ms"
+                f"{r['start_ms']:>10.0f}ms{r['stop_ms']:>10.0f}ms"
+            )
+    elif args.mode:
+        bench = bench_cpu if args.bench == "cpu" else bench_stream
+        print(json.dumps(bench(args.mode, args.size)))
+    elif args.bench == "cpu":
+        print(f"{'模式':<10}{'MB/s':>8}{'代理线程CPU/MB':>16}{'进程CPU/MB':>14}")
+        for r in _run_modes("cpu", ("selective", "all"), ["--size", str(args.size)]):
+            print(
+                f"{r['mode']:<12}{r['mb_per_s']:>8.1f}"
+                f"{r['proxy_cpu_ms_per_mb']:>16.2f}ms"
+                f"{r['process_cpu_ms_per_mb']:>12.2f}ms"
+            )
+    else:
+        print(f"{'模式':<10}{'首字节':>10}{'总耗时':>10}{'基线RSS':>10}{'峰值RSS':>10}")
+        modes = ("buffered", "streamed")
+        for r in _run_modes("stream", modes, ["--size", str(args.size)]):
+            print(
+                f"{r['mode']:<12}{r['ttfb_ms']:>10.0f}ms{r['elapsed_s']:>10.2f}s"
+                f"{r['baseline_rss_mb']:>10.0f}MB{r['peak_rss_mb']:>10.0f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 """用于启动代理进程"""
 
-import sys
+import time
 from typing import Optional
 
 from Src.Proxy.ssl_cert_manager import (
@@ -9,6 +9,7 @@ from Src.Proxy.ssl_cert_manager import (
     build_new_ca_certs,
     install_certificate,
 )
+from Src.Proxy.startup_graph import StartupTask, TaskResult, run_graph, run_in_thread
 from Src.ThirdPartyManager.mihomo import (
     download_main,
     create_config_mihomo_yaml,
@@ -20,85 +21,127 @@ from Src.ThirdPartyManager.mitmproxy import (
     move_plugin_to_app_dir_path,
     MitmproxyManager,
 )
+from Src.ThirdPartyManager.supervisor import ProcessSupervisor
 from Src.config import cfg
-from Src.runtimeLog import info, warning
+from Src.runtimeLog import info, warning, error
+
+
+def _install_ca_cert():
+    warning("CA证书未安装")
+    # 检查是否已有证书文件
+    if check_ca_certs_exist() is False:
+        if build_new_ca_certs() is False:
+            raise RuntimeError("构建CA证书失败")
+    install_certificate(cfg["certs_path"]["ca_cert"])
+
+
+async def _download_mihomo():
+    warning("缺失mihomo.exe, 自动下载")
+    await download_main()
+
+
+def _create_mihomo_config():
+    warning("缺失mihomo配置文件，自动创建")
+    create_config_mihomo_yaml()
+
+
+def _copy_plugin():
+    warning("缺失plugin文件，自动创建")
+    move_plugin_to_app_dir_path()
+
+
+def preflight_tasks() -> list[StartupTask]:
+    """启动前检查: CA证书、mihomo核心与配置、mitmproxy核心与插件"""
+    return [
+        StartupTask("ca_cert", _install_ca_cert, check_ca_certs_install),
+        StartupTask(
+            "mihomo_core", _download_mihomo, lambda: check_mihomo_exist() not in (1, 3)
+        ),
+        # 配置文件写入下载时创建的目录
+        StartupTask(
+            "mihomo_config",
+            _create_mihomo_config,
+            lambda: check_mihomo_exist() not in (2, 3),
+            deps=("mihomo_core",),
+        ),
+        # TODO: 缺失mitmdump.exe时自动下载; 内嵌模式不需要mitmdump.exe
+        StartupTask(
+            "mitmdump",
+            check=lambda: cfg["proxy"]["mitmproxy_embedded"]
+            or check_mitmproxy_exist() not in (1, 3),
+        ),
+        StartupTask(
+            "mitm_plugin", _copy_plugin, lambda: check_mitmproxy_exist() not in (2, 3)
+        ),
+    ]
+
+
+def _log_results(stage: str, results: dict[str, TaskResult], elapsed: float):
+    fixed = [name for name, result in results.items() if result.fixed]
+    if fixed:
+        info(
+            f"{stage}完成(冷启动, 已修复: {', '.join(fixed)}), 耗时 {elapsed * 1000:.0f}ms"
+        )
+    else:
+        info(f"{stage}完成(热启动), 耗时 {elapsed * 1000:.0f}ms")
 
 
 def check_completeness():
-    need_check_again_flag = False
-    # 检查CA证书
-    if check_ca_certs_install() is False:
-        need_check_again_flag = True
-        warning("CA证书未安装")
-        # 检查是否已有证书文件
-        if check_ca_certs_exist() is False:
-            if build_new_ca_certs() is False:
-                sys.exit(2)
-        install_certificate(cfg["certs_path"]["ca_cert"])
-    else:
-        info("CA证书完整")
-
-    # 检查mihomo核心与配置文件
-    _ = check_mihomo_exist()
-    if _ != 0:
-        need_check_again_flag = True
-
-    if _ == 1:
-        # 缺失mihomo.exe
-        warning("缺失mihomo.exe, 自动下载")
-        download_main()
-    elif _ == 2:
-        warning("缺失mihomo配置文件，自动创建")
-        create_config_mihomo_yaml()
-    elif _ == 3:
-        warning("缺失mihomo相关组件, 自动处理中")
-        download_main()
-        create_config_mihomo_yaml()
-    else:
-        info("mihomo核心与配置文件完整")
-
-    # 检查mitmproxy核心与配置文件
-    _ = check_mitmproxy_exist()
-    if _ != 0:
-        need_check_again_flag = True
-
-    if _ == 1:
-        # 缺失mitmdump.exe
-        warning("缺失mitmdump.exe, 自动下载")
-        # TODO: 未完成
-        pass
-    elif _ == 2:
-        warning("缺失plugin文件，自动创建")
-        move_plugin_to_app_dir_path()
-    elif _ == 3:
-        warning("缺失mitmproxy相关组件, 自动处理中")
-
-        move_plugin_to_app_dir_path()
-    else:
-        info("mitmproxy核心与配置文件完整")
-
-    if need_check_again_flag:
-        return check_completeness()
-    else:
-        return
+    """并发执行启动前检查, 未通过的项自动修复并复查"""
+    start = time.monotonic()
+    results = ProcessSupervisor.get().run(run_graph(preflight_tasks()))
+    _log_results("启动前检查", results, time.monotonic() - start)
 
 
 Mihomo: Optional[MihomoManager] = None
 Mitmproxy: Optional[MitmproxyManager] = None
 
 
-def start_all():
-    global Mihomo, Mitmproxy
-    check_completeness()
-    # 启动Mihomo
-    Mihomo = MihomoManager()
-    Mihomo.start_mihomo()
+def start_all() -> dict[str, float]:
+    """检查并启动mihomo与mitmproxy, 两者均就绪后返回
 
-    # 启动Mitmproxy
+    启动前检查与两个组件的启动按依赖关系并发执行: mitmproxy只依赖证书与自身文件,
+    可以在mihomo下载核心或建立TUN的同时启动
+    Returns:
+        各组件自启动起的就绪耗时(秒)
+    Raises:
+        任一任务失败或组件未能就绪时抛出原异常(如TimeoutError), 此时已停止全部组件
+    """
+    global Mihomo, Mitmproxy
+    timeout = cfg["proxy"]["ready_timeout"]
     Mitmproxy = MitmproxyManager()
-    Mitmproxy.start_mitmproxy()
+    Mihomo = MihomoManager()
 
-    pass
+    # 启动在线程中执行, 等待就绪在事件循环中执行: 另一组件失败时等待可以立即取消,
+    # 而已开始的启动会执行完毕后才停止全部组件, 不会在停止之后再启动进程或布置看门狗
+    async def _start_mitmproxy() -> float:
+        await run_in_thread(Mitmproxy.start_mitmproxy)
+        return await Mitmproxy.ready(timeout)
+
+    async def _start_mihomo() -> float:
+        await run_in_thread(Mihomo.start_mihomo)
+        return await Mihomo.ready(timeout)
+
+    tasks = preflight_tasks() + [
+        StartupTask(
+            "mitmproxy", _start_mitmproxy, deps=("ca_cert", "mitmdump", "mitm_plugin")
+        ),
+        StartupTask("mihomo", _start_mihomo, deps=("mihomo_core", "mihomo_config")),
+    ]
+    start = time.monotonic()
+    try:
+        results = ProcessSupervisor.get().run(run_graph(tasks))
+    except Exception as e:
+        error(f"代理组件未能就绪: {e}")
+        stop_all()
+        raise
+    _log_results("代理启动", results, time.monotonic() - start)
+    ready = {name: results[name].value for name in ("mitmproxy", "mihomo")}
+    info(
+        "代理已就绪: "
+        + ", ".join(f"{name} {t * 1000:.0f}ms" for name, t in ready.items())
+    )
+    return ready
 
 
 def stop_all():
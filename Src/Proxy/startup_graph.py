@@ -0,0 +1,125 @@
+"""启动依赖图
+
+将启动前检查与子进程启动描述为带依赖的任务, 相互独立的任务并发执行.
+每个任务先检查, 未通过时执行修复并仅对该任务复查一次, 不再整体重复检查.
+"""
+
+import asyncio
+import inspect
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from Src.runtimeLog import debug
+
+
+@dataclass
+class StartupTask:
+    """启动图中的一个任务
+
+    Attributes:
+        name: 任务名称, 供其他任务在deps中引用
+        fix: 检查未通过时执行的修复; 没有check的任务直接执行(如启动进程)
+        check: 返回True表示已满足
+        deps: 依赖的任务名称, 全部完成后才开始执行
+    """
+
+    name: str
+    fix: Optional[Callable[[], Any]] = None
+    check: Optional[Callable[[], bool]] = None
+    deps: tuple[str, ...] = ()
+
+
+@dataclass
+class TaskResult:
+    elapsed: float  # 任务耗时(秒), 不含等待依赖的时间
+    fixed: bool  # 是否因检查未通过而执行了修复
+    value: Any = None  # fix的返回值
+
+
+async def run_in_thread(fn: Callable[[], Any]) -> Any:
+    """在线程池中执行普通函数
+
+    取消只能中断等待而无法中断线程, 被取消时先等线程中的调用结束再传递取消,
+    保证调用方收到取消时没有仍在执行的调用(如正在启动进程、布置看门狗)
+    """
+    future = asyncio.ensure_future(asyncio.to_thread(fn))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        while not future.done():
+            try:
+                await asyncio.wait([future])
+            except asyncio.CancelledError:
+                pass
+        if not future.cancelled():
+            future.exception()  # 已被取消, 不再关心结果, 取回异常避免未处理的警告
+        raise
+
+
+async def _call(fn: Callable[[], Any]) -> Any:
+    """协程函数直接等待, 普通函数放到线程池中执行, 避免阻塞事件循环"""
+    if inspect.iscoroutinefunction(fn):
+        return await fn()
+    return await run_in_thread(fn)
+
+
+def _topological_order(tasks: list[StartupTask]) -> list[StartupTask]:
+    by_name = {task.name: task for task in tasks}
+    order, visiting, visited = [], set(), set()
+
+    def visit(task: StartupTask):
+        if task.name in visited:
+            return
+        if task.name in visiting:
+            raise ValueError(f"启动任务存在循环依赖: {task.name}")
+        visiting.add(task.name)
+        for dep in task.deps:
+            if dep not in by_name:
+                raise ValueError(f"启动任务 {task.name} 依赖未知任务 {dep}")
+            visit(by_name[dep])
+        visiting.discard(task.name)
+        visited.add(task.name)
+        order.append(task)
+
+    for task in tasks:
+        visit(task)
+    return order
+
+
+async def _run_task(task: StartupTask, deps: list[asyncio.Task]) -> TaskResult:
+    for dep in deps:
+        await dep  # 依赖失败时异常向上传递, 本任务不再执行
+    start = time.monotonic()
+    if task.check is not None and await _call(task.check):
+        return TaskResult(time.monotonic() - start, False)
+    if task.fix is None:
+        raise RuntimeError(f"{task.name} 检查未通过且无法自动修复")
+    value = await _call(task.fix)
+    if task.check is not None and not await _call(task.check):
+        raise RuntimeError(f"{task.name} 修复后仍未通过检查")
+    return TaskResult(time.monotonic() - start, task.check is not None, value)
+
+
+async def run_graph(tasks: list[StartupTask]) -> dict[str, TaskResult]:
+    """按依赖关系并发执行任务, 任一任务失败时取消尚未完成的任务并抛出其异常
+    抛出异常前等待全部任务结束, 包括线程中已开始执行的调用
+    """
+    running: dict[str, asyncio.Task] = {}
+    for task in _topological_order(tasks):
+        deps = [running[dep] for dep in task.deps]
+        running[task.name] = asyncio.create_task(_run_task(task, deps), name=task.name)
+    try:
+        await asyncio.gather(*running.values())
+    except BaseException:
+        for pending in running.values():
+            pending.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        raise
+    results = {name: t.result() for name, t in running.items()}
+    for name, result in results.items():
+        debug(
+            f"启动任务 {name}: {result.elapsed * 1000:.0f}ms"
+            + (" (已修复)" if result.fixed else "")
+        )
+    return results
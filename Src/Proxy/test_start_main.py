@@ -0,0 +1,137 @@
+"""start_all 并发启动与失败时停止全部组件的测试
+
+替身可执行文件: mitmdump.exe 在 -p 指定的端口上监听, mihomo.exe 在配置文件的
+external-controller 上提供 /version(broken 时只运行不提供), 每次启动向 launches 文件追加一行
+"""
+
+import os
+import socket
+import stat
+import sys
+import textwrap
+import time
+
+import psutil
+import pytest
+
+from Src.Proxy import start_main
+from Src.Proxy.startup_graph import StartupTask
+from Src.ThirdPartyManager import mihomo, mitmproxy
+from Src.config import cfg
+
+STAND_IN = textwrap.dedent(
+    """
+    import http.server, socket, sys, time
+
+    LAUNCHES, KIND, BROKEN = {launches!r}, {kind!r}, {broken!r}
+    with open(LAUNCHES, "a") as f:
+        f.write(KIND + "\\n")
+    args = sys.argv[1:]
+    if KIND == "mitmdump":
+        server = socket.create_server(("127.0.0.1", int(args[args.index("-p") + 1])))
+        while True:
+            server.accept()
+    config = open(args[args.index("-f") + 1]).read()
+    port = int(config.split("external-controller: 127.0.0.1:")[1].split()[0])
+
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/version" or BROKEN:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{{}}")
+
+
+    http.server.HTTPServer(("127.0.0.1", port), Handler).serve_forever()
+    """
+)
+
+
+def _free_port() -> int:
+    with socket.create_server(("127.0.0.1", 0)) as s:
+        return s.getsockname()[1]
+
+
+def _stand_in(path, launches, kind: str, broken=False):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    script = STAND_IN.format(launches=str(launches), kind=kind, broken=broken)
+    path.write_text(f"#!{sys.executable}\n{script}")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+
+
+@pytest.fixture
+def stand_ins(tmp_path, monkeypatch):
+    """在临时应用目录中放置替身核心, 跳过启动前检查, 返回记录启动次数的文件"""
+    monkeypatch.setattr(mihomo, "app_dir_path", tmp_path)
+    monkeypatch.setattr(mitmproxy, "app_dir_path", tmp_path)
+    monkeypatch.setitem(cfg["proxy"], "ready_timeout", 2)
+    monkeypatch.setitem(cfg["proxy"], "watchdog", True)
+    names = ("ca_cert", "mihomo_core", "mihomo_config", "mitmdump", "mitm_plugin")
+    monkeypatch.setattr(
+        start_main,
+        "preflight_tasks",
+        lambda: [StartupTask(name, check=lambda: True) for name in names],
+    )
+    port = _free_port()
+    monkeypatch.setattr(
+        start_main,
+        "MitmproxyManager",
+        lambda: mitmproxy.MitmproxyManager(port, embedded=False),
+    )
+    work_dir = tmp_path / "ThirdParty" / "mihomo"
+    work_dir.mkdir(parents=True)
+    (work_dir / "mihomo_config.yaml").write_text(
+        f"external-controller: 127.0.0.1:{_free_port()}\n"
+    )
+    launches = tmp_path / "launches"
+    _stand_in(
+        tmp_path / "ThirdParty" / "mitmproxy" / "mitmdump.exe", launches, "mitmdump"
+    )
+    yield launches
+    start_main.stop_all()
+
+
+def _pids() -> list[int]:
+    return [
+        start_main.Mitmproxy.mitmproxy_process.pid,
+        start_main.Mihomo.mihomo_process.pid,
+    ]
+
+
+@pytest.mark.skipif(os.name == "nt", reason="替身核心依赖shebang执行")
+def test_start_all_waits_for_both(stand_ins, tmp_path):
+    _stand_in(tmp_path / "ThirdParty" / "mihomo" / "mihomo.exe", stand_ins, "mihomo")
+
+    ready = start_main.start_all()
+
+    assert set(ready) == {"mitmproxy", "mihomo"}
+    assert start_main.Mitmproxy.is_running() and start_main.Mihomo.is_running()
+    pids = _pids()
+    start_main.stop_all()
+    assert not any(psutil.pid_exists(pid) for pid in pids)
+
+
+@pytest.mark.skipif(os.name == "nt", reason="替身核心依赖shebang执行")
+def test_start_all_stops_everything_when_one_fails(stand_ins, tmp_path):
+    _stand_in(
+        tmp_path / "ThirdParty" / "mihomo" / "mihomo.exe",
+        stand_ins,
+        "mihomo",
+        broken=True,
+    )
+
+    with pytest.raises(TimeoutError):
+        start_main.start_all()
+
+    # 失败后两个组件均已停止, 看门狗也已解除, 之后不会再有进程被启动
+    assert not start_main.Mitmproxy.is_running()
+    assert not start_main.Mihomo.is_running()
+    time.sleep(1)
+    assert sorted(stand_ins.read_text().split()) == ["mihomo", "mitmdump"]
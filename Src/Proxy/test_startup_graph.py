@@ -0,0 +1,43 @@
+"""启动依赖图的测试, 与 start_all 相同在常驻的托管事件循环中执行"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from Src.Proxy.startup_graph import StartupTask, run_graph
+from Src.ThirdPartyManager.supervisor import ProcessSupervisor
+
+
+def test_failure_waits_for_running_thread_calls():
+    finished = threading.Event()
+
+    def slow_start():
+        time.sleep(0.3)
+        finished.set()
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("boom")
+
+    tasks = [StartupTask("slow", slow_start), StartupTask("broken", fail)]
+    with pytest.raises(RuntimeError, match="boom"):
+        ProcessSupervisor.get().run(run_graph(tasks))
+    # 线程中已开始的调用执行完毕后才向调用方抛出异常
+    assert finished.is_set()
+
+
+def test_dependents_are_not_started_after_failure():
+    started = []
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    tasks = [
+        StartupTask("broken", fail),
+        StartupTask("after", lambda: started.append(1), deps=("broken",)),
+    ]
+    with pytest.raises(RuntimeError):
+        ProcessSupervisor.get().run(run_graph(tasks))
+    assert started == []
@@ -0,0 +1,581 @@
+"""可续传的分段下载
+
+下载内容先写入 <目标>.part, 各分段进度保存在 <目标>.part.json; 中断后再次下载时,
+若文件未变化(大小与摘要或ETag一致)则从已完成的位置继续. 服务器支持Range时分成多段并发下载,
+全部完成后校验大小与摘要, 再原子替换为目标文件. 给出多个镜像时按探测结果与历史统计选择,
+下载中镜像变慢或出错时切换镜像继续.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional, Sequence, Union
+from urllib.parse import urlsplit
+
+import httpx
+
+from Src.runtimeLog import debug, info, warning
+
+_MIN_SEGMENT_SIZE = 1024 * 1024  # 小于该大小不再拆分
+_STATE_SAVE_INTERVAL = 4 * 1024 * 1024  # 每段每写入该字节数保存一次进度
+
+
+class DownloadError(Exception):
+    """下载失败或校验未通过"""
+
+
+@dataclass
+class DownloadResult:
+    path: Path
+    size: int
+    downloaded: int  # 本次实际下载的字节数, 不含续传前已完成的部分
+    elapsed: float
+    segments: int
+    url: str  # 完成下载时使用的镜像地址
+
+    @property
+    def throughput(self) -> float:
+        """本次下载速度(字节/秒)"""
+        return self.downloaded / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class _Progress:
+    """汇总各分段的进度, 每完成10%输出一次"""
+
+    def __init__(self, total: int, done: int):
+        self.total = total
+        self.done = done
+        self.downloaded = 0
+        self._last_reported = done * 100 // total if total else 0
+
+    def add(self, n: int):
+        self.done += n
+        self.downloaded += n
+        if not self.total:
+            return
+        percent = self.done * 100 // self.total
+        if percent >= self._last_reported + 10:
+            self._last_reported = percent
+            debug(
+                f"Downloaded {self.done / 1024 / 1024:.1f}MB"
+                f" / {self.total / 1024 / 1024:.1f}MB"
+            )
+
+
+class _State:
+    """分段下载进度, segments 为 [起始, 结束(含), 已完成字节数] 列表
+
+    validator 用于识别服务器上的文件(摘要或ETag), 与进度文件中的不一致时重新下载
+    """
+
+    def __init__(
+        self, path: Path, total: int, validator: Optional[str], segments: list
+    ):
+        self.path = path
+        self.total = total
+        self.validator = validator
+        self.segments = segments
+
+    @classmethod
+    def plan(cls, path: Path, total: int, validator: Optional[str], count: int):
+        count = max(1, min(count, total // _MIN_SEGMENT_SIZE))
+        step = -(-total // count)
+        segments = [
+            [start, min(start + step, total) - 1, 0] for start in range(0, total, step)
+        ]
+        return cls(path, total, validator, segments)
+
+    @classmethod
+    def load(
+        cls, path: Path, total: int, validator: Optional[str]
+    ) -> Optional["_State"]:
+        """读取进度文件, 与服务器当前文件不一致时返回None"""
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if data.get("total") != total or data.get("validator") != validator:
+            return None
+        return cls(path, total, validator, data["segments"])
+
+    def save(self):
+        _write_json(
+            self.path,
+            {
+                "total": self.total,
+                "validator": self.validator,
+                "segments": self.segments,
+            },
+        )
+
+    @property
+    def completed(self) -> int:
+        return sum(done for _, _, done in self.segments)
+
+
+def _verify(path: Path, size: Optional[int], digest: Optional[str]):
+    """校验文件大小与摘要, digest 格式为 "算法:十六进制", 如 GitHub 资源的 "sha256:..." """
+    actual = path.stat().st_size
+    if size is not None and actual != size:
+        raise DownloadError(f"文件大小不符: 期望 {size}, 实际 {actual}")
+    if digest:
+        algorithm, _, expected = digest.partition(":")
+        h = hashlib.new(algorithm)
+        with path.open("rb") as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+        if h.hexdigest() != expected.lower():
+            raise DownloadError(
+                f"{algorithm} 摘要不符: 期望 {expected}, 实际 {h.hexdigest()}"
+            )
+
+
+def _write_json(path: Path, data):
+    """写入临时文件后替换, 中途崩溃不会留下不完整的文件"""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _load_cache(cache_path: Path, url: str) -> Optional[dict]:
+    """读取fetch_json的缓存, 文件缺失、损坏、结构不符或属于其他地址时返回None"""
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(cached, dict)
+        or cached.get("url") != url
+        or "data" not in cached
+        or not isinstance(cached.get("fetched_at"), (int, float))
+        or not isinstance(cached.get("etag") or "", str)
+        or not isinstance(cached.get("last_modified") or "", str)
+    ):
+        return None
+    return cached
+
+
+async def fetch_json(
+    url: str,
+    cache_path: Path,
+    max_age: float = 3600,
+    accept: str = "application/json",
+) -> Any:
+    """获取JSON并缓存到磁盘, 带ETag/Last-Modified条件请求
+
+    缓存在max_age秒内直接返回, 过期后以 If-None-Match/If-Modified-Since 重新验证,
+    服务器返回304时沿用缓存; 请求失败(离线、限流)时退回到过期的缓存.
+    无法使用的缓存文件视为没有缓存
+    Args:
+        url: 请求地址
+        cache_path: 缓存文件路径
+        max_age: 缓存的新鲜期(秒)
+        accept: 请求的Accept头, 如GitHub API的 "application/vnd.github+json"
+    Raises:
+        httpx.HTTPError: 请求失败且没有可用的缓存
+    """
+    cached = _load_cache(cache_path, url)
+    if cached is not None and 0 <= time.time() - cached["fetched_at"] < max_age:
+        return cached["data"]
+
+    headers = {"Accept": accept}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        async with httpx.AsyncClient(
+            follow_redirects=True, timeout=httpx.Timeout(10)
+        ) as client:
+            response = await client.get(url, headers=headers)
+            if response.status_code != 304:
+                response.raise_for_status()
+    except httpx.HTTPError as e:
+        if cached is None:
+            raise
+        warning(f"请求 {url} 失败, 使用缓存: {e}")
+        return cached["data"]
+
+    if response.status_code == 304:
+        debug(f"{url} 未变化, 沿用缓存")
+        cached["fetched_at"] = time.time()
+    else:
+        cached = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+            "data": response.json(),
+        }
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    _write_json(cache_path, cached)
+    return cached["data"]
+
+
+@dataclass
+class _ProbeResult:
+    url: str
+    ttfb: float  # 收到响应头的耗时(秒)
+    ranged: bool
+    total: int
+    etag: Optional[str]
+
+
+async def _probe(client: httpx.AsyncClient, url: str) -> _ProbeResult:
+    """请求首字节, 得到响应耗时、是否支持Range、文件大小与ETag"""
+    start = time.monotonic()
+    async with client.stream("GET", url, headers={"Range": "bytes=0-0"}) as response:
+        response.raise_for_status()
+        ttfb = time.monotonic() - start
+        etag = response.headers.get("ETag")
+        if response.status_code == 206:
+            total = int(response.headers["Content-Range"].rpartition("/")[2])
+            return _ProbeResult(url, ttfb, True, total, etag)
+        total = int(response.headers.get("Content-Length", 0))
+        return _ProbeResult(url, ttfb, False, total, etag)
+
+
+def _mirror_key(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+class MirrorStats:
+    """各镜像首字节时间、下载速度与成功率的EWMA统计, 保存到磁盘供下次选择镜像
+
+    Args:
+        path: 统计文件路径, 为None时只在内存中统计
+        alpha: EWMA平滑系数, 越大越偏向最近的样本
+    """
+
+    def __init__(self, path: Optional[Path] = None, alpha: float = 0.3):
+        self.path = path
+        self.alpha = alpha
+        self._data: dict[str, dict[str, float]] = {}
+        if path is not None:
+            try:
+                self._data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                pass
+
+    def get(self, url: str) -> dict[str, float]:
+        return self._data.get(_mirror_key(url), {})
+
+    def update(self, url: str, **samples: float):
+        entry = self._data.setdefault(_mirror_key(url), {})
+        for name, value in samples.items():
+            old = entry.get(name)
+            entry[name] = value if old is None else old + self.alpha * (value - old)
+
+    def estimate(self, probe: _ProbeResult) -> float:
+        """估计从该镜像下载完整文件的耗时, 没有速度记录时只看首字节时间"""
+        entry = self.get(probe.url)
+        seconds = probe.ttfb
+        if entry.get("throughput") and probe.total:
+            seconds += probe.total / entry["throughput"]
+        return seconds / max(entry.get("success", 1.0), 0.1)
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        _write_json(self.path, self._data)
+
+
+async def _race(
+    client: httpx.AsyncClient,
+    urls: list[str],
+    stats: MirrorStats,
+    size: Optional[int],
+    timeout: float = 5,
+) -> list[_ProbeResult]:
+    """并发探测各镜像, 按估计耗时从快到慢返回可用的镜像
+
+    最快的镜像响应后, 其余镜像最多再等待其首字节时间的两倍, 超时的镜像不参与本次下载
+    Raises:
+        DownloadError: 没有可用的镜像
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + timeout
+    tasks = {asyncio.create_task(_probe(client, url)): url for url in urls}
+    pending = set(tasks)
+    results: list[_ProbeResult] = []
+    errors = []
+    while pending:
+        done, pending = await asyncio.wait(
+            pending,
+            timeout=max(deadline - loop.time(), 0),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if not done:
+            break
+        for task in done:
+            url = tasks[task]
+            if task.exception() is None:
+                probe = task.result()
+                stats.update(url, ttfb=probe.ttfb, success=1.0)
+                results.append(probe)
+            else:
+                stats.update(url, success=0.0)
+                errors.append(task.exception())
+                debug(f"镜像 {_mirror_key(url)} 不可用: {task.exception()!r}")
+        if results:
+            deadline = min(deadline, start + max(results[0].ttfb * 2, 0.1))
+    for task in pending:
+        task.cancel()
+        stats.update(tasks[task], ttfb=loop.time() - start)
+    await asyncio.gather(*pending, return_exceptions=True)
+    if not results:
+        raise DownloadError(f"所有镜像均不可用: {errors}")
+
+    # 大小与期望(或最快镜像)不一致的镜像提供的不是同一个文件
+    expected = size or results[0].total
+    results = [p for p in results if not p.total or p.total == expected] or results
+    results.sort(key=stats.estimate)
+    debug(
+        "镜像探测: "
+        + ", ".join(f"{_mirror_key(p.url)} {p.ttfb * 1000:.0f}ms" for p in results)
+    )
+    return results
+
+
+class _MirrorSet:
+    """下载中使用的镜像, 按顺序轮换, 并记录每个镜像的实际下载速度"""
+
+    def __init__(self, urls: list[str], stats: MirrorStats, progress: _Progress):
+        self.urls = urls
+        self.stats = stats
+        self.progress = progress
+        self.index = 0
+        self.switches = 0
+        self._since = time.monotonic()
+        self._done = progress.done
+
+    @property
+    def current(self) -> str:
+        return self.urls[self.index]
+
+    def _record(self):
+        now = time.monotonic()
+        if now - self._since >= 0.5:
+            speed = (self.progress.done - self._done) / (now - self._since)
+            self.stats.update(self.current, throughput=speed)
+        self._since, self._done = now, self.progress.done
+
+    def switch(self, from_url: str, reason: str) -> bool:
+        """从from_url切换到下一个镜像; 已被其他分段切换过时不再重复切换"""
+        if len(self.urls) < 2 or from_url != self.current:
+            return False
+        self._record()
+        self.index = (self.index + 1) % len(self.urls)
+        self.switches += 1
+        warning(
+            f"{reason}, 切换镜像 {_mirror_key(from_url)} -> {_mirror_key(self.current)}"
+        )
+        return True
+
+    def finish(self):
+        self._record()
+
+
+async def _watch_speed(
+    mirrors: _MirrorSet, min_speed: float, interval: float = 1, patience: int = 3
+):
+    """连续patience次采样速度低于min_speed(字节/秒)时切换镜像"""
+    progress = mirrors.progress
+    last, slow = progress.done, 0
+    while True:
+        await asyncio.sleep(interval)
+        speed = (progress.done - last) / interval
+        last = progress.done
+        slow = slow + 1 if speed < min_speed else 0
+        if slow >= patience:
+            slow = 0
+            mirrors.switch(mirrors.current, f"下载速度 {speed / 1024:.0f}KB/s 低于阈值")
+
+
+async def _fetch_segment(
+    client: httpx.AsyncClient,
+    mirrors: _MirrorSet,
+    part_path: Path,
+    state: _State,
+    segment: list,
+    retries: int,
+):
+    """下载一个分段, 连接中断或切换镜像时从已写入的位置继续"""
+    start, end, _ = segment
+    progress = mirrors.progress
+    failures = 0
+    with part_path.open("r+b") as f:
+        while start + segment[2] <= end:
+            url = mirrors.current
+            offset = start + segment[2]
+            unsaved = 0
+            try:
+                async with client.stream(
+                    "GET", url, headers={"Range": f"bytes={offset}-{end}"}
+                ) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise DownloadError(f"{_mirror_key(url)} 不支持Range请求")
+                    f.seek(offset)
+                    async for chunk in response.aiter_bytes():
+                        chunk = chunk[: end + 1 - start - segment[2]]
+                        f.write(chunk)
+                        segment[2] += len(chunk)
+                        progress.add(len(chunk))
+                        unsaved += len(chunk)
+                        if unsaved >= _STATE_SAVE_INTERVAL:
+                            f.flush()
+                            state.save()
+                            unsaved = 0
+                        if url != mirrors.current:
+                            break
+                if url == mirrors.current and start + segment[2] <= end:
+                    raise httpx.RemoteProtocolError("响应提前结束")
+            except (httpx.HTTPError, DownloadError) as e:
+                # 只按连续失败计数, 本次请求写入过数据则重新计数
+                failures = 1 if start + segment[2] > offset else failures + 1
+                mirrors.stats.update(url, success=0.0)
+                if failures > retries:
+                    raise
+                warning(f"分段 {start}-{end} 下载中断, 第{failures}次重试: {e}")
+                if not mirrors.switch(url, f"{_mirror_key(url)} 下载失败"):
+                    await asyncio.sleep(min(0.5 * 2 ** (failures - 1), 10))
+            finally:
+                f.flush()
+                state.save()
+
+
+async def _fetch_whole(
+    client: httpx.AsyncClient, url: str, part_path: Path, progress: _Progress
+):
+    """服务器不支持Range时整体下载, 无法续传"""
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        with part_path.open("wb") as f:
+            async for chunk in response.aiter_bytes():
+                f.write(chunk)
+                progress.add(len(chunk))
+
+
+async def download_file(
+    url: Union[str, Sequence[str]],
+    path: Path,
+    size: Optional[int] = None,
+    digest: Optional[str] = None,
+    segments: int = 4,
+    retries: int = 5,
+    stats_path: Optional[Path] = None,
+    min_speed: float = 0,
+) -> DownloadResult:
+    """下载文件到path, 支持断点续传、分段并发与多镜像
+
+    给出多个镜像时先并发探测, 从估计最快的镜像开始下载; 下载速度持续低于min_speed
+    或镜像出错时, 各分段从已写入的位置切换到下一个镜像继续
+    Args:
+        url: 下载地址, 或同一文件的多个镜像地址
+        path: 目标文件路径, 仅在下载完成并校验通过后才会出现
+        size: 期望的文件大小, 用于校验
+        digest: 期望的摘要, 如 "sha256:<hex>"
+        segments: 服务器支持Range时的最大并发分段数
+        retries: 每个分段连续失败(期间没有写入数据)时的最大重试次数
+        stats_path: 镜像统计文件路径, 用于下次选择镜像
+        min_speed: 触发切换镜像的速度阈值(字节/秒), 为0时不按速度切换
+    Raises:
+        DownloadError: 没有可用的镜像, 或校验未通过(此时已删除临时文件)
+        httpx.HTTPError: 网络错误且重试耗尽, 保留临时文件以便下次续传
+    """
+    urls = [url] if isinstance(url, str) else list(url)
+    part_path = path.with_name(path.name + ".part")
+    state_path = path.with_name(path.name + ".part.json")
+    stats = MirrorStats(stats_path)
+    start_time = time.monotonic()
+
+    async with httpx.AsyncClient(
+        follow_redirects=True, timeout=httpx.Timeout(30, connect=10)
+    ) as client:
+        try:
+            probes = await _race(client, urls, stats, size)
+        finally:
+            stats.save()
+        best = probes[0]
+        total = best.total
+        # 有摘要时以摘要识别文件, 不同镜像的ETag不同也能续传
+        validator = digest or best.etag
+        if best.ranged and total:
+            state = (
+                _State.load(state_path, total, validator)
+                if part_path.exists()
+                else None
+            )
+            if state is None:
+                state = _State.plan(state_path, total, validator, segments)
+                with part_path.open("wb") as f:
+                    f.truncate(total)
+                state.save()
+            elif state.completed:
+                info(f"从 {state.completed / 1024 / 1024:.1f}MB 处继续下载 {path.name}")
+            progress = _Progress(total, state.completed)
+            mirrors = _MirrorSet([p.url for p in probes if p.ranged], stats, progress)
+            watcher = None
+            if min_speed and len(mirrors.urls) > 1:
+                watcher = asyncio.create_task(_watch_speed(mirrors, min_speed))
+            tasks = [
+                asyncio.create_task(
+                    _fetch_segment(client, mirrors, part_path, state, segment, retries)
+                )
+                for segment in state.segments
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # 任一分段最终失败时停止其余分段, 不再继续下载和写入状态文件
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            finally:
+                if watcher is not None:
+                    watcher.cancel()
+                mirrors.finish()
+                stats.save()
+            segment_count = len(state.segments)
+            final_url = mirrors.current
+        else:
+            progress = _Progress(total, 0)
+            await _fetch_whole(client, best.url, part_path, progress)
+            segment_count = 1
+            final_url = best.url
+
+    try:
+        # 计算整个文件的摘要耗时较长, 在线程池中执行以免阻塞事件循环
+        await asyncio.to_thread(
+            _verify, part_path, size if size is not None else total or None, digest
+        )
+    except DownloadError:
+        part_path.unlink(missing_ok=True)
+        state_path.unlink(missing_ok=True)
+        raise
+    os.replace(part_path, path)
+    state_path.unlink(missing_ok=True)
+
+    result = DownloadResult(
+        path,
+        path.stat().st_size,
+        progress.downloaded,
+        time.monotonic() - start_time,
+        segment_count,
+        final_url,
+    )
+    info(
+        f"下载完成 {path.name}: {result.size / 1024 / 1024:.1f}MB,"
+        f" {segment_count}段, 耗时 {result.elapsed:.1f}s,"
+        f" {result.throughput / 1024 / 1024:.1f}MB/s, 镜像 {_mirror_key(final_url)}"
+    )
+    return result
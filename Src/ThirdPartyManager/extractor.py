@@ -0,0 +1,140 @@
+"""从压缩包中流式提取单个可执行文件
+
+只解压需要的成员, 直接写入目标旁的临时文件, 设置可执行权限后原子替换旧文件,
+不会把整个压缩包展开到磁盘. 支持 .zip、.tar.gz/.tgz 与单文件 .gz.
+"""
+
+import gzip
+import os
+import shutil
+import stat
+import tarfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class ExtractError(Exception):
+    """压缩包格式不支持或其中没有匹配的成员"""
+
+
+def _install(src: BinaryIO, target: Path):
+    """将src写入target旁的临时文件, 设置可执行权限后替换target"""
+    tmp = target.with_name(target.name + ".tmp")
+    try:
+        with tmp.open("wb") as f:
+            shutil.copyfileobj(src, f, _CHUNK_SIZE)
+        mode = tmp.stat().st_mode
+        tmp.chmod(mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        os.replace(tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def extract_member(archive: Path, target: Path, match: Callable[[str], bool]) -> str:
+    """从archive中提取第一个文件名匹配的成员到target
+
+    Args:
+        archive: 压缩包路径, 按扩展名判断格式
+        target: 目标文件路径, 已存在时被原子替换
+        match: 以成员文件名(不含目录)判断是否为所需成员; 单文件 .gz 不使用
+    Returns:
+        提取的成员名称
+    Raises:
+        ExtractError: 格式不支持或没有匹配的成员
+    """
+    name = archive.name.lower()
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(archive) as z:
+            for info in z.infolist():
+                if not info.is_dir() and match(PurePosixPath(info.filename).name):
+                    with z.open(info) as src:
+                        _install(src, target)
+                    return info.filename
+    elif name.endswith((".tar.gz", ".tgz")):
+        # 流式模式按顺序读取, 找到成员后即停止, 不解压其余部分
+        with tarfile.open(archive, mode="r|gz") as tar:
+            for member in tar:
+                if member.isfile() and match(PurePosixPath(member.name).name):
+                    _install(tar.extractfile(member), target)
+                    return member.name
+    elif name.endswith(".gz"):
+        with gzip.open(archive, "rb") as src:
+            _install(src, target)
+        return archive.name[: -len(".gz")]
+    else:
+        raise ExtractError(f"不支持的压缩格式: {archive.name}")
+    raise ExtractError(f"{archive.name} 中没有匹配的文件")
+
+
+if __name__ == "__main__":
+    # 基准: 对比展开整个压缩包再查找重命名(原实现)与流式提取单个成员的写盘字节数和耗时
+    import tempfile
+    import time
+
+    def written_bytes() -> int:
+        with open("/proc/self/io") as f:
+            return int(next(l for l in f if l.startswith("wchar:")).split()[1])
+
+    def extractall_and_rename(archive: Path, target: Path):
+        with zipfile.ZipFile(archive) as z:
+            z.extractall(archive.parent)
+        files = sorted(
+            archive.parent.glob("mihomo-*.exe"),
+            key=lambda x: x.stat().st_ctime,
+            reverse=True,
+        )
+        files[0].replace(target)
+
+    def measure(label: str, fn, archive: Path, target: Path):
+        before, start = written_bytes(), time.perf_counter()
+        fn(archive, target)
+        elapsed = time.perf_counter() - start
+        written = written_bytes() - before
+        print(f"{label:<28}{written / 1024 / 1024:>8.1f}MB{elapsed * 1000:>9.0f}ms")
+
+    exe = os.urandom(8 * 1024 * 1024) + bytes(24 * 1024 * 1024)  # 约32MB, 部分可压缩
+    extras = {"LICENSE": os.urandom(64 * 1024), "docs/manual.pdf": os.urandom(8 << 20)}
+    with tempfile.TemporaryDirectory() as d:
+        root = Path(d)
+        for extra in (False, True):
+            archive = root / "mihomo-windows-amd64.zip"
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+                z.writestr("mihomo-windows-amd64.exe", exe)
+                for member, data in extras.items() if extra else ():
+                    z.writestr(member, data)
+            suffix = " +附加文件" if extra else ""
+            measure(
+                "extractall+rename" + suffix,
+                extractall_and_rename,
+                archive,
+                root / "mihomo.exe",
+            )
+            measure(
+                "extract_member" + suffix,
+                lambda a, t: extract_member(a, t, lambda n: n.startswith("mihomo")),
+                archive,
+                root / "mihomo.exe",
+            )
+        gz = root / "mihomo-linux-amd64.gz"
+        with gzip.open(gz, "wb") as f:
+            f.write(exe)
+        measure(
+            "extract_member .gz",
+            lambda a, t: extract_member(a, t, None),
+            gz,
+            root / "m",
+        )
+        tgz = root / "mihomo-linux-amd64.tar.gz"
+        with tarfile.open(tgz, "w:gz") as tar:
+            tar.add(root / "m", "mihomo-linux-amd64")
+        measure(
+            "extract_member .tar.gz",
+            lambda a, t: extract_member(a, t, lambda n: n.startswith("mihomo")),
+            tgz,
+            root / "m2",
+        )
+        assert (root / "m2").read_bytes() == exe and os.access(root / "m2", os.X_OK)
@@ -0,0 +1,165 @@
+"""第三方进程日志行路由
+
+将子进程输出的日志行解析为 (级别, 消息), 通过字典映射到对应的日志函数输出.
+正则在构造时编译一次, 消息经过rich标记转义, 包含引号、方括号的内容也能原样输出;
+来源标签以 extra={"source": ...} 的结构化字段附加到日志记录上.
+"""
+
+import re
+from typing import Callable, Mapping, Optional
+
+from rich.markup import escape
+
+from Src.runtimeLog import debug, info, warning, error, critical
+
+LOG_LEVELS: dict[str, Callable[..., None]] = {
+    "debug": debug,
+    "info": info,
+    "warning": warning,
+    "warn": warning,
+    "error": error,
+    "fatal": critical,
+    "critical": critical,
+}
+
+# mihomo的logfmt格式: time="..." level=info msg="[TCP] ... \"quoted\""
+MIHOMO_PATTERN = re.compile(r'level=(?P<level>\w+) msg="(?P<msg>(?:[^"\\]|\\.)*)"')
+# 插件输出的标签格式: <LEVEL>message</LEVEL>
+MITM_PATTERN = re.compile(r"^<(?P<level>[^>]+)>(?P<msg>.*?)</(?P=level)>")
+
+_LOGFMT_ESCAPE = re.compile(r"\\(.)")
+
+
+def _escape(text: str) -> str:
+    """转义rich标记, 不含方括号时直接返回"""
+    return escape(text) if "[" in text else text
+
+
+def unescape_logfmt(msg: str) -> str:
+    """还原logfmt中被转义的引号与反斜杠"""
+    return _LOGFMT_ESCAPE.sub(r"\1", msg) if "\\" in msg else msg
+
+
+class LogRouter:
+    """日志行路由器
+
+    Args:
+        source: 来源标签, 同时用作日志前缀
+        pattern: 含 level 与 msg 命名分组的已编译正则
+        unescape: 对消息的额外还原处理, 如 unescape_logfmt
+        on_unknown: 级别不是日志级别时的回调 on_unknown(标签, 消息), 默认按info输出整行
+        fallback_level: 无法解析的行的输出级别
+        levels: 级别名称(小写)到日志函数的映射
+    """
+
+    def __init__(
+        self,
+        source: str,
+        pattern: re.Pattern,
+        unescape: Optional[Callable[[str], str]] = None,
+        on_unknown: Optional[Callable[[str, str], None]] = None,
+        fallback_level: str = "info",
+        levels: Mapping[str, Callable[..., None]] = LOG_LEVELS,
+    ):
+        self.source = source
+        self.prefix = f"[italic yellow]{source}:[/italic yellow] "
+        self._search = pattern.search
+        self._unescape = unescape
+        self._on_unknown = on_unknown
+        self._levels = levels
+        self._fallback = levels[fallback_level]
+        self._extra = {"source": source.strip().lower()}
+
+    def log(self, level: str, msg: str) -> bool:
+        """按级别输出一条消息, 级别未知时返回False"""
+        log = self._levels.get(level.lower())
+        if log is None:
+            return False
+        log(self.prefix + _escape(msg), extra=self._extra)
+        return True
+
+    def route(self, line: str):
+        """解析并输出一行日志"""
+        match = self._search(line)
+        if match is None:
+            self._fallback(self.prefix + _escape(line), extra=self._extra)
+            return
+        level, msg = match.group("level", "msg")
+        if self._unescape is not None:
+            msg = self._unescape(msg)
+        if not self.log(level, msg):
+            if self._on_unknown is not None:
+                self._on_unknown(level, msg)
+            else:
+                self._fallback(self.prefix + _escape(line), extra=self._extra)
+
+
+if __name__ == "__main__":
+    # 基准: 录制格式的日志语料(含引号与方括号), 对比eval实现与路由器的每秒行数
+    import time
+
+    CORPUS = [
+        'time="2025-03-01T10:00:00.000000000+08:00" level=info msg="[TCP] 127.0.0.1:50312(dwrg.exe) --> service.mkey.163.com:443 match ProcessName(dwrg.exe) using PROXY"',
+        'time="2025-03-01T10:00:00.100000000+08:00" level=warning msg="[UDP] dial DIRECT (match Match/) to 8.8.8.8:53 error: context deadline exceeded"',
+        'time="2025-03-01T10:00:00.200000000+08:00" level=error msg="parse rule \\"DOMAIN,[bad],DIRECT\\" failed: it\'s invalid"',
+        'time="2025-03-01T10:00:00.300000000+08:00" level=debug msg="[DNS] cache hit for \\"api.example.com\\" [A]"',
+        "<INFO>拦截 service.mkey.163.com/mpay/games/[id]/devices/'x'/users</INFO>",
+        '<WARNING>pc_config 响应解析失败: Expecting value: line 1 column 1 (char 0) ["raw"]</WARNING>',
+        "<qrcode_login>{'uuid': \"abc\", 'game_id': 'aecfrxodyqaaaajp-g-x19'}</qrcode_login>",
+    ]
+    corpus = CORPUS * 2000
+    sink = lambda *args, **kwargs: None  # noqa: E731
+    sinks = {name: sink for name in LOG_LEVELS}
+    eval_failures = []
+
+    def eval_mihomo(line):
+        # 原实现: 拼接源码字符串后eval, 消息含引号时直接报错
+        try:
+            _log_level, _msg = re.compile('.*level=(.*) msg="(.*)"').findall(line)[0]
+            eval(
+                f"{_log_level}('[italic yellow]MIHOMO:[/italic yellow] {_msg}')",
+                sinks,
+            )
+        except Exception:
+            eval_failures.append(line)
+
+    def eval_mitm(line):
+        p = re.compile(r"<([^>]+)>(.*?)</\1>")
+        try:
+            if p.match(line):
+                name, msg = p.findall(line)[0]
+                if name.lower() in sinks:
+                    eval(
+                        f"{name.lower()}('[italic yellow] MITM :[/italic yellow] {msg}')",
+                        sinks,
+                    )
+                else:
+                    sink()
+            else:
+                eval(f"info('[italic yellow] MITM :[/italic yellow] {line}')", sinks)
+        except Exception:
+            eval_failures.append(line)
+
+    mihomo = LogRouter("MIHOMO", MIHOMO_PATTERN, unescape_logfmt, levels=sinks)
+    mitm = LogRouter(" MITM ", MITM_PATTERN, levels=sinks)
+
+    def run(name, mihomo_fn, mitm_fn):
+        start = time.perf_counter()
+        for line in corpus:
+            (mitm_fn if line[0] == "<" else mihomo_fn)(line)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<8}{len(corpus) / elapsed:>12,.0f} lines/s")
+
+    run("eval", eval_mihomo, eval_mitm)
+    run("router", mihomo.route, mitm.route)
+    print(f"eval 解析失败 {len(eval_failures)}/{len(corpus)} 行")
+
+    routed = []
+    check = LogRouter(
+        "MIHOMO",
+        MIHOMO_PATTERN,
+        unescape_logfmt,
+        levels={k: (lambda m, **kw: routed.append(m)) for k in LOG_LEVELS},
+    )
+    check.route(CORPUS[2])
+    print("router 输出:", routed[0])
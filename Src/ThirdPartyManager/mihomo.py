@@ -1,15 +1,32 @@
+import asyncio
+import json
 import platform
-import re
-import subprocess
 import threading
-import zipfile
+import time
+from collections import deque
 from pathlib import Path
-from queue import Queue, Empty
-from typing import Optional, List, Dict
+from typing import Callable, Optional, List, Dict
 
 import httpx
 import yaml
-
+from rich.markup import escape
+
+from Src.ThirdPartyManager.downloader import download_file, fetch_json
+from Src.ThirdPartyManager.extractor import extract_member
+from Src.ThirdPartyManager.log_router import (
+    LogRouter,
+    MIHOMO_PATTERN,
+    unescape_logfmt,
+)
+from Src.ThirdPartyManager.mihomo_config import MihomoConfig
+from Src.ThirdPartyManager.supervisor import (
+    ManagedProcess,
+    OutputBuffer,
+    ProcessSupervisor,
+    Watchdog,
+    probe_http,
+)
+from Src.config import cfg
 from Src.init import app_dir_path
 from Src.runtimeLog import debug, info, warning, error
 
@@ -24,11 +41,13 @@ _ARCH_MAPPING = {
 }
 
 _EXTENSION_PRIORITY = {
-    "linux": [".deb", ".rpm", ".gz"],
+    "linux": [".gz", ".deb", ".rpm"],
     "windows": [".zip"],
     "darwin": [".gz", ".zip"],
 }
 
+_log_router = LogRouter("MIHOMO", MIHOMO_PATTERN, unescape_logfmt)
+
 
 def normalize_arch(raw_arch: str) -> str:
     """标准化架构名称"""
@@ -72,12 +91,13 @@ def get_asset_key(name: str, os_type: str) -> tuple:
 
 
 async def fetch_releases() -> Dict:
-    """获取最新版本信息"""
-    async with httpx.AsyncClient() as client:
-        url = "https://api.github.com/repos/MetaCubeX/mihomo/releases/latest"
-        response = await client.get(url)
-        response.raise_for_status()
-        return response.json()
+    """获取最新版本信息, 在新鲜期内使用磁盘缓存, 离线时退回到缓存"""
+    return await fetch_json(
+        "https://api.github.com/repos/MetaCubeX/mihomo/releases/latest",
+        app_dir_path / "ThirdParty" / "cache" / "mihomo_release.json",
+        cfg["proxy"]["release_cache_ttl"],
+        accept="application/vnd.github+json",
+    )
 
 
 def select_asset(assets: List[Dict], os_type: str, arch: str) -> Optional[Dict]:
@@ -96,27 +116,6 @@ def select_asset(assets: List[Dict], os_type: str, arch: str) -> Optional[Dict]:
     return min(candidates, key=lambda x: get_asset_key(x["name"], os_type))
 
 
-async def download_file(url: str, path: Path):
-    """下载文件并显示进度"""
-    async with httpx.AsyncClient(follow_redirects=True) as client:
-        async with client.stream("GET", url) as response:
-            response.raise_for_status()
-            total = int(response.headers.get("Content-Length", 0))
-            path.touch(exist_ok=True)
-            with open(path, "wb") as f:
-                downloaded = 0
-                last_reported_percent = 0
-                async for chunk in response.aiter_bytes():
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    percent_complete = (downloaded / total) * 100
-                    if percent_complete >= last_reported_percent + 10:
-                        last_reported_percent = percent_complete
-                        debug(
-                            f"Downloaded {downloaded / 1024 / 1024:.1f}MB / {total / 1024 / 1024:.1f}MB"
-                        )
-
-
 async def download_main(use_mirror: str = None):
     """主函数"""
     os_type, arch = get_system_info()
@@ -145,50 +144,51 @@ async def download_main(use_mirror: str = None):
     #     error("No matching asset found")
     #     return
 
-    download_url = selected["browser_download_url"]
+    # 镜像为替换 https://github.com 的前缀, 下载时选择最快的镜像
+    mirrors = cfg["proxy"]["download_mirrors"]
     if use_mirror:
-        download_url = download_url.replace("https://github.com", use_mirror)
+        mirrors = [use_mirror] + mirrors
+    download_urls = [
+        selected["browser_download_url"].replace("https://github.com", mirror, 1)
+        for mirror in dict.fromkeys(mirrors)
+    ]
 
-    output_path = app_dir_path / "ThirdParty" / "mihomo" / "mihomo.zip"
+    output_path = app_dir_path / "ThirdParty" / "mihomo" / selected["name"]
     output_path.parent.mkdir(exist_ok=True)
 
     info(f"Downloading {selected['name']}...")
     try:
-        await download_file(download_url, output_path)
+        # 中断时保留临时文件, 下次从断点继续
+        await download_file(
+            download_urls,
+            output_path,
+            size=selected.get("size"),
+            digest=selected.get("digest"),
+            stats_path=app_dir_path / "ThirdParty" / "cache" / "mirrors.json",
+            min_speed=cfg["proxy"]["mirror_min_speed"],
+        )
         info(f"Successfully downloaded to {output_path}")
     except Exception as e:
         error(f"Download failed: {str(e)}")
         output_path.unlink(missing_ok=True)
+        return
 
-    # 解压ZIP, 并覆盖原先的程序
-    if _unzip_and_clean_and_rename(output_path) is False:
+    # 提取核心, 并覆盖原先的程序; 解压耗时较长, 在线程池中执行以免阻塞事件循环
+    if await asyncio.to_thread(_extract_core, output_path) is False:
         return
 
 
-def _unzip_and_clean_and_rename(zip_path: Path) -> bool:
-    """解压下载来的zip文件，并清理原始zip，修改解压后的文件名称"""
-    # 解压
+def _extract_core(archive: Path) -> bool:
+    """从下载的压缩包中提取mihomo核心为mihomo.exe, 并清理压缩包"""
+    target = archive.parent / "mihomo.exe"
     try:
-        with zipfile.ZipFile(zip_path, mode="r") as z:
-            z.extractall(zip_path.parent)
+        member = extract_member(archive, target, lambda name: name.startswith("mihomo"))
     except Exception as e:
         error(f"解压失败 {e}")
         return False
-    # 清理原始文件
-    zip_path.unlink(missing_ok=True)
-    # 重命名为mihomo.exe
-    files = [path for path in zip_path.parent.glob("mihomo-*.exe")]
-    if len(files) > 1:
-        warning("检测到有多个mihomo核心文件，自动取最新创建的文件")
-        files.sort(key=lambda x: x.stat().st_ctime, reverse=True)
-    elif not files:
-        error("未找到 mihomo 核心文件")
-        return False
-
-    # 重命名文件
-    target_file = files[0]
-    target_file.replace(zip_path.parent / "mihomo.exe")
-    info(f"重命名(或覆盖) {target_file} 为 mihomo.exe")
+    finally:
+        archive.unlink(missing_ok=True)
+    info(f"提取(或覆盖) {member} 为 mihomo.exe")
     return True
 
 
@@ -235,14 +235,13 @@ def create_config_mihomo_yaml(ports: int = 8443, tun: bool = True):
         },
     }
     config_path = app_dir_path / "ThirdParty" / "mihomo" / "mihomo_config.yaml"
-    yaml.dump(config, config_path.open("w", encoding="utf-8"))
+    MihomoConfig(config_path, config).save()
 
 
-def add_process_to_config(process_name: str):
+def add_process_to_config(process_name: str) -> bool:
+    """将进程加入代理规则, 已存在时不修改文件"""
     config_path = app_dir_path / "ThirdParty" / "mihomo" / "mihomo_config.yaml"
-    c = yaml.full_load(config_path.open("r", encoding="utf-8"))
-    c["rules"] = [f"PROCESS-NAME, {process_name}, Proxy_HTTP"] + c["rules"]
-    yaml.dump(c, config_path.open("w", encoding="utf-8"))
+    return MihomoConfig(config_path).add_process(process_name)
 
 
 def check_mihomo_exist() -> int:
@@ -268,9 +267,225 @@ def check_mihomo_exist() -> int:
     return 0
 
 
+class MihomoController:
+    """mihomo external-controller REST API客户端
+
+    通过API使配置修改即时生效, 不必重启mihomo(重启会重建TUN并断开全部连接)
+    """
+
+    def __init__(self, base_url: str, headers: Optional[dict] = None, timeout=5):
+        self.base_url = base_url
+        self._client = httpx.Client(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=False,  # 本地明文HTTP, 省去创建SSL上下文的开销
+            trust_env=False,
+        )
+
+    def version(self) -> dict:
+        response = self._client.get("/version")
+        response.raise_for_status()
+        return response.json()
+
+    def reload(self, payload: str, force: bool = True):
+        """以完整配置内容重新加载规则、代理等配置, 进程与已有连接保持不变"""
+        response = self._client.put(
+            "/configs", params={"force": force}, json={"path": "", "payload": payload}
+        )
+        response.raise_for_status()
+
+    def patch(self, changes: dict):
+        """修改运行中的通用配置项, 如 mode、log-level、tun.enable"""
+        response = self._client.patch("/configs", json=changes)
+        response.raise_for_status()
+
+    def connections(self) -> list:
+        """当前活动连接列表"""
+        response = self._client.get("/connections")
+        response.raise_for_status()
+        return response.json().get("connections") or []
+
+    def close(self):
+        self._client.close()
+
+
+class TimeSeries:
+    """按固定时间粒度聚合的有界时间序列
+
+    同一时间段内的上下行字节数累加, 连接数取最大值; 超出容量时丢弃最旧的时间段
+    """
+
+    def __init__(self, resolution: int, size: int):
+        self.resolution = resolution
+        self._buckets: deque[dict] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def _bucket(self, ts: float) -> dict:
+        start = int(ts // self.resolution * self.resolution)
+        if not self._buckets or self._buckets[-1]["ts"] != start:
+            self._buckets.append(
+                {"ts": start, "up": 0, "down": 0, "connections": 0, "game": 0}
+            )
+        return self._buckets[-1]
+
+    def add_traffic(self, ts: float, up: int, down: int):
+        with self._lock:
+            bucket = self._bucket(ts)
+            bucket["up"] += up
+            bucket["down"] += down
+
+    def add_connections(self, ts: float, total: int, game: int):
+        with self._lock:
+            bucket = self._bucket(ts)
+            bucket["connections"] = max(bucket["connections"], total)
+            bucket["game"] = max(bucket["game"], game)
+
+    def snapshot(self, last: Optional[int] = None) -> list[dict]:
+        """按时间顺序返回各时间段的副本, last指定时只返回最近的若干段"""
+        with self._lock:
+            buckets = list(self._buckets)[-last:] if last else list(self._buckets)
+            return [dict(bucket) for bucket in buckets]
+
+
+class TrafficCollector:
+    """采集mihomo的流量与连接数
+
+    在托管事件循环中以一个长连接客户端持续读取流式的 /traffic(每秒一条上下行字节数),
+    并每秒获取一次 /connections 统计总连接数与游戏进程的连接数; 断开后按指数退避自动重连.
+    mihomo仅以WebSocket推送连接列表, 为避免引入WebSocket依赖这里改为轮询.
+
+    Args:
+        controller_url: 返回 (external-controller地址, 请求头) 的函数, 每次连接时调用
+        processes: 计为游戏连接的进程名
+        seconds: 每秒序列保留的时长(秒)
+        minutes: 每分钟序列保留的时长(分钟)
+    """
+
+    def __init__(
+        self,
+        controller_url: Callable[[], tuple[str, dict]],
+        processes: tuple[str, ...] = ("dwrg.exe",),
+        seconds: int = 300,
+        minutes: int = 1440,
+    ):
+        self.controller_url = controller_url
+        self.processes = set(processes)
+        self.per_second = TimeSeries(1, seconds)
+        self.per_minute = TimeSeries(60, minutes)
+        self.connected = False
+        self.reconnects = 0
+        self.bad_samples = 0  # 无法解析而丢弃的数据条数
+        self._task: Optional[asyncio.Task] = None
+        self._supervisor = ProcessSupervisor.get()
+
+    def start(self):
+        """开始采集, 已在采集时无操作"""
+        if self._task is None or self._task.done():
+            self._supervisor.run(self._start())
+
+    async def _start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None and not self._task.done():
+            self._supervisor.run(self._stop())
+
+    async def _stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self.connected = False
+
+    async def _run(self, max_delay: float = 10):
+        delay = 0.5
+        while True:
+            url, headers = self.controller_url()
+            try:
+                async with httpx.AsyncClient(
+                    base_url=url,
+                    headers=headers,
+                    timeout=None,
+                    verify=False,  # 本地明文HTTP, 省去创建SSL上下文的开销
+                    trust_env=False,
+                ) as client:
+                    await self._collect(client)
+            except httpx.HTTPError as e:
+                if self.connected:
+                    delay = 0.5  # 曾经连接成功, 重新开始退避
+                    warning(f"[italic yellow]MIHOMO:[/italic yellow] 流量采集断开: {e}")
+            except Exception as e:
+                # 采集任务结束后只有mihomo重启才会重新开始, 未预料的错误也重连而不退出
+                error(f"[italic yellow]MIHOMO:[/italic yellow] 流量采集出错: {e}")
+            self.connected = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+            self.reconnects += 1
+
+    async def _collect(self, client: httpx.AsyncClient):
+        """同时读取流量与连接数, 任一方出错时取消另一方并抛出该异常"""
+        tasks = [
+            asyncio.create_task(self._read_traffic(client)),
+            asyncio.create_task(self._poll_connections(client)),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for task in done:
+            task.result()
+
+    async def _read_traffic(self, client: httpx.AsyncClient):
+        async with client.stream("GET", "/traffic") as response:
+            response.raise_for_status()
+            self.connected = True
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                try:
+                    sample = json.loads(line)
+                    up, down = int(sample["up"]), int(sample["down"])
+                except (ValueError, TypeError, KeyError) as e:
+                    self._bad_sample("traffic", line, e)
+                    continue
+                now = time.time()
+                for series in (self.per_second, self.per_minute):
+                    series.add_traffic(now, up, down)
+        raise httpx.RemoteProtocolError("流量数据流已结束")
+
+    async def _poll_connections(self, client: httpx.AsyncClient, interval=1):
+        while True:
+            response = await client.get("/connections", timeout=5)
+            response.raise_for_status()
+            try:
+                connections = response.json().get("connections") or []
+                game = sum(
+                    1
+                    for conn in connections
+                    if (conn.get("metadata") or {}).get("process") in self.processes
+                )
+            except (ValueError, TypeError, AttributeError) as e:
+                self._bad_sample("connections", response.text, e)
+            else:
+                now = time.time()
+                for series in (self.per_second, self.per_minute):
+                    series.add_connections(now, len(connections), game)
+            await asyncio.sleep(interval)
+
+    def _bad_sample(self, kind: str, raw: str, e: Exception):
+        self.bad_samples += 1
+        debug(
+            f"[italic yellow]MIHOMO:[/italic yellow] 丢弃无法解析的{kind}数据"
+            f" {escape(repr(raw[:100]))}: {escape(repr(e))}"
+        )
+
+
 class MihomoManager:
-    def __init__(self, config_path: Path = None):
-        self.mihomo_process: Optional[subprocess.Popen] = None
+    def __init__(self, config_path: Path = None, output_capacity: int = 1000):
+        self.mihomo_process = ManagedProcess("mihomo", self._on_output_line)
+        # 崩溃后自动重启
+        self.watchdog = Watchdog(self.mihomo_process, self._restart)
         self.mihomo_path = app_dir_path / "ThirdParty" / "mihomo" / "mihomo.exe"
         self.work_dir = app_dir_path / "ThirdParty" / "mihomo"
 
@@ -278,9 +493,13 @@ class MihomoManager:
         self.config_path = config_path or self.work_dir / "mihomo_config.yaml"
 
         # 输出管理
-        self.output_queue = Queue()
-        self._capture_threads = []
-        self._running = False
+        self.output = OutputBuffer(capacity=output_capacity)
+        self._output_cursor = 0
+
+        self._config: Optional[MihomoConfig] = None
+        self._controller: Optional[MihomoController] = None
+        # 流量与连接数采集, 随mihomo启动与停止
+        self.telemetry = TrafficCollector(self.controller_url)
 
     def start_mihomo(self):
         """启动mihomo核心
@@ -305,92 +524,172 @@ class MihomoManager:
             str(self.work_dir),
         ]
 
+        start = time.perf_counter()
         try:
-            self.mihomo_process = subprocess.Popen(
-                args,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,  # 合并错误输出
-                # cwd=str(self.work_dir),
-                # bufsize=1,
-                # universal_newlines=True,
-                # encoding = 'utf-8'
-            )
+            self.mihomo_process.start(args)
         except Exception as e:
             error(f"[italic yellow]MIHOMO:[/italic yellow] 启动mihomo失败: {str(e)}")
             raise
 
-        self._running = True
-
-        # 启动输出捕获线程
-        self._capture_threads = [
-            threading.Thread(
-                target=self._enqueue_output,
-                args=(self.mihomo_process.stdout,),
-                daemon=True,
+        info(
+            f"[italic yellow]MIHOMO:[/italic yellow] mihomo核心已启动"
+            f" (耗时 {(time.perf_counter() - start) * 1000:.1f}ms)"
+        )
+        if cfg["proxy"]["watchdog"]:
+            self.watchdog.arm()
+        self.telemetry.start()
+
+    @property
+    def config(self) -> MihomoConfig:
+        """配置文件模型, 首次访问时读取, 文件被外部修改后重新读取"""
+        if self._config is None:
+            self._config = MihomoConfig(self.config_path)
+        return self._config.refresh()
+
+    def controller_url(self) -> tuple[str, dict]:
+        """从配置文件读取external-controller地址与鉴权头"""
+        try:
+            config = self.config
+        except (OSError, yaml.YAMLError):
+            config = MihomoConfig(self.config_path, {})
+        host, _, port = config.external_controller.rpartition(":")
+        if host in ("", "0.0.0.0", "[::]"):
+            host = "127.0.0.1"
+        secret = config.secret
+        headers = {"Authorization": f"Bearer {secret}"} if secret else {}
+        return f"http://{host}:{port}", headers
+
+    @property
+    def controller(self) -> MihomoController:
+        """external-controller客户端, 配置中的地址变化后自动重建"""
+        url, headers = self.controller_url()
+        if self._controller is None or self._controller.base_url != url:
+            if self._controller is not None:
+                self._controller.close()
+            self._controller = MihomoController(url, headers)
+        return self._controller
+
+    def reload_config(self) -> bool:
+        """使配置文件的修改生效
+
+        运行中优先通过external-controller热重载, 失败时才重启mihomo
+        Returns:
+            是否热重载成功, 未运行或改为重启时返回False
+        """
+        if not self.is_running():
+            return False
+        start = time.perf_counter()
+        try:
+            self.controller.reload(self.config.text)
+            info(
+                f"[italic yellow]MIHOMO:[/italic yellow] 配置已热重载"
+                f" (耗时 {(time.perf_counter() - start) * 1000:.1f}ms)"
             )
-        ]
+            return True
+        except httpx.HTTPError as e:
+            warning(
+                f"[italic yellow]MIHOMO:[/italic yellow] 热重载失败, 重启mihomo: {e}"
+            )
+        self.stop_mihomo()
+        self.start_mihomo()
+        self.wait_ready(cfg["proxy"]["ready_timeout"])
+        return False
 
-        for t in self._capture_threads:
-            t.start()
+    def patch_config(self, changes: dict) -> bool:
+        """修改通用配置项并写回配置文件, 运行中通过PATCH即时生效, 失败时重载配置
 
-        info("[italic yellow]MIHOMO:[/italic yellow] mihomo核心已启动")
+        配置没有变化时不写文件也不请求mihomo
+        """
+        if not self.config.merge(changes):
+            return self.is_running()
+        if not self.is_running():
+            return False
+        try:
+            self.controller.patch(changes)
+            return True
+        except httpx.HTTPError as e:
+            warning(f"[italic yellow]MIHOMO:[/italic yellow] 修改配置失败: {e}")
+            return self.reload_config()
+
+    def add_process(self, *process_names: str) -> bool:
+        """将进程加入代理规则并即时生效, 多个进程只写一次文件、重载一次"""
+        config = self.config
+        with config.batch():
+            added = [name for name in process_names if config.add_process(name)]
+        if not added:
+            return self.is_running()
+        return self.reload_config()
+
+    def wait_ready(self, timeout: float = 15) -> float:
+        """等待external-controller的/version可访问, 返回自启动起的就绪耗时(秒)
+
+        Raises:
+            TimeoutError: 超时仍未就绪
+            RuntimeError: mihomo在就绪前退出
+        """
+        return self.mihomo_process.supervisor.run(self.ready(timeout))
+
+    async def ready(self, timeout: float = 15) -> float:
+        """wait_ready 的协程版本, 在托管事件循环中等待, 可被取消"""
+        url, headers = self.controller_url()
+        elapsed = await self.mihomo_process.wait_ready(
+            lambda: probe_http(f"{url}/version", headers), timeout
+        )
+        info(
+            f"[italic yellow]MIHOMO:[/italic yellow] mihomo已就绪"
+            f" (耗时 {elapsed * 1000:.0f}ms)"
+        )
+        return elapsed
+
+    def _restart(self):
+        """看门狗重启: 启动并等待就绪, 未就绪时停止进程后抛出异常"""
+        self.start_mihomo()
+        try:
+            self.wait_ready(cfg["proxy"]["ready_timeout"])
+        except Exception:
+            self.mihomo_process.stop(timeout=1)
+            raise
 
     def stop_mihomo(self):
         """停止mihomo进程"""
+        self.watchdog.disarm()
+        self.telemetry.stop()
         if not self.is_running():
             return
 
-        self._running = False
+        # 优雅终止, 超时后强制终止
+        self.mihomo_process.stop(timeout=3)
+        info("[italic yellow]MIHOMO:[/italic yellow] mihomo核心已停止")
 
-        try:
-            # 优雅终止
-            self.mihomo_process.terminate()
-            self.mihomo_process.wait(timeout=3)
-        except ProcessLookupError:
-            pass  # 进程已终止
-        except TimeoutError:
-            warning("[italic yellow]MIHOMO:[/italic yellow] 强制终止mihomo进程")
-            self.mihomo_process.kill()
-        finally:
-            self.mihomo_process = None
-            info("[italic yellow]MIHOMO:[/italic yellow] mihomo核心已停止")
+    def health(self) -> dict:
+        """进程状态概要, 含看门狗的重启与恢复统计"""
+        return {**self.mihomo_process.health(), "watchdog": self.watchdog.stats()}
 
     def is_running(self):
         """检查进程是否运行"""
-        return self.mihomo_process and self.mihomo_process.poll() is None
+        return self.mihomo_process.is_running()
 
-    def _enqueue_output(self, stream):
-        """输出捕获线程"""
-        while self._running:
-            try:
-                line = stream.readline().strip().decode("utf-8")
-                # print(line)
-                if line:
-                    if "ProcessName/dwrg.exe" in line:
-                        self._log_out(line)
-                        self.output_queue.put(line)
-                    if 'level=info msg="[' not in line:
-                        self._log_out(line)
-                        self.output_queue.put(line)
-            except ValueError:
-                break  # 流已关闭
+    def _on_output_line(self, line: str):
+        """输出行处理, 在托管事件循环中调用"""
+        if "ProcessName/dwrg.exe" in line:
+            self._log_out(line)
+            self.output.append(line)
+        if 'level=info msg="[' not in line:
+            self._log_out(line)
+            self.output.append(line)
 
     def _log_out(self, line):
-        p = re.compile('.*level=(.*) msg="(.*)"')
-        try:
-            _log_level, _msg = p.findall(line)[0]
-            eval(f"{_log_level}('[italic yellow]MIHOMO:[/italic yellow] {_msg}')")
-        except Exception as e:
-            error(f"[italic yellow]MIHOMO:[/italic yellow] 未知错误: {e}")
+        _log_router.route(line)
 
-    def get_output(self, timeout=0.1):
-        """获取捕获的输出"""
-        outputs = []
-        while True:
-            try:
-                outputs.append(self.output_queue.get(timeout=timeout))
-            except Empty:
-                break
+    def get_output(self, since: Optional[int] = None) -> list:
+        """获取捕获的输出, 不阻塞
+
+        Args:
+            since: 起始序号, 默认从上次调用 get_output 之后开始
+        """
+        outputs, self._output_cursor = self.output.read_since(
+            self._output_cursor if since is None else since
+        )
         return outputs
 
     def __del__(self):
@@ -413,7 +712,7 @@ if __name__ == "__main__":
     create_config_mihomo_yaml()
     # add_process_to_config('test.exe')
     # output_path = app_dir_path / "ThirdParty" / "mihomo" / "mihomo.zip"
-    # _unzip_and_clean_and_rename(output_path)
+    # _extract_core(output_path)
 
     manager = MihomoManager()
 
@@ -425,11 +724,10 @@ if __name__ == "__main__":
         print("运行状态:", manager.is_running())
         input()
 
-        # # 获取实时输出
-        # while manager.is_running():
-        #     for line in manager.get_output():
-        #         print("[mihomo]", line)
-        #     time.sleep(0.5)
+        # # 订阅实时输出, 无需轮询
+        # unsubscribe = manager.output.subscribe(
+        #     lambda seq, line: print("[mihomo]", line)
+        # )
 
     finally:
         manager.stop_mihomo()
@@ -0,0 +1,245 @@
+"""mihomo配置文件模型
+
+配置只在首次访问或文件被外部修改后读取一次, 修改在内存中进行;
+在 batch() 中的多次修改只写一次文件, 没有实际变化的修改不会重写文件.
+写入时先写临时文件再替换, 中途崩溃不会留下不完整的配置.
+"""
+
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+import yaml
+
+# 优先使用libyaml的C实现
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+DEFAULT_PROXY = "Proxy_HTTP"
+
+
+def _merge_config(config: dict, changes: dict) -> bool:
+    """将changes逐层合并到config, 只覆盖给出的键, 返回是否有变化"""
+    changed = False
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            changed |= _merge_config(config[key], value)
+        elif key not in config or config[key] != value:
+            config[key] = value
+            changed = True
+    return changed
+
+
+def _normalize_rule(rule: str) -> str:
+    """去掉规则各字段两侧的空格, 用于判断重复"""
+    return ",".join(part.strip() for part in rule.split(","))
+
+
+class MihomoConfig:
+    """mihomo配置文件的内存模型
+
+    Args:
+        path: 配置文件路径
+        data: 初始配置; 给出时视为未保存的修改, 否则从path读取
+    """
+
+    def __init__(self, path: Path, data: Optional[dict] = None):
+        self.path = path
+        self.data: dict = {}
+        self.text = ""  # 最近一次读取或写入的文件内容
+        self._mtime_ns: Optional[int] = None
+        self._rule_index: Optional[set[str]] = None
+        self._depth = 0
+        self._dirty = False
+        if data is None:
+            self._read()
+        else:
+            self.data = data
+            self._dirty = True
+
+    def _read(self):
+        self.text = self.path.read_text(encoding="utf-8")
+        self.data = yaml.load(self.text, Loader=_Loader) or {}
+        self._mtime_ns = self.path.stat().st_mtime_ns
+        self._rule_index = None
+        self._dirty = False
+
+    def refresh(self) -> "MihomoConfig":
+        """文件被外部修改时重新读取; 有未保存的修改或在batch中时不读取"""
+        if self._dirty or self._depth:
+            return self
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return self
+        if mtime_ns != self._mtime_ns:
+            self._read()
+        return self
+
+    def save(self) -> bool:
+        """有修改时写入文件, 返回是否写入"""
+        if not self._dirty:
+            return False
+        self.text = yaml.dump(self.data, Dumper=_Dumper)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(self.text, encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._mtime_ns = self.path.stat().st_mtime_ns
+        self._dirty = False
+        return True
+
+    def _changed(self):
+        self._dirty = True
+        if not self._depth:
+            self.save()
+
+    @contextmanager
+    def batch(self) -> Iterator["MihomoConfig"]:
+        """批量修改, 退出时只写一次文件; 出现异常时放弃全部未保存的修改"""
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if not self._depth and self._dirty:
+                self._read()
+            raise
+        self._depth -= 1
+        if not self._depth:
+            self.save()
+
+    # 规则
+
+    @property
+    def rules(self) -> list[str]:
+        return self.data.setdefault("rules", [])
+
+    def _rules_normalized(self) -> set[str]:
+        if self._rule_index is None:
+            self._rule_index = {_normalize_rule(rule) for rule in self.rules}
+        return self._rule_index
+
+    def has_rule(self, rule: str) -> bool:
+        return _normalize_rule(rule) in self._rules_normalized()
+
+    def add_rule(self, rule: str) -> bool:
+        """在规则列表最前面加入规则, 已存在时不修改; 返回是否加入"""
+        normalized = _normalize_rule(rule)
+        index = self._rules_normalized()
+        if normalized in index:
+            return False
+        self.rules.insert(0, rule)
+        index.add(normalized)
+        self._changed()
+        return True
+
+    def remove_rule(self, rule: str) -> bool:
+        normalized = _normalize_rule(rule)
+        if normalized not in self._rules_normalized():
+            return False
+        self.data["rules"] = [r for r in self.rules if _normalize_rule(r) != normalized]
+        self._rule_index.discard(normalized)
+        self._changed()
+        return True
+
+    def add_process(self, process_name: str, proxy: str = DEFAULT_PROXY) -> bool:
+        """将进程的流量交给proxy, 返回是否新增了规则"""
+        return self.add_rule(f"PROCESS-NAME, {process_name}, {proxy}")
+
+    def remove_process(self, process_name: str, proxy: str = DEFAULT_PROXY) -> bool:
+        return self.remove_rule(f"PROCESS-NAME, {process_name}, {proxy}")
+
+    @property
+    def process_names(self) -> list[str]:
+        """PROCESS-NAME规则中的进程名"""
+        return [
+            rule.split(",")[1].strip()
+            for rule in self.rules
+            if _normalize_rule(rule).startswith("PROCESS-NAME,")
+        ]
+
+    # 代理
+
+    @property
+    def proxies(self) -> list[dict]:
+        return self.data.setdefault("proxies", [])
+
+    def proxy(self, name: str) -> Optional[dict]:
+        return next((p for p in self.proxies if p.get("name") == name), None)
+
+    def set_proxy(self, proxy: dict) -> bool:
+        """按名称新增或替换代理, 返回是否有变化"""
+        for i, existing in enumerate(self.proxies):
+            if existing.get("name") == proxy["name"]:
+                if existing == proxy:
+                    return False
+                self.proxies[i] = proxy
+                break
+        else:
+            self.proxies.append(proxy)
+        self._changed()
+        return True
+
+    # 通用配置
+
+    @property
+    def external_controller(self) -> str:
+        return str(self.data.get("external-controller", "127.0.0.1:9090"))
+
+    @property
+    def secret(self) -> Optional[str]:
+        return self.data.get("secret")
+
+    def merge(self, changes: dict) -> bool:
+        """逐层合并通用配置项, 返回是否有变化"""
+        if not _merge_config(self.data, changes):
+            return False
+        self._rule_index = None
+        self._changed()
+        return True
+
+
+if __name__ == "__main__":
+    # 基准: 加入1000条进程规则, 对比逐条读取并写回整个文件(原实现)与batch中只写一次
+    import tempfile
+    import time
+
+    BASE = {
+        "mixed-port": 17890,
+        "proxies": [{"name": DEFAULT_PROXY, "server": "127.0.0.1", "port": 8443}],
+        "rules": ["PROCESS-NAME, dwrg.exe, Proxy_HTTP", "MATCH,DIRECT"],
+        "external-controller": "127.0.0.1:9090",
+    }
+    names = [f"game{i}.exe" for i in range(1000)]
+
+    def per_call(path: Path):
+        for name in names:
+            c = yaml.full_load(path.open("r", encoding="utf-8"))
+            c["rules"] = [f"PROCESS-NAME, {name}, Proxy_HTTP"] + c["rules"]
+            yaml.dump(c, path.open("w", encoding="utf-8"))
+
+    def batched(path: Path):
+        config = MihomoConfig(path)
+        with config.batch():
+            for name in names:
+                config.add_process(name)
+
+    def measure(label: str, fn, path: Path):
+        yaml.dump(BASE, path.open("w", encoding="utf-8"))
+        start = time.perf_counter()
+        fn(path)
+        elapsed = time.perf_counter() - start
+        rules = len(yaml.safe_load(path.read_text(encoding="utf-8"))["rules"])
+        print(f"{label:<24}{elapsed * 1000:>10.1f}ms  rules={rules}")
+
+    with tempfile.TemporaryDirectory() as d:
+        path = Path(d) / "mihomo_config.yaml"
+        print(f"C加速: {_Dumper is not yaml.SafeDumper}")
+        measure("逐条 full_load+dump", per_call, path)
+        measure("MihomoConfig.batch", batched, path)
+        config = MihomoConfig(path)
+        mtime = path.stat().st_mtime_ns
+        with config.batch():
+            config.add_process("game1.exe")  # 已存在
+        print("无变化时重写文件:", path.stat().st_mtime_ns != mtime)
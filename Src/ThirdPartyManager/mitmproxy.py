@@ -1,20 +1,68 @@
-import re
+import asyncio
+import json
 import shutil
-import subprocess
+import socket
 import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from queue import Empty, Queue
-from typing import Optional
-
-from Src.Proxy.process_port_manager import (
-    find_listening_pid,
-    log_pid_details,
-    force_kill,
+from typing import Any, Optional
+
+import httpx
+from Src.ThirdPartyManager.log_router import LogRouter, MITM_PATTERN
+from Src.ThirdPartyManager.supervisor import (
+    ManagedProcess,
+    OutputBuffer,
+    Watchdog,
+    probe_tcp,
+    wait_ready,
 )
+from Src.config import cfg
 from Src.init import app_dir_path
 from Src.runtimeLog import debug, info, warning, error
 
 
+@dataclass
+class MitmEvent:
+    """插件通过事件通道发送的事件"""
+
+    type: str  # 事件类型, 如 INFO/ERROR/REQUEST/QRCode/QRCodeLogin
+    flow: Optional[str]  # mitmproxy flow id, 与flow无关的事件为None
+    ts: float  # 事件产生时间戳
+    payload: Any  # 事件内容
+
+
+def _on_captured_event(name: str, payload: Any):
+    info(f"[italic yellow] MITM :[/italic yellow] {name}事件已捕获")
+    # TODO: 处理捕获后事件
+
+
+# 插件日志与事件共用的路由器, 非日志级别的标签视为捕获事件
+_log_router = LogRouter(" MITM ", MITM_PATTERN, on_unknown=_on_captured_event)
+
+
+def get_intercept_hosts() -> list[str]:
+    """根据配置生成选择性拦截的主机名单, 传给插件的 intercept_hosts 选项
+
+    proxy.selective_intercept 为真时仅对 proxy.intercept_hosts 中的域名进行TLS解密,
+    其余连接直接以TCP隧道透传, 避免对CDN、更新下载等流量做无意义的解密与重加密
+    为假时返回空列表, 即拦截全部连接
+    """
+    if not cfg["proxy"].get("selective_intercept", True):
+        return []
+    hosts = cfg["proxy"].get("intercept_hosts", ["service.mkey.163.com"])
+    return [host.lower() for host in hosts]
+
+
+def build_intercept_args() -> list[str]:
+    """生成mitmdump的选择性拦截命令行参数"""
+    return [
+        arg
+        for host in get_intercept_hosts()
+        for arg in ("--set", f"intercept_hosts={host}")
+    ]
+
+
 def download():
     pass
 
@@ -67,16 +115,66 @@ def move_plugin_to_app_dir_path():
     info("已将mitmproxy插件复制到应用目录下")
 
 
+class _RunningSignal:
+    """内嵌模式的启动信号
+
+    DumpMaster 在代理端口开始监听后才触发 running 事件, 以此作为启动完成,
+    启动耗时包含监听端口; 事件循环异常退出时只置位 event, listening 保持False
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.listening = False
+
+    def running(self):
+        self.listening = True
+        self.event.set()
+
+
 class MitmproxyManager:
-    def __init__(self, port=8443):
+    """mitmproxy管理器
+
+    支持两种运行模式, 对外接口一致:
+    - 子进程模式: 启动 mitmdump.exe 并加载应用目录下的插件
+    - 内嵌模式: 在本进程的独立asyncio事件循环线程中运行 DumpMaster,
+      省去进程启动、输出解析和按端口查找PID, 并可通过 self.addon 直接访问插件状态
+    """
+
+    def __init__(
+        self,
+        port=8443,
+        embedded: Optional[bool] = None,
+        output_capacity: int = 1000,
+    ):
         self.port = port
-        self.mitmproxy_process: Optional[subprocess.Popen] = None
+        self.embedded = (
+            cfg["proxy"].get("mitmproxy_embedded", False)
+            if embedded is None
+            else embedded
+        )
+        self.mitmproxy_process = ManagedProcess(
+            "mitmproxy", self._on_output_line, merge_stderr=False
+        )
+        # 子进程模式下崩溃后自动重启
+        self.watchdog = Watchdog(self.mitmproxy_process, self._restart)
         self.mitmproxy_path = app_dir_path / "ThirdParty" / "mitmproxy" / "mitmdump.exe"
 
+        # 内嵌模式相关属性
+        self.addon = None
+        self._master = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._master_thread: Optional[threading.Thread] = None
+        self.started_at: Optional[float] = None
+
         # 输出管理相关属性
-        self.output_queue = Queue()
-        self._capture_threads = []
-        self._running = False
+        self.output = OutputBuffer(capacity=output_capacity)
+        self._output_cursor = 0
+        # 插件事件通道, 在托管事件循环中本地监听, 由插件连接后发送NDJSON事件
+        self._event_server: Optional[asyncio.Server] = None
+        # 插件耗时直方图HTTP端点端口(子进程模式)
+        self.metrics_port: Optional[int] = None
+        # 二维码登录记录文件
+        self.qrcode_store_path = app_dir_path / "qrcode_sessions.json"
 
     def start_mitmproxy(self):
         """启动mitmproxy并开始捕获输出"""
@@ -84,6 +182,22 @@ class MitmproxyManager:
             warning("[italic yellow] MITM :[/italic yellow] mitmproxy已经启动")
             return
 
+        start = time.perf_counter()
+        self.started_at = time.monotonic()
+        if self.embedded:
+            self._start_embedded()
+        else:
+            self._start_subprocess()
+
+        info(
+            f"[italic yellow] MITM :[/italic yellow] mitmproxy started on port {self.port}"
+            f" ({'内嵌' if self.embedded else '子进程'}模式, 耗时 {(time.perf_counter() - start) * 1000:.1f}ms)"
+        )
+        if not self.embedded and cfg["proxy"]["watchdog"]:
+            self.watchdog.arm()
+
+    def _start_subprocess(self):
+        """以子进程方式启动mitmdump.exe"""
         certs_dir = app_dir_path / "certs"
         script_path = self.mitmproxy_path.parent / "MITM_4_service_mkey_163_com.py"
 
@@ -91,143 +205,261 @@ class MitmproxyManager:
             str(self.mitmproxy_path),
             "--set",
             f"confdir={certs_dir}",
+            "--set",
+            f"event_channel=127.0.0.1:{self._open_event_channel()}",
+            "--set",
+            f"metrics_port={self._pick_metrics_port()}",
+            "--set",
+            f"qrcode_store={self.qrcode_store_path}",
             "-k",  # 忽略SSL错误
             # "-q", # 静默运行
             "-p",
             str(self.port),
             "-s",
             str(script_path),
+            *build_intercept_args(),
         ]
 
         try:
-            self.mitmproxy_process = subprocess.Popen(
-                args,
-                stdout=subprocess.PIPE,
-                # stderr=subprocess.PIPE,
-                bufsize=1,  # 行缓冲
-                universal_newlines=True,
-            )
+            self.mitmproxy_process.start(args)
         except FileNotFoundError:
+            self._close_event_channel()
             error(
                 f"[italic yellow] MITM :[/italic yellow] mitmdump.exe not found at {self.mitmproxy_path}"
             )
             raise RuntimeError(f"mitmdump.exe not found at {self.mitmproxy_path}")
 
-        self._running = True
+    def _start_embedded(self, timeout: float = 5):
+        """在独立的事件循环线程中运行 DumpMaster"""
+        from mitmproxy import options
+        from mitmproxy.tools.dump import DumpMaster
 
-        # 捕获stdout
-        self._capture_threads = [
-            threading.Thread(
-                target=self._enqueue_output,
-                args=(self.mitmproxy_process.stdout,),
-                daemon=True,
-            ),
-            # threading.Thread(target=enqueue_output, args=(self.mitmproxy_process.stderr, 'STDERR'), daemon=True)
-        ]
+        from Src.Proxy.plugin import MITM_4_service_mkey_163_com as plugin
 
-        for t in self._capture_threads:
-            t.start()
+        self.addon = plugin.Proxy_service_mkey_163_com()
+        plugin.events.set_sink(self._receive_embedded_event)
+        started = _RunningSignal()
 
+        async def _run():
+            opts = options.Options(
+                listen_port=self.port,
+                confdir=str(app_dir_path / "certs"),
+                ssl_insecure=True,  # 忽略SSL错误
+            )
+            # DumpMaster 需要在运行中的事件循环内创建
+            # 使用局部变量: 停止超时时 self._master 可能已被其他线程改变
+            master = DumpMaster(opts, with_termlog=False, with_dumper=False)
+            master.addons.add(self.addon, started)
+            master.options.update(
+                qrcode_store=str(self.qrcode_store_path),
+                intercept_hosts=get_intercept_hosts(),
+            )
+            self._master = master
+            try:
+                await master.run()
+            finally:
+                # mitmdump随进程退出释放端口, 内嵌模式需手动关闭监听
+                if proxyserver := master.addons.get("proxyserver"):
+                    await proxyserver.servers.update([])
+
+        def _loop_worker():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(_run())
+            except Exception as e:
+                error(
+                    f"[italic yellow] MITM :[/italic yellow] 内嵌mitmproxy异常退出: {e}"
+                )
+            finally:
+                started.event.set()
+                self._loop.close()
+
+        self._master_thread = threading.Thread(
+            target=_loop_worker, name="MitmproxyLoop", daemon=True
+        )
+        self._master_thread.start()
+        if not started.event.wait(timeout) or not started.listening:
+            raise RuntimeError("内嵌mitmproxy启动失败")
+
+    def wait_ready(self, timeout: float = 15) -> float:
+        """等待代理端口可连接, 返回自启动起的就绪耗时(秒)
+
+        Raises:
+            TimeoutError: 超时仍未就绪
+            RuntimeError: mitmproxy在就绪前退出
+        """
+        return self.mitmproxy_process.supervisor.run(self.ready(timeout))
+
+    async def ready(self, timeout: float = 15) -> float:
+        """wait_ready 的协程版本, 在托管事件循环中等待, 可被取消"""
+        await wait_ready(
+            lambda: probe_tcp("127.0.0.1", self.port),
+            timeout,
+            alive=self.is_running,
+        )
+        elapsed = time.monotonic() - self.started_at
         info(
-            f"[italic yellow] MITM :[/italic yellow] mitmproxy started on port {self.port}"
+            f"[italic yellow] MITM :[/italic yellow] mitmproxy已就绪"
+            f" (耗时 {elapsed * 1000:.0f}ms)"
         )
+        return elapsed
+
+    def _pick_metrics_port(self) -> int:
+        """为插件的耗时直方图端点选择一个空闲端口"""
+        with socket.create_server(("127.0.0.1", 0)) as s:
+            self.metrics_port = s.getsockname()[1]
+        return self.metrics_port
+
+    def get_latency_stats(self, timeout: float = 1) -> Optional[dict]:
+        """获取插件各hook与处理方法的耗时直方图
+
+        内嵌模式直接读取插件状态, 子进程模式从插件的本地HTTP端点获取
+        Returns:
+            {"buckets_us": [...], "histograms": {名称: {count, sum_us, counts, p50_us, p99_us}}}
+            获取失败时返回None
+        """
+        if not self.is_running():
+            return None
+        if self.embedded:
+            from Src.Proxy.plugin import MITM_4_service_mkey_163_com as plugin
+
+            return plugin.metrics.snapshot()
+        try:
+            response = httpx.get(
+                f"http://127.0.0.1:{self.metrics_port}/metrics", timeout=timeout
+            )
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            warning(f"[italic yellow] MITM :[/italic yellow] 获取耗时统计失败: {e}")
+            return None
+
+    def _receive_embedded_event(self, event: dict):
+        """内嵌模式下插件事件的进程内回调"""
+        event = MitmEvent(**event)
+        self._handle_event(event)
+        self.output.append(event)
+
+    def _restart(self):
+        """看门狗重启: 启动并等待就绪, 未就绪时停止进程后抛出异常"""
+        self.start_mitmproxy()
+        try:
+            self.wait_ready(cfg["proxy"]["ready_timeout"])
+        except Exception:
+            self._stop_subprocess()
+            raise
 
     def stop_mitmproxy(self):
         """停止mitmproxy进程"""
+        self.watchdog.disarm()
         if not self.is_running():
             return
 
-        self._running = False  # 停止捕获线程
+        start = time.perf_counter()
+        if self.embedded:
+            self._stop_embedded()
+        else:
+            self._stop_subprocess()
+        info(
+            f"[italic yellow] MITM :[/italic yellow] mitmproxy stopped"
+            f" (耗时 {(time.perf_counter() - start) * 1000:.1f}ms)"
+        )
 
+    def _stop_subprocess(self):
         try:
-            # 先尝试优雅终止
-            self.mitmproxy_process.terminate()
-            self.mitmproxy_process.wait(timeout=2)  # 等待进程完全退出
-        except ProcessLookupError:
-            pass  # 进程已经结束
-        except TimeoutError:
-            # self._force_kill()
-            pass  # 无论退不退出都需要强制关闭（可能是windows特性？）
+            # mitmdump.exe为单文件打包程序, 实际监听端口的是其子进程, 需连同进程树一起终止
+            self.mitmproxy_process.stop(timeout=2)
         finally:
-            self.mitmproxy_process = None
-            self._force_kill()
-            info("[italic yellow] MITM :[/italic yellow] mitmproxy stopped")
-
-    def _force_kill(self):
-        """
-        查找指定TCP端口的LISTEN状态进程PID, 然后发送终止信号
-        """
+            self._close_event_channel()
 
-        pids = find_listening_pid(self.port)
+    def _stop_embedded(self, timeout: float = 5):
+        from Src.Proxy.plugin import MITM_4_service_mkey_163_com as plugin
 
         try:
-            pid = pids[0]
-            if len(pids) > 1:
-                warning(
-                    f"[italic yellow] MITM :[/italic yellow] 检测到多个pid占用，默认kill第一个 PID:{pid}"
-                )
-            log_pid_details(pid)
-            force_kill(pid)
-        except IndexError:
-            warning("[italic yellow] MITM :[/italic yellow] 未检测到端口占用")
-            pass
+            self._loop.call_soon_threadsafe(self._master.shutdown)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+        self._master_thread.join(timeout)
+        if self._master_thread.is_alive():
+            # 事件循环线程仍在使用 DumpMaster, 保留引用以便再次停止
+            warning("[italic yellow] MITM :[/italic yellow] 内嵌mitmproxy未能按时退出")
+            return
+        plugin.events.set_sink(None)
+        self._master = None
+        self._master_thread = None
+
+    def health(self) -> dict:
+        """进程状态概要, 与MihomoManager一致"""
+        if self.embedded:
+            return {
+                "name": "mitmproxy",
+                "pid": None,
+                "running": self.is_running(),
+                "returncode": None,
+                "uptime": None,
+            }
+        return {**self.mitmproxy_process.health(), "watchdog": self.watchdog.stats()}
 
     def is_running(self):
         """检查进程是否正在运行"""
-        return (
-            self.mitmproxy_process is not None and self.mitmproxy_process.poll() is None
+        if self.embedded:
+            return self._master_thread is not None and self._master_thread.is_alive()
+        return self.mitmproxy_process.is_running()
+
+    def _open_event_channel(self) -> int:
+        """打开插件事件通道的本地监听端口, 返回端口号"""
+        self._close_event_channel()
+        self._event_server = self.mitmproxy_process.supervisor.run(
+            asyncio.start_server(self._receive_events, "127.0.0.1", 0)
         )
+        return self._event_server.sockets[0].getsockname()[1]
+
+    def _close_event_channel(self):
+        if self._event_server is not None:
+            self.mitmproxy_process.supervisor.call_soon(self._event_server.close)
+            self._event_server = None
+
+    async def _receive_events(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """事件通道连接处理, 逐行解析插件发送的NDJSON事件"""
+        debug("[italic yellow] MITM :[/italic yellow] 事件通道已连接")
+        try:
+            while line := await reader.readline():
+                try:
+                    event = MitmEvent(**json.loads(line))
+                except (ValueError, TypeError) as e:
+                    warning(f"[italic yellow] MITM :[/italic yellow] 无效事件: {e}")
+                    continue
+                self._handle_event(event)
+                self.output.append(event)
+        finally:
+            writer.close()
 
-    def _enqueue_output(self, stream):
-        debug("[italic yellow] MITM :[/italic yellow] 捕获线程启动")
-        p = re.compile(r"<.*>(.*)</.*>")
-        s = re.compile(r".*proxy listening at.*")
-        while self._running:
-            try:
-                line = stream.readline().strip()
-                if s.match(line):
-                    self._log_out(line)
-                    self.output_queue.put(line.strip())
-                if p.match(line):
-                    self._log_out(line)
-                    self.output_queue.put(line.strip())
-            except ValueError:  # 当流关闭时可能发生
-                break
+    @staticmethod
+    def _handle_event(event: MitmEvent):
+        if not _log_router.log(event.type, str(event.payload)):
+            _on_captured_event(event.type, event.payload)
+
+    def _on_output_line(self, line: str):
+        """标准输出仅包含mitmproxy自身日志"""
+        if "proxy listening at" in line:
+            self._log_out(line)
+            self.output.append(MitmEvent("STDOUT", None, time.time(), line))
 
     def _log_out(self, line):
-        p = re.compile(r"<([^>]+)>(.*?)</\1>")
-        try:
-            if p.match(line):
-                name, msg = p.findall(line)[0]
-                # 日志输出
-                _name = name.lower()
-                if (
-                    _name == "debug"
-                    or _name == "info"
-                    or _name == "warning"
-                    or _name == "error"
-                ):
-                    eval(f"{_name}('[italic yellow] MITM :[/italic yellow] {msg}')")
-                else:
-                    info(f"[italic yellow] MITM :[/italic yellow] {name}事件已捕获")
-                    # TODO: 处理捕获后事件
-
-            else:
-                eval(f"info('[italic yellow] MITM :[/italic yellow] {line}')")
-        except Exception as e:
-            error(f"[italic yellow] MITM :[/italic yellow] 未知错误: {e}")
-
-    def get_output(self, timeout=0.1):
+        _log_router.route(line)
+
+    def get_output(self, since: Optional[int] = None) -> list:
         """
-        获取捕获的输出内容
-        返回： message 的列表
+        获取捕获的输出内容, 不阻塞
+        参数： since 起始序号, 默认从上次调用 get_output 之后开始
+        返回： MitmEvent 的列表
         """
-        outputs = []
-        while True:
-            try:
-                outputs.append(self.output_queue.get(timeout=timeout))
-            except Empty:
-                break
+        outputs, self._output_cursor = self.output.read_since(
+            self._output_cursor if since is None else since
+        )
         return outputs
 
     def __del__(self):
@@ -0,0 +1,596 @@
+"""第三方子进程统一托管
+
+所有子进程共用一个后台asyncio事件循环: 进程启动、输出读取与退出等待都以协程完成,
+不再为每个子进程的每个输出流单独创建读取线程. 各管理器通过 ManagedProcess 获得一致的
+start/stop/is_running/health/wait_ready 接口, 就绪探测以指数退避间隔轮询;
+Watchdog 在进程意外退出时自动重启.
+"""
+
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from itertools import islice
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Optional,
+    Sequence,
+)
+
+import httpx
+import psutil
+
+from Src.runtimeLog import debug, info, warning, error
+
+
+class ProcessSupervisor:
+    """托管子进程的后台事件循环, 进程内单例, 首次使用时启动"""
+
+    _instance: Optional["ProcessSupervisor"] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="ProcessSupervisor", daemon=True
+        )
+        self._thread.start()
+        debug("子进程托管事件循环已启动")
+
+    @classmethod
+    def get(cls) -> "ProcessSupervisor":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def submit(self, coro: Coroutine) -> Future:
+        """将协程提交到后台事件循环, 立即返回Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None):
+        """在后台事件循环中执行协程并等待结果"""
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback: Callable, *args):
+        """线程安全地在后台事件循环中调用普通函数"""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+
+async def probe_tcp(host: str, port: int, timeout: float = 0.5) -> bool:
+    """TCP连接探测, 端口可连接即视为就绪"""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+async def probe_http(
+    url: str, headers: Optional[dict] = None, timeout: float = 0.5
+) -> bool:
+    """HTTP探测, 返回2xx即视为就绪"""
+    try:
+        # 仅用于本地明文HTTP, 不创建SSL上下文, 避免每次探测阻塞事件循环约100ms
+        async with httpx.AsyncClient(
+            timeout=timeout, verify=False, trust_env=False
+        ) as client:
+            response = await client.get(url, headers=headers)
+        return response.is_success
+    except httpx.HTTPError:
+        return False
+
+
+async def wait_ready(
+    probe: Callable[[], Awaitable[bool]],
+    timeout: float,
+    alive: Optional[Callable[[], bool]] = None,
+    interval: float = 0.02,
+    max_interval: float = 0.5,
+) -> float:
+    """按指数退避间隔轮询探测, 直到就绪
+
+    Args:
+        probe: 探测协程函数, 返回True表示就绪
+        timeout: 最长等待秒数
+        alive: 进程存活检查, 返回False时立即失败而不必等到超时
+        interval: 首次轮询间隔, 之后每次翻倍
+        max_interval: 轮询间隔上限
+    Returns:
+        就绪耗时(秒)
+    Raises:
+        TimeoutError: 超时仍未就绪
+        RuntimeError: 等待期间进程已退出
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    while True:
+        if alive is not None and not alive():
+            raise RuntimeError("进程在就绪前退出")
+        if await probe():
+            return time.monotonic() - start
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"{timeout}秒内未就绪")
+        await asyncio.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+
+class OutputBuffer:
+    """固定容量的输出环形缓冲区
+
+    追加为O(1), 超出容量时丢弃最旧的记录, 长时间运行内存也不会增长.
+    每条记录带有递增序号, 读取方通过 read_since(seq) 按游标增量获取;
+    也可以通过 subscribe 注册回调或 stream 异步迭代, 在新记录追加时立即收到
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self._items: deque[Any] = deque(maxlen=capacity)
+        self._next_seq = 0
+        self._lock = threading.Lock()
+        self._subscribers: list[Callable[[int, Any], None]] = []
+
+    @property
+    def next_seq(self) -> int:
+        """下一条记录的序号, 可作为之后 read_since 的起始游标"""
+        return self._next_seq
+
+    def append(self, item: Any) -> int:
+        """追加记录并通知订阅者, 返回记录序号"""
+        with self._lock:
+            seq = self._next_seq
+            self._items.append(item)
+            self._next_seq += 1
+            subscribers = tuple(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(seq, item)
+            except Exception as e:
+                warning(f"输出订阅回调失败: {e}")
+        return seq
+
+    def read_since(self, seq: int = 0) -> tuple[list, int]:
+        """读取序号不小于seq的记录
+
+        Returns:
+            (记录列表, 下一次读取的游标); 游标早于缓冲区中最旧的记录时从最旧的开始返回
+        """
+        with self._lock:
+            first_seq = self._next_seq - len(self._items)
+            items = list(islice(self._items, max(seq - first_seq, 0), None))
+            return items, self._next_seq
+
+    def subscribe(self, callback: Callable[[int, Any], None]) -> Callable[[], None]:
+        """注册回调 callback(seq, item), 在追加记录的线程中调用, 返回取消订阅函数"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    async def stream(self, since: Optional[int] = None) -> AsyncIterator[Any]:
+        """异步迭代新记录, 指定since时先补发缓冲区中该游标之后的记录"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        unsubscribe = self.subscribe(
+            lambda seq, item: loop.call_soon_threadsafe(queue.put_nowait, (seq, item))
+        )
+        try:
+            # 订阅之后追加的记录都会进入队列; 补发时跳过队列中已包含在补发内容里的记录
+            cursor = 0
+            if since is not None:
+                backlog, cursor = self.read_since(since)
+                for item in backlog:
+                    yield item
+            while True:
+                seq, item = await queue.get()
+                if seq >= cursor:  # 跳过补发时已返回的记录
+                    yield item
+        finally:
+            unsubscribe()
+
+
+class _ExitNotifyingProtocol(asyncio.subprocess.SubprocessStreamProtocol):
+    """进程退出时立即置位 exited
+
+    Process.wait() 要等输出管道全部关闭才返回, 管道被孙进程继承时会一直等待
+    """
+
+    def __init__(self, limit: int, loop: asyncio.AbstractEventLoop):
+        super().__init__(limit=limit, loop=loop)
+        self.exited = asyncio.Event()
+
+    def process_exited(self):
+        super().process_exited()
+        self.exited.set()
+
+
+class ManagedProcess:
+    """由 ProcessSupervisor 托管的子进程
+
+    Args:
+        name: 日志中显示的名称
+        on_line: 每读到一行输出(已解码并去除首尾空白, 空行跳过)时的回调, 在后台事件循环中执行
+        merge_stderr: 是否将stderr合并到stdout一并读取, 否则stderr继承父进程
+    """
+
+    def __init__(
+        self,
+        name: str,
+        on_line: Callable[[str], None],
+        merge_stderr: bool = True,
+    ):
+        self.name = name
+        self.on_line = on_line
+        self.merge_stderr = merge_stderr
+        self.supervisor = ProcessSupervisor.get()
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.started_at: Optional[float] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._exit_event: Optional[asyncio.Event] = None
+        self._tracker: Optional[asyncio.Task] = None
+        # 运行中定期记录的子孙进程, 进程崩溃后据此清理遗留的孙进程
+        self._known_descendants: list[psutil.Process] = []
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process is not None else None
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.returncode if self.process is not None else None
+
+    def start(self, args: Sequence[str], cwd: Optional[str] = None):
+        """启动子进程, 启动失败时抛出原始异常(如FileNotFoundError)"""
+        self.supervisor.run(self._start(args, cwd))
+
+    async def _start(self, args: Sequence[str], cwd: Optional[str]):
+        # 与 asyncio.create_subprocess_exec 相同, 但使用可通知退出的协议
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.subprocess_exec(
+            lambda: _ExitNotifyingProtocol(limit=2**16, loop=loop),
+            *args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if self.merge_stderr else None,
+            cwd=cwd,
+            # 非Windows系统放入独立进程组, 停止时可连同孙进程一起发送信号
+            start_new_session=os.name != "nt",
+        )
+        self.process = asyncio.subprocess.Process(transport, protocol, loop)
+        self._exit_event = protocol.exited
+        self._known_descendants = []
+        self.started_at = time.monotonic()
+        self._reader = asyncio.create_task(self._read_lines(self.process.stdout))
+        self._tracker = asyncio.create_task(self._track_descendants(protocol.exited))
+
+    async def _read_lines(self, stream: asyncio.StreamReader):
+        while True:
+            try:
+                line = await stream.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                line = e.partial  # 输出结束, 最后一行可能没有换行符
+                if not line:
+                    break
+            except asyncio.LimitOverrunError as e:
+                # 超过缓冲区上限的行按上限拆成多段处理, 保证管道一直被读取, 子进程不会阻塞在写入上
+                line = await stream.read(max(e.consumed, 1))
+            self._handle_line(line)
+
+    def _handle_line(self, line: bytes):
+        line = line.decode("utf-8", errors="replace").strip()
+        if not line:
+            return
+        try:
+            self.on_line(line)
+        except Exception as e:
+            warning(f"{self.name} 输出处理失败: {e}")
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def wait_exit(self) -> Optional[int]:
+        """等待进程退出并返回退出码, 进程退出时立即返回, 不等待输出管道关闭"""
+        await self._exit_event.wait()
+        return self.process.returncode
+
+    def stop(self, timeout: float = 3) -> Optional[int]:
+        """终止进程及其全部子孙进程, 超时后强制结束, 返回退出码"""
+        if self.process is None:
+            return None
+        return self.supervisor.run(self._stop(timeout))
+
+    def _descendants(self) -> list[psutil.Process]:
+        try:
+            return psutil.Process(self.process.pid).children(recursive=True)
+        except psutil.Error:
+            return []
+
+    async def _track_descendants(
+        self, exited: asyncio.Event, min_interval=0.05, max_interval=2
+    ):
+        """进程运行期间定期记录子孙进程
+
+        进程退出后其子孙进程不再能通过它找到(Windows上没有进程组可以整体结束),
+        只能按退出前的记录清理; 启动初期子进程变化频繁, 间隔从min_interval逐渐增大
+        """
+        interval = min_interval
+        while not exited.is_set():
+            descendants = await asyncio.to_thread(self._descendants)
+            if exited.is_set():
+                break  # 退出后查询到的结果不完整, 保留上一次的记录
+            self._known_descendants = descendants
+            try:
+                await asyncio.wait_for(exited.wait(), interval)
+            except asyncio.TimeoutError:
+                interval = min(interval * 2, max_interval)
+
+    def _leftover_descendants(self) -> list[psutil.Process]:
+        """当前可找到的子孙进程与退出前记录中仍存活的子孙进程"""
+        current = self._descendants()
+        pids = {proc.pid for proc in current}
+        return current + [
+            proc
+            for proc in self._known_descendants
+            if proc.pid not in pids and not self._exited(proc)
+        ]
+
+    async def kill_leftovers(self) -> int:
+        """强制结束进程退出后遗留的子孙进程, 返回结束的数量
+
+        在后台事件循环中调用; 进程意外退出后用于避免遗留的孙进程继续占用端口导致重启失败
+        """
+        leftovers = self._leftover_descendants()
+        self._signal_tree(leftovers, kill=True)
+        await self._wait_tree(leftovers, 1)
+        return len(leftovers)
+
+    def _signal_tree(self, descendants: list[psutil.Process], kill: bool):
+        """向进程组(非Windows)、子进程与已记录的子孙进程发送终止信号"""
+        if os.name != "nt":
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass  # 进程组已不存在
+        if self.process.returncode is None:
+            try:
+                self.process.kill() if kill else self.process.terminate()
+            except ProcessLookupError:
+                pass  # 进程已经结束
+        for child in descendants:
+            try:
+                child.kill() if kill else child.terminate()
+            except psutil.Error:
+                pass
+
+    @staticmethod
+    def _exited(proc: psutil.Process) -> bool:
+        # 已退出但尚未被回收的僵尸进程也视为已退出
+        try:
+            return proc.status() == psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return True
+
+    async def _wait_tree(
+        self, descendants: list[psutil.Process], timeout: float
+    ) -> list[psutil.Process]:
+        """等待进程与子孙进程退出, 返回超时后仍存活的子孙进程
+
+        子进程退出由事件循环回收后设置returncode(process.wait()还要等输出管道关闭,
+        而管道可能仍被孙进程持有); 子孙进程不是本进程的子进程, 均以指数退避间隔轮询
+        """
+        deadline = time.monotonic() + timeout
+        interval = 0.001
+        alive = [proc for proc in descendants if not self._exited(proc)]
+        while (alive or self.process.returncode is None) and (
+            time.monotonic() < deadline
+        ):
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, 0.05)
+            alive = [proc for proc in alive if not self._exited(proc)]
+        return alive
+
+    async def _stop(self, timeout: float) -> Optional[int]:
+        # 先记录进程树, 父进程退出后子孙进程会被重新挂靠, 无法再通过父进程找到
+        descendants = self._leftover_descendants()
+        if self.process.returncode is not None and not descendants:
+            return self.process.returncode
+        self._signal_tree(descendants, kill=False)
+        alive = await self._wait_tree(descendants, timeout)
+        if self.process.returncode is None or alive:
+            warning(f"{self.name} 未能在{timeout}秒内退出, 强制终止")
+            self._signal_tree(alive, kill=True)
+            await self._wait_tree(alive, 1)
+        if self._reader is not None:
+            # 孙进程可能仍持有输出管道, 不无限等待读取结束
+            try:
+                await asyncio.wait_for(self._reader, 1)
+            except asyncio.TimeoutError:
+                pass
+            except Exception as e:
+                warning(f"{self.name} 输出读取异常结束: {e}")
+            self._reader = None
+        return self.process.returncode
+
+    async def wait_ready(
+        self, probe: Callable[[], Awaitable[bool]], timeout: float
+    ) -> float:
+        """等待进程就绪, 返回自启动起的就绪耗时(秒)"""
+        await wait_ready(probe, timeout, alive=self.is_running)
+        return time.monotonic() - self.started_at
+
+    def health(self) -> dict:
+        """进程状态概要"""
+        running = self.is_running()
+        return {
+            "name": self.name,
+            "pid": self.pid,
+            "running": running,
+            "returncode": self.returncode,
+            "uptime": (
+                time.monotonic() - self.started_at
+                if running and self.started_at is not None
+                else None
+            ),
+        }
+
+
+class Watchdog:
+    """子进程崩溃看门狗
+
+    通过退出通知(而非轮询)发现进程意外退出, 按带抖动的指数退避重启;
+    window 秒内崩溃超过 max_crashes 次时熔断, 不再重启.
+
+    Args:
+        process: 被看护的进程
+        restart: 重启函数, 在线程池中执行, 应启动进程并等待就绪, 失败时抛出异常
+        base_delay: 首次重启前的等待秒数, 之后每次翻倍
+        max_delay: 重启等待上限
+        max_crashes: 熔断阈值
+        window: 熔断统计窗口(秒)
+    """
+
+    def __init__(
+        self,
+        process: ManagedProcess,
+        restart: Callable[[], Any],
+        base_delay: float = 0.5,
+        max_delay: float = 30,
+        max_crashes: int = 5,
+        window: float = 60,
+    ):
+        self.process = process
+        self.restart = restart
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_crashes = max_crashes
+        self.window = window
+
+        self.crashes = 0
+        self.restarts = 0
+        self.failed_restarts = 0
+        self.tripped = False
+        self.total_uptime = 0.0  # 已结束的各次运行时长之和
+        self.recover_times: deque[float] = deque(maxlen=100)
+        self._recent_failures: deque[float] = deque()
+        self._armed = False
+        self._task: Optional[asyncio.Task] = None
+        self._restarting: Optional[asyncio.Future] = None
+
+    def arm(self):
+        """开始看护, 在进程启动后调用; 看门狗自身重启进程时重复调用无副作用"""
+        self._armed = True
+        self.tripped = False
+        if self._task is None or self._task.done():
+            self.process.supervisor.run(self._arm())
+
+    async def _arm(self):
+        self._task = asyncio.create_task(self._watch())
+
+    def disarm(self):
+        """停止看护, 在主动停止进程前调用; 正在进行的重启会等待其完成"""
+        self._armed = False
+        if self._task is not None and not self._task.done():
+            self.process.supervisor.run(self._cancel())
+        self._armed = False  # 等待中的重启可能再次调用了arm
+
+    async def _cancel(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        if self._restarting is not None:
+            await asyncio.gather(self._restarting, return_exceptions=True)
+        self._task = None
+
+    def _backoff(self) -> float:
+        """带抖动的指数退避: 在 [delay/2, delay] 中随机取值"""
+        attempt = max(len(self._recent_failures) - 1, 0)
+        delay = min(self.base_delay * 2**attempt, self.max_delay)
+        return delay * (0.5 + random.random() / 2)
+
+    def _record_failure(self, now: float) -> bool:
+        """记录一次崩溃或重启失败, 返回是否触发熔断"""
+        self._recent_failures.append(now)
+        while self._recent_failures and now - self._recent_failures[0] > self.window:
+            self._recent_failures.popleft()
+        return len(self._recent_failures) > self.max_crashes
+
+    async def _watch(self):
+        while True:
+            returncode = await self.process.wait_exit()
+            if not self._armed:
+                return
+            crashed_at = time.monotonic()
+            uptime = crashed_at - self.process.started_at
+            self.crashes += 1
+            self.total_uptime += uptime
+            warning(
+                f"{self.process.name} 意外退出 (返回码 {returncode}, 运行 {uptime:.1f}秒)"
+            )
+            # 清理崩溃进程遗留的孙进程
+            leftovers = await self.process.kill_leftovers()
+            if leftovers:
+                warning(f"{self.process.name} 遗留的{leftovers}个子孙进程已结束")
+
+            tripped = self._record_failure(crashed_at)
+            while not tripped:
+                delay = self._backoff()
+                debug(f"{self.process.name} 将在 {delay:.2f}秒后重启")
+                await asyncio.sleep(delay)
+                self._restarting = asyncio.ensure_future(
+                    asyncio.to_thread(self.restart)
+                )
+                try:
+                    await asyncio.shield(self._restarting)
+                    break
+                except Exception as e:
+                    self.failed_restarts += 1
+                    warning(f"{self.process.name} 重启失败: {e}")
+                    tripped = self._record_failure(time.monotonic())
+                finally:
+                    self._restarting = None
+            if tripped:
+                self.tripped = True
+                error(
+                    f"{self.process.name} 在{self.window:.0f}秒内崩溃超过"
+                    f"{self.max_crashes}次, 停止自动重启",
+                    exc_info=False,
+                )
+                return
+
+            recover = time.monotonic() - crashed_at
+            self.restarts += 1
+            self.recover_times.append(recover)
+            info(f"{self.process.name} 已恢复 (耗时 {recover * 1000:.0f}ms)")
+
+    def stats(self) -> dict:
+        """重启计数、运行时长与恢复耗时"""
+        running = self.process.is_running()
+        uptime = time.monotonic() - self.process.started_at if running else 0.0
+        return {
+            "armed": self._armed,
+            "tripped": self.tripped,
+            "crashes": self.crashes,
+            "restarts": self.restarts,
+            "failed_restarts": self.failed_restarts,
+            "uptime": uptime,
+            "total_uptime": self.total_uptime + uptime,
+            "last_recover": self.recover_times[-1] if self.recover_times else None,
+            "mean_recover": (
+                sum(self.recover_times) / len(self.recover_times)
+                if self.recover_times
+                else None
+            ),
+        }
@@ -0,0 +1,301 @@
+"""downloader 的测试
+
+替身文件服务器支持Range请求, 可配置响应延迟、每个连接的限速、每个响应发送若干字节后断开;
+替身API按 If-None-Match 返回200或304; 多个替身服务器以不同的延迟与限速模拟镜像
+"""
+
+import asyncio
+import hashlib
+import http.server
+import json
+import os
+import re
+import time
+import httpx
+import pytest
+
+from Src.ThirdPartyManager.downloader import DownloadError, download_file, fetch_json
+
+MB = 1024 * 1024
+DATA = os.urandom(6 * MB)
+DIGEST = "sha256:" + hashlib.sha256(DATA).hexdigest()
+
+
+class _FileHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        time.sleep(server.ttfb)
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match and server.fail_from is not None and int(match[1]) >= server.fail_from:
+            self.send_error(503)
+            return
+        if match and server.ranged:
+            start = int(match[1])
+            end = int(match[2]) if match[2] else len(DATA) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        else:
+            start, end = 0, len(DATA) - 1
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+
+        body = memoryview(DATA)[start : end + 1]
+        if server.drop_after is not None:
+            body = body[: server.drop_after]
+        try:
+            for i in range(0, len(body), 16384):
+                chunk = body[i : i + 16384]
+                self.wfile.write(chunk)
+                server.sent += len(chunk)
+                slow = server.slow_after is not None and server.sent > server.slow_after
+                rate = server.slow_rate if slow else server.rate
+                if rate:
+                    time.sleep(len(chunk) / rate)
+        except OSError:
+            return  # 客户端已断开
+        if len(body) < end - start + 1:
+            self.close_connection = True
+
+
+@pytest.fixture
+def servers(http_server):
+    """启动替身文件服务器的工厂, url 为文件地址
+
+    Args:
+        ranged: 是否支持Range请求
+        ttfb: 发送响应头前的延迟(秒)
+        rate: 每个连接的限速(字节/秒), 为0时不限速
+        drop_after: 每个响应最多发送的字节数, 之后断开连接
+        slow_after: 累计发送该字节数后改用slow_rate限速
+        fail_from: Range起始位置不小于该值的请求返回503
+    """
+
+    def start(
+        ranged=True,
+        ttfb=0.0,
+        rate=0,
+        drop_after=None,
+        slow_after=None,
+        slow_rate=0,
+        fail_from=None,
+    ):
+        server = http_server(
+            _FileHandler,
+            ranged=ranged,
+            ttfb=ttfb,
+            rate=rate,
+            drop_after=drop_after,
+            slow_after=slow_after,
+            slow_rate=slow_rate,
+            fail_from=fail_from,
+            sent=0,
+            requests=0,
+        )
+        server.url = f"{server.base_url}/mihomo.zip"
+        return server
+
+    return start
+
+
+def test_resumes_segments_after_dropped_connections(servers, tmp_path):
+    server = servers(drop_after=MB // 2)
+    path = tmp_path / "mihomo.zip"
+
+    result = asyncio.run(download_file(server.url, path, len(DATA), DIGEST, retries=20))
+
+    assert path.read_bytes() == DATA
+    assert result.segments == 4
+    assert server.requests > 1 + 4  # 探测与每段首次请求之外还有续传请求
+    assert not (tmp_path / "mihomo.zip.part").exists()
+    assert not (tmp_path / "mihomo.zip.part.json").exists()
+
+
+def test_retries_count_only_consecutive_failures(servers, tmp_path):
+    # 每段1.5MB, 每次只能下载0.5MB; 每次中断前都有进展, 不会耗尽重试次数
+    server = servers(drop_after=MB // 2)
+    path = tmp_path / "mihomo.zip"
+
+    asyncio.run(download_file(server.url, path, len(DATA), DIGEST, retries=1))
+
+    assert path.read_bytes() == DATA
+
+
+def test_failed_segment_stops_other_segments(servers, tmp_path):
+    # 最后一段始终失败, 其余分段限速下载中
+    server = servers(rate=MB, fail_from=len(DATA) // 4 * 3)
+    path = tmp_path / "mihomo.zip"
+
+    async def download():
+        with pytest.raises(httpx.HTTPStatusError):
+            await download_file(server.url, path, len(DATA), DIGEST, retries=0)
+        # 抛出异常时其余分段已经结束, 没有遗留在后台的任务
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+    asyncio.run(download())
+    assert server.sent < len(DATA) // 4 * 3
+
+
+def test_resumes_interrupted_download(servers, tmp_path):
+    server = servers(rate=2 * MB)
+    path = tmp_path / "mihomo.zip"
+
+    async def interrupted():
+        task = asyncio.create_task(download_file(server.url, path, digest=DIGEST))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(interrupted())
+    assert not path.exists()
+    assert (tmp_path / "mihomo.zip.part.json").exists()
+
+    result = asyncio.run(download_file(server.url, path, digest=DIGEST))
+    assert path.read_bytes() == DATA
+    assert 0 < result.downloaded < len(DATA)
+
+
+def test_rejects_digest_mismatch(servers, tmp_path):
+    server = servers()
+    path = tmp_path / "mihomo.zip"
+
+    with pytest.raises(DownloadError):
+        asyncio.run(download_file(server.url, path, digest="sha256:" + "0" * 64))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_falls_back_to_single_stream_without_range(servers, tmp_path):
+    server = servers(ranged=False)
+    path = tmp_path / "mihomo.zip"
+
+    result = asyncio.run(download_file(server.url, path, digest=DIGEST))
+
+    assert path.read_bytes() == DATA
+    assert result.segments == 1
+
+
+class _ReleaseHandler(http.server.BaseHTTPRequestHandler):
+    requests: list = []  # 各请求的 If-None-Match
+    accepts: list = []  # 各请求的 Accept
+
+    def do_GET(self):
+        etag = self.headers.get("If-None-Match")
+        self.requests.append(etag)
+        self.accepts.append(self.headers.get("Accept"))
+        if etag == '"r1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps({"tag_name": "v1.0.0", "assets": []}).encode()
+        self.send_response(200)
+        self.send_header("ETag", '"r1"')
+        self.send_header("Last-Modified", "Wed, 01 Jan 2025 00:00:00 GMT")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_fetch_json_revalidates_and_falls_back_offline(http_server, tmp_path):
+    server = http_server(_ReleaseHandler)
+    url = f"{server.base_url}/releases/latest"
+    cache = tmp_path / "cache" / "release.json"
+    requests = _ReleaseHandler.requests = []
+
+    try:
+        assert asyncio.run(fetch_json(url, cache))["tag_name"] == "v1.0.0"
+        assert requests == [None]
+        # 新鲜期内不发请求
+        assert asyncio.run(fetch_json(url, cache))["tag_name"] == "v1.0.0"
+        assert requests == [None]
+        # 过期后条件请求, 304时沿用缓存
+        assert asyncio.run(fetch_json(url, cache, max_age=0))["tag_name"] == "v1.0.0"
+        assert requests == [None, '"r1"']
+    finally:
+        server.close()
+
+    # 离线时退回到过期的缓存, 没有缓存时抛出异常
+    assert asyncio.run(fetch_json(url, cache, max_age=0))["tag_name"] == "v1.0.0"
+    cache.unlink()
+    with pytest.raises(httpx.HTTPError):
+        asyncio.run(fetch_json(url, cache))
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "not json",
+        "[]",
+        '{{"url": "{url}"}}',
+        '{{"url": "{url}", "fetched_at": "now", "data": {{}}}}',
+        '{{"url": "{url}", "fetched_at": 0, "data": {{}}, "etag": 1}}',
+    ],
+)
+def test_fetch_json_treats_malformed_cache_as_miss(http_server, tmp_path, content):
+    url = f"{http_server(_ReleaseHandler).base_url}/releases/latest"
+    cache = tmp_path / "release.json"
+    cache.write_text(content.format(url=url))
+    _ReleaseHandler.requests = []
+    _ReleaseHandler.accepts = []
+
+    data = asyncio.run(fetch_json(url, cache, accept="application/vnd.github+json"))
+    assert data["tag_name"] == "v1.0.0"
+    assert _ReleaseHandler.requests == [None]  # 不带条件请求头
+    assert _ReleaseHandler.accepts == ["application/vnd.github+json"]
+    assert json.loads(cache.read_text())["data"] == data
+
+
+def test_picks_mirror_with_fastest_first_byte(servers, tmp_path):
+    slow, fast = servers(ttfb=0.2), servers(ttfb=0.01)
+    stats = tmp_path / "mirrors.json"
+
+    result = asyncio.run(
+        download_file([slow.url, fast.url], tmp_path / "m.zip", stats_path=stats)
+    )
+
+    assert result.url == fast.url
+    assert set(json.loads(stats.read_text())) == {
+        url.split("/")[2] for url in (slow.url, fast.url)
+    }
+
+
+def test_switches_mirror_when_throughput_drops(servers, tmp_path):
+    # a 首字节最快, 发送1MB后每个连接降到64KB/s; b 稍慢但不限速
+    a = servers(slow_after=MB, slow_rate=64 * 1024)
+    b = servers(ttfb=0.05)
+    stats = tmp_path / "mirrors.json"
+    path = tmp_path / "m.zip"
+
+    result = asyncio.run(
+        download_file(
+            [a.url, b.url], path, digest=DIGEST, stats_path=stats, min_speed=MB
+        )
+    )
+    assert path.read_bytes() == DATA
+    assert result.url == b.url
+    assert 0 < b.sent < len(DATA)
+
+    # 下次按记录的速度直接选择b
+    requests = a.requests
+    path.unlink()
+    result = asyncio.run(
+        download_file([a.url, b.url], path, digest=DIGEST, stats_path=stats)
+    )
+    assert result.url == b.url
+    assert a.requests == requests + 1  # 只有探测请求
+
+
+def test_skips_unreachable_mirror(servers, tmp_path):
+    server = servers()
+    path = tmp_path / "m.zip"
+
+    result = asyncio.run(
+        download_file(["http://127.0.0.1:1/m.zip", server.url], path, digest=DIGEST)
+    )
+
+    assert result.url == server.url
+    assert path.read_bytes() == DATA
@@ -0,0 +1,118 @@
+"""LogRouter 的测试
+
+日志函数替换为记录 (函数名, 消息, extra) 的替身, 函数名取自 LOG_LEVELS 中对应的日志函数,
+从而同时检验级别别名的映射
+"""
+
+import pytest
+
+from Src.ThirdPartyManager.log_router import (
+    LOG_LEVELS,
+    LogRouter,
+    MIHOMO_PATTERN,
+    MITM_PATTERN,
+    unescape_logfmt,
+)
+
+
+@pytest.fixture
+def records():
+    return []
+
+
+@pytest.fixture
+def levels(records):
+    def recorder(name):
+        return lambda msg, **kwargs: records.append((name, msg, kwargs["extra"]))
+
+    return {level: recorder(log.__name__) for level, log in LOG_LEVELS.items()}
+
+
+@pytest.mark.parametrize(
+    "level, expected",
+    [
+        ("debug", "debug"),
+        ("info", "info"),
+        ("warning", "warning"),
+        ("warn", "warning"),
+        ("error", "error"),
+        ("fatal", "critical"),
+        ("CRITICAL", "critical"),
+    ],
+)
+def test_levels_map_to_log_functions(levels, records, level, expected):
+    router = LogRouter("MIHOMO", MIHOMO_PATTERN, levels=levels)
+    router.route(f'time="2025-03-01T10:00:00+08:00" level={level} msg="hello"')
+    assert records == [
+        (expected, "[italic yellow]MIHOMO:[/italic yellow] hello", {"source": "mihomo"})
+    ]
+
+
+def test_mihomo_line_is_unescaped_and_markup_escaped(levels, records):
+    router = LogRouter("MIHOMO", MIHOMO_PATTERN, unescape_logfmt, levels=levels)
+    router.route(r'level=error msg="parse rule \"DOMAIN,[bad],DIRECT\" failed"')
+    name, msg, _ = records[0]
+    assert name == "error"
+    # logfmt转义的引号被还原, 方括号被转义而不会被rich当作标记
+    assert msg == (
+        r'[italic yellow]MIHOMO:[/italic yellow] parse rule "DOMAIN,\[bad],DIRECT" failed'
+    )
+
+
+def test_mitm_tag_line(levels, records):
+    router = LogRouter(" MITM ", MITM_PATTERN, levels=levels)
+    router.route("<WARNING>pc_config 响应解析失败</WARNING>")
+    assert records == [
+        (
+            "warning",
+            "[italic yellow] MITM :[/italic yellow] pc_config 响应解析失败",
+            {"source": "mitm"},
+        )
+    ]
+
+
+@pytest.mark.parametrize("fallback_level", ["info", "debug"])
+def test_unmatched_line_uses_fallback_level(levels, records, fallback_level):
+    router = LogRouter(
+        " MITM ", MITM_PATTERN, fallback_level=fallback_level, levels=levels
+    )
+    router.route("listening [red] 8443")
+    assert records == [
+        (
+            fallback_level,
+            r"[italic yellow] MITM :[/italic yellow] listening \[red] 8443",
+            {"source": "mitm"},
+        )
+    ]
+
+
+def test_unknown_level_goes_to_callback(levels, records):
+    unknown = []
+    router = LogRouter(
+        " MITM ",
+        MITM_PATTERN,
+        on_unknown=lambda tag, msg: unknown.append((tag, msg)),
+        levels=levels,
+    )
+    router.route("<QRCode>{'uuid': 'abc'}</QRCode>")
+    assert unknown == [("QRCode", "{'uuid': 'abc'}")]
+    assert records == []
+
+
+def test_unknown_level_without_callback_logs_whole_line(levels, records):
+    router = LogRouter(" MITM ", MITM_PATTERN, levels=levels)
+    router.route("<QRCode>abc</QRCode>")
+    assert records == [
+        (
+            "info",
+            "[italic yellow] MITM :[/italic yellow] <QRCode>abc</QRCode>",
+            {"source": "mitm"},
+        )
+    ]
+
+
+def test_log_reports_unknown_level(levels, records):
+    router = LogRouter("MIHOMO", MIHOMO_PATTERN, levels=levels)
+    assert router.log("Info", "ok")
+    assert not router.log("QRCode", "payload")
+    assert [name for name, _, _ in records] == ["info"]
@@ -0,0 +1,105 @@
+"""MihomoManager 热重载与修改配置的测试
+
+替身mihomo进程只保持运行; 替身external-controller在测试进程中监听, 记录 PUT/PATCH /configs
+请求, 按 fail 中的方法返回500, 用于覆盖 PATCH 失败改为 PUT 重载、重载失败改为重启的路径
+"""
+
+import http.server
+import json
+import stat
+import sys
+
+import pytest
+import yaml
+
+from Src.ThirdPartyManager import mihomo
+from Src.ThirdPartyManager.mihomo import MihomoManager
+from Src.config import cfg
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    requests: list = []  # (方法, 请求体)
+    fail: set = set()
+
+    def _reply(self, status: int, body: bytes = b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/version":
+            self._reply(200, b'{"version": "stand-in"}')
+        else:
+            self.send_error(404)
+
+    def _configs(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.requests.append((self.command, json.loads(self.rfile.read(length))))
+        self._reply(500 if self.command in self.fail else 204)
+
+    do_PUT = do_PATCH = _configs
+
+
+@pytest.fixture
+def manager(http_server, tmp_path, monkeypatch):
+    _Handler.requests = []
+    _Handler.fail = set()
+    server = http_server(_Handler)
+
+    monkeypatch.setattr(mihomo, "app_dir_path", tmp_path)
+    monkeypatch.setitem(cfg["proxy"], "watchdog", False)
+    monkeypatch.setitem(cfg["proxy"], "ready_timeout", 5)
+    manager = MihomoManager()
+    manager.work_dir.mkdir(parents=True)
+    manager.mihomo_path.write_text(f"#!{sys.executable}\nimport time\ntime.sleep(60)\n")
+    manager.mihomo_path.chmod(manager.mihomo_path.stat().st_mode | stat.S_IEXEC)
+    manager.config_path.write_text(
+        yaml.safe_dump(
+            {
+                "external-controller": f"127.0.0.1:{server.server_address[1]}",
+                "mode": "rule",
+            }
+        )
+    )
+    manager.start_mihomo()
+    manager.wait_ready(5)
+    yield manager
+    manager.stop_mihomo()
+    manager.controller.close()
+
+
+def test_reload_config_uses_controller(manager):
+    pid = manager.mihomo_process.pid
+
+    assert manager.reload_config()
+
+    assert _Handler.requests == [("PUT", {"path": "", "payload": manager.config.text})]
+    assert manager.mihomo_process.pid == pid
+
+
+@pytest.mark.parametrize(
+    "fail, hot, methods",
+    [
+        (set(), True, ["PATCH"]),
+        ({"PATCH"}, True, ["PATCH", "PUT"]),  # PATCH失败时以完整配置重载
+        ({"PATCH", "PUT"}, False, ["PATCH", "PUT"]),  # 重载也失败时重启mihomo
+    ],
+)
+def test_patch_config_falls_back(manager, fail, hot, methods):
+    _Handler.fail = fail
+    pid = manager.mihomo_process.pid
+
+    assert manager.patch_config({"mode": "global"}) == hot
+
+    assert [method for method, _ in _Handler.requests] == methods
+    assert _Handler.requests[0][1] == {"mode": "global"}
+    # 修改总是写回配置文件, 重载与重启都使用修改后的配置
+    assert yaml.safe_load(manager.config_path.read_text())["mode"] == "global"
+    assert manager.is_running()
+    assert (manager.mihomo_process.pid == pid) == hot
+
+
+def test_patch_config_without_changes_sends_nothing(manager):
+    assert manager.patch_config({"mode": "rule"})
+    assert _Handler.requests == []
@@ -0,0 +1,91 @@
+"""TrafficCollector 的测试
+
+替身external-controller: /traffic 以分块传输逐行推送流量数据(夹杂格式错误的数据)后结束,
+/connections 第一次返回格式错误的列表, 之后返回正常的连接列表
+"""
+
+import http.server
+import json
+import time
+
+import pytest
+
+from Src.ThirdPartyManager.mihomo import TrafficCollector
+
+TRAFFIC = [
+    json.dumps({"up": 10, "down": 20}),
+    "[]",
+    "null",
+    json.dumps({"up": "x", "down": 1}),
+    "not json [/bold]",
+    json.dumps({"up": 1, "down": 2}),
+]
+CONNECTIONS = {
+    "connections": [
+        {"metadata": {"process": "dwrg.exe"}},
+        {"metadata": {"process": "x.exe"}},
+        {"metadata": None},
+    ]
+}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connection_requests = 0
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/traffic":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for line in TRAFFIC:
+                self._send_chunk(line.encode() + b"\n")
+                time.sleep(0.02)
+            self._send_chunk(b"")  # 数据流结束, 采集器应重连
+            return
+        if self.path == "/connections":
+            type(self).connection_requests += 1
+            first = type(self).connection_requests == 1
+            body = json.dumps([] if first else CONNECTIONS).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_error(404)
+
+
+@pytest.fixture
+def controller(http_server):
+    return http_server(_Handler).base_url
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.02)
+
+
+def test_collector_survives_bad_samples_and_reconnects(controller):
+    collector = TrafficCollector(lambda: (controller, {}))
+    collector.start()
+    try:
+        # 每轮数据流中有效的上行字节数为 10 + 1, 两轮说明断开后已重连
+        _wait_for(lambda: sum(b["up"] for b in collector.per_second.snapshot()) >= 22)
+        _wait_for(lambda: any(b["game"] for b in collector.per_minute.snapshot()))
+
+        assert not collector._task.done()
+        assert collector.reconnects >= 1
+        # 每轮4条格式错误的流量数据, 加上一次格式错误的连接列表
+        assert collector.bad_samples >= 2 * 4 + 1
+        bucket = max(collector.per_minute.snapshot(), key=lambda b: b["game"])
+        assert (bucket["connections"], bucket["game"]) == (3, 1)
+    finally:
+        collector.stop()
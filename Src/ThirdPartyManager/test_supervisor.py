@@ -0,0 +1,213 @@
+"""ManagedProcess 停止进程树、读取超长输出行, Watchdog 清理遗留孙进程与 OutputBuffer 的测试
+
+替身进程树: 根进程启动一个普通子进程和一个独立会话(不在进程组内, 相当于Windows上
+无法整体结束)的子进程, 可选再启动一个忽略SIGTERM的子进程; 各进程就绪后输出一行
+"""
+
+import asyncio
+import os
+import sys
+import textwrap
+import threading
+import time
+import tracemalloc
+
+import psutil
+import pytest
+
+from Src.ThirdPartyManager.supervisor import ManagedProcess, OutputBuffer, Watchdog
+
+TREE = textwrap.dedent(
+    r"""
+    import os, signal, subprocess, sys, time
+
+    mode = sys.argv[1]
+    if mode in ("leaf", "stubborn"):
+        if mode == "stubborn":
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        os.write(1, b"child\n")  # 一次写入, 避免与其他进程的输出交错
+        time.sleep(60)
+        sys.exit()
+
+    child = [sys.executable, __file__]
+    kids = [
+        subprocess.Popen(child + ["leaf"]),
+        subprocess.Popen(child + ["leaf"], start_new_session=True),
+    ]
+    if mode == "stubborn-tree":
+        kids.append(subprocess.Popen(child + ["stubborn"]))
+    os.write(1, b"root\n")
+    if mode == "crash":
+        time.sleep(1)  # 留出记录进程树的时间后崩溃
+        sys.exit(3)
+    time.sleep(60)
+    """
+)
+
+
+def _gone(pid: int) -> bool:
+    # 容器中孤儿进程可能不被回收, 僵尸进程视为已退出
+    try:
+        return psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+
+
+class _Tree:
+    """启动替身进程树, 等待全部子进程就绪"""
+
+    def __init__(self, tmp_path, mode: str):
+        script = tmp_path / "tree.py"
+        script.write_text(TREE)
+        self.lines = []
+        self.ready = threading.Event()
+        self.expected = 4 if mode == "stubborn-tree" else 3
+        self.process = ManagedProcess("tree", self._on_line)
+        self.args = [sys.executable, str(script), mode]
+
+    def _on_line(self, line: str):
+        self.lines.append(line)
+        if len(self.lines) >= self.expected:
+            self.ready.set()
+
+    def start(self) -> list[int]:
+        self.process.start(self.args)
+        assert self.ready.wait(10), self.lines
+        descendants = psutil.Process(self.process.pid).children(recursive=True)
+        assert len(descendants) == self.expected - 1
+        return [proc.pid for proc in descendants]
+
+
+def test_stop_kills_whole_tree(tmp_path):
+    tree = _Tree(tmp_path, "tree")
+    pids = tree.start()
+
+    start = time.monotonic()
+    tree.process.stop(timeout=3)
+    elapsed = time.monotonic() - start
+
+    assert not tree.process.is_running()
+    assert all(_gone(pid) for pid in pids)
+    assert elapsed < 2
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Windows上terminate即强制结束")
+def test_stop_escalates_when_child_ignores_sigterm(tmp_path):
+    tree = _Tree(tmp_path, "stubborn-tree")
+    pids = tree.start()
+
+    start = time.monotonic()
+    tree.process.stop(timeout=0.5)
+    elapsed = time.monotonic() - start
+
+    assert all(_gone(pid) for pid in pids)
+    assert 0.5 <= elapsed < 2.5
+
+
+def test_watchdog_kills_leftovers_after_crash(tmp_path):
+    tree = _Tree(tmp_path, "crash")
+    pids = tree.start()
+    restarted = threading.Event()
+
+    def restart():
+        # 重启为不会崩溃的进程树
+        tree.args[-1] = "tree"
+        tree.lines.clear()
+        tree.ready.clear()
+        tree.start()
+        restarted.set()
+
+    watchdog = Watchdog(tree.process, restart, base_delay=0.05)
+    watchdog.arm()
+    try:
+        assert restarted.wait(10)
+        # 崩溃时父进程已退出, 遗留的子进程只能按运行中记录的进程树找到
+        assert all(_gone(pid) for pid in pids)
+        deadline = time.monotonic() + 5
+        while watchdog.stats()["restarts"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert watchdog.stats()["restarts"] == 1
+    finally:
+        watchdog.disarm()
+        tree.process.stop()
+
+
+def test_overlong_line_does_not_stall_reader():
+    # 100 KiB的一行超过读取缓冲区上限, 之后的输出仍应被读取, 子进程不会阻塞在写入上
+    script = "import sys; sys.stdout.write('x' * 102400 + '\\ndone\\n')"
+    lines = []
+    done = threading.Event()
+
+    def on_line(line: str):
+        lines.append(line)
+        if line == "done":
+            done.set()
+
+    process = ManagedProcess("long-line", on_line)
+    process.start([sys.executable, "-c", script])
+    try:
+        assert done.wait(10), [len(line) for line in lines]
+        assert process.supervisor.run(process.wait_exit(), timeout=10) == 0
+    finally:
+        process.stop()
+    assert "".join(lines[:-1]) == "x" * 102400
+
+
+class _RacingBuffer(OutputBuffer):
+    """订阅完成后、stream读取游标前立即追加一条记录, 模拟其他线程的并发追加"""
+
+    def subscribe(self, callback):
+        unsubscribe = super().subscribe(callback)
+        self.append("racer")
+        return unsubscribe
+
+
+@pytest.mark.parametrize("since", [None, 0])
+def test_stream_keeps_line_appended_while_subscribing(since):
+    buffer = _RacingBuffer()
+    buffer.append("old")
+
+    async def first_items():
+        stream = buffer.stream(since)
+        items = [await asyncio.wait_for(anext(stream), 1)]
+        if since is not None:
+            items.append(await asyncio.wait_for(anext(stream), 1))
+        await stream.aclose()
+        return items
+
+    expected = ["racer"] if since is None else ["old", "racer"]
+    assert asyncio.run(first_items()) == expected
+
+
+def test_buffer_memory_stays_flat_while_streaming():
+    buffer = OutputBuffer(capacity=1000)
+    line = "x" * 100
+
+    async def soak(rounds: int, batch: int) -> list[int]:
+        received = 0
+        stream = buffer.stream()
+        # 异步生成器在第一次迭代时才订阅, 先取一条以确认订阅已完成
+        first = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        buffer.append(line)
+        await first
+        sizes = []
+        for _ in range(rounds):
+            for i in range(batch):
+                buffer.append(f"{line}{i}")  # 每条都是新对象
+            for _ in range(batch):
+                await anext(stream)
+                received += 1
+            sizes.append(tracemalloc.get_traced_memory()[0])
+        await stream.aclose()
+        assert received == rounds * batch
+        return sizes
+
+    tracemalloc.start()
+    try:
+        sizes = asyncio.run(soak(rounds=50, batch=2000))
+    finally:
+        tracemalloc.stop()
+    # 缓冲区填满后内存不再随追加的记录数增长: 后40轮追加的8万条记录约8MB,
+    # tracemalloc 也统计其他线程的分配, 只要求增长远小于记录本身的大小
+    assert sizes[-1] - sizes[10] < 1024 * 1024, sizes
@@ -77,6 +77,38 @@ if "proxy" not in cfg:
     warning("配置文件缺少proxy字段，自动添加")
     cfg["proxy"] = {}
 
+if "selective_intercept" not in cfg["proxy"]:
+    warning("配置文件缺少proxy.selective_intercept字段，自动添加")
+    cfg["proxy"]["selective_intercept"] = True
+
+if "intercept_hosts" not in cfg["proxy"]:
+    warning("配置文件缺少proxy.intercept_hosts字段，自动添加")
+    cfg["proxy"]["intercept_hosts"] = ["service.mkey.163.com"]
+
+if "mitmproxy_embedded" not in cfg["proxy"]:
+    warning("配置文件缺少proxy.mitmproxy_embedded字段，自动添加")
+    cfg["proxy"]["mitmproxy_embedded"] = False
+
+if "ready_timeout" not in cfg["proxy"]:
+    warning("配置文件缺少proxy.ready_timeout字段，自动添加")
+    cfg["proxy"]["ready_timeout"] = 15
+
+if "watchdog" not in cfg["proxy"]:
+    warning("配置文件缺少proxy.watchdog字段，自动添加")
+    cfg["proxy"]["watchdog"] = True
+
+if "release_cache_ttl" not in cfg["proxy"]:
+    warning("配置文件缺少proxy.release_cache_ttl字段，自动添加")
+    cfg["proxy"]["release_cache_ttl"] = 3600
+
+if "download_mirrors" not in cfg["proxy"]:
+    warning("配置文件缺少proxy.download_mirrors字段，自动添加")
+    cfg["proxy"]["download_mirrors"] = ["https://github.com"]
+
+if "mirror_min_speed" not in cfg["proxy"]:
+    warning("配置文件缺少proxy.mirror_min_speed字段，自动添加")
+    cfg["proxy"]["mirror_min_speed"] = 256 * 1024
+
 if "certs_path" not in cfg:
     warning("配置文件缺少certs_path字段，自动添加")
     cfg["certs_path"] = {}
@@ -0,0 +1,45 @@
+"""测试配置
+
+Src.init 在导入时会请求管理员权限并在ProgramData下创建应用目录,
+测试中替换为只提供应用目录的模块, 应用目录使用临时目录;
+http_server 夹具在本地启动替身HTTP服务器, 测试结束后关闭
+"""
+
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+import pytest
+
+import Src
+
+_init = types.ModuleType("Src.init")
+_init.app_dir_path = Path(tempfile.mkdtemp(prefix="NetEase_PC_Game_Loginer_"))
+_init.dir_path_prefix = Path(__file__).parent
+sys.modules["Src.init"] = _init
+Src.init = _init
+
+
+@pytest.fixture
+def http_server():
+    """启动替身HTTP服务器的工厂: http_server(handler, **attrs)
+
+    服务器为 proxy_bench.LocalHTTPServer, attrs 设置为服务器的属性, 请求处理类经 self.server 读取;
+    测试中可提前关闭服务器, 测试结束后关闭全部服务器
+    """
+    from Src.Proxy.proxy_bench import LocalHTTPServer
+
+    started = []
+
+    def start(handler, **attrs) -> LocalHTTPServer:
+        server = LocalHTTPServer(handler)
+        for name, value in attrs.items():
+            setattr(server, name, value)
+        server.serve_in_background()
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.close()